@@ -1,71 +1,100 @@
-import graphviz as gv
+from nodes import Visitor
 
-# Définition de la classe AST
+# Rendu graphique de l'AST
 
-def format_str_date(date):
-    # receive a date in datetime format and return a string
-    # Condition to check if the date is not None
-    if date is None:
-        return ""
-    else:
-        return date.strftime("%d/%m/%Y")
+# Identifiant du noeud d'origine du graphique
+ROOT = 'family_tree_AST'
 
-class AST:
-    def __init__(self):
-        self.graph = gv.Digraph(format='svg')
+
+def node_id(*parts):
+    """
+    Retourne l'identifiant DOT d'un noeud à partir de ses parties, séparées par ':'
+    (caractère absent des noms et des dates : deux noeuds différents ne peuvent pas
+    avoir le même identifiant)
+    :param parts:
+    :return:
+    """
+    return ":".join(parts)
+
+
+class ASTRenderer(Visitor):
+    """
+    Passe de rendu de l'AST : chaque instruction visitée est dessinée sur un graphique
+    (un graphviz.Digraph par défaut, ou un dot.DotWriter pour écrire l'AST directement
+    sur le disque). Les dates sont affichées telles qu'écrites dans la source
+    """
+    def __init__(self, graph=None):
+        if graph is None:
+            # graphviz n'est importé que si l'on construit réellement le graphique
+            import graphviz as gv
+            graph = gv.Digraph(format='svg')
+        self.graph = graph
+        # Dates de naissance des personnes déclarées sous chaque nom, dans l'ordre de déclaration :
+        # comme pour TreeBuilder, un lien désigne le premier homonyme déclaré
+        self.birthdates = {}
+        # Première déclaration (celle de la racine de l'arbre)
+        self.racine = None
         # Ajout du noeud "family_tree"
-        self.graph.node('family_tree_AST', label='family_tree_AST')
+        self.graph.node(ROOT, label=ROOT)
 
-    def def_declaration(self,name,bdate,ddate=None, racine=False):
+    def visit_declaration(self, node):
+        name = node.name.value
         # Si la date de décès est inconnue, on ne l'affiche pas
-        if ddate == None:
-            label = name + '\n' + bdate
+        if node.deathdate is None:
+            label = name + '\n' + node.birthdate
         else:
-            label = name + '\n' + bdate + '-' + ddate
-        # Ajout du noeud (on prend le nom + la date de naissance comme identifiant pour avoir une clef unique)
-        self.graph.node(name + bdate, label=label, shape='box')
+            label = name + '\n' + node.birthdate + '-' + node.deathdate
+        # Le nom et la date de naissance forment une clef unique
+        identifier = node_id('declaration', name, node.birthdate)
+        self.graph.node(identifier, label=label, shape='box')
 
-        # Condition si la déclaration concerne la racine de l'arbre
-        if racine:
-            # Ajout de l'arête entre le noeud et l'origine de l'AST
-            self.graph.edge('family_tree_AST', name+bdate, label='racine')
-        else:
-            # Ajout de l'arête entre le noeud et l'origine de l'AST
-            self.graph.edge('family_tree_AST', name+bdate, label='declaration')
+        # La première déclaration est celle de la racine de l'arbre
+        if self.racine is None:
+            self.racine = node
+        self.graph.edge(ROOT, identifier, label='racine' if self.racine is node else 'declaration')
+        self.birthdates.setdefault(name, []).append(node.birthdate)
 
-    def def_marital_link(self, name1, bdate1, name2, bdate2, wedding_date=None):
+    def visit_marital_link(self, node):
+        name1, name2 = node.spouse1.value, node.spouse2.value
         # Ajout du noeud mariage et de l'arête depuis l'origine de l'AST
-        if wedding_date == None:
-            wedding_node = 'marriage' + name1 + name2
+        if node.wedding_date is None:
+            wedding_node = node_id('marriage', name1, name2)
             label_wedding_node = '♥ Mariage ♥'
         else:
-            wedding_node = 'marriage' + name1 + name2 + wedding_date
-            label_wedding_node = '♥ Mariage ♥\n' + wedding_date
+            wedding_node = node_id('marriage', name1, name2, node.wedding_date)
+            label_wedding_node = '♥ Mariage ♥\n' + node.wedding_date
         self.graph.node(wedding_node, label=label_wedding_node, shape='diamond')
-        self.graph.edge('family_tree_AST', wedding_node)
+        self.graph.edge(ROOT, wedding_node)
 
         # Ajout des deux noeuds des personnes + arête depuis le noeud de mariage
-        label1 = 'wedd' + name1 + format_str_date(bdate1)
-        label2 = 'wedd' + name2 + format_str_date(bdate2)
-        self.graph.node(label1, label=name1 + '\n' + format_str_date(bdate1), shape='box')
-        self.graph.node(label2, label=name2 + '\n' + format_str_date(bdate2), shape='box')
-        self.graph.edge(wedding_node, label1)
-        self.graph.edge(wedding_node, label2)
+        self.link_person(wedding_node, 'wedd', name1)
+        self.link_person(wedding_node, 'wedd', name2)
 
-    def def_familial_link(self, parent, bdate_parent, child, bdate_child):
+    def visit_familial_link(self, node):
+        parent, child = node.parent.value, node.child.value
         # Ajout du noeud de lien familial et de l'arête depuis l'origine de l'AST
-        label_familial_node = 'familial' + parent + child
-        self.graph.node(label_familial_node, label='familial_link')
-        self.graph.edge('family_tree_AST', label_familial_node, label='familial_link')
+        familial_node = node_id('familial', parent, child)
+        self.graph.node(familial_node, label='familial_link')
+        self.graph.edge(ROOT, familial_node, label='familial_link')
 
         # Ajout des deux noeuds des personnes + arête depuis le noeud de lien familial
-        label1 = 'fam' + parent + bdate_parent
-        label2 = 'fam' + child + bdate_child
-        self.graph.node(label1, label=parent + '\n' + bdate_parent, shape='box')
-        self.graph.node(label2, label=child + '\n' + bdate_child, shape='box')
-        self.graph.edge(label_familial_node, label1)
-        self.graph.edge(label_familial_node, label2)
+        self.link_person(familial_node, 'fam', parent)
+        self.link_person(familial_node, 'fam', child)
 
+    def link_person(self, link_node, prefix, name):
+        """
+        Ajoute le noeud d'une personne citée par un lien et l'arête depuis le noeud du lien
+        :param link_node:
+        :param prefix:
+        :param name:
+        :return:
+        """
+        homonyms = self.birthdates.get(name)
+        bdate = homonyms[0] if homonyms else ''
+        person_node = node_id(prefix, name, bdate)
+        self.graph.node(person_node, label=name + '\n' + bdate, shape='box')
+        self.graph.edge(link_node, person_node)
 
-    def show_AST(self):
-        self.graph.render('test-output/round-table.gv', view=True)
+    def show_AST(self, view=True):
+        # view=False : le fichier est produit sans ouvrir de visionneuse
+        return self.graph.render('test-output/round-table.gv', view=view)
@@ -1,5 +1,10 @@
 
-import graphviz as gv
+import sys
+from collections import deque
+
+from dot import DotWriter
+from Person import Person
+from treefile import write_tree_file
 
 def format_str_date(date):
     # receive a date in datetime format and return a string
@@ -9,6 +14,10 @@ def format_str_date(date):
     else:
         return date.strftime("%d/%m/%Y")
 
+class FamilyTreeException(Exception):
+    pass
+
+
 class FamilyTree:
     """
     Classe représentant un arbre généalogique
@@ -19,90 +28,159 @@ class FamilyTree:
         """
         self.persons = []
         self.racine = None
+        self.generation_conflicts = []
+        # Index des personnes : nom -> liste des homonymes, (nom, date de naissance) -> personne
+        self.persons_by_name = {}
+        self.persons_by_key = {}
+
+    def write_binary(self, path):
+        """
+        Enregistre l'arbre au format binaire, relisible sans recompilation avec treefile.load_tree_file
+        :param path:
+        :return:
+        """
+        write_tree_file(self, path)
 
-    def get_person(self, name):
+    def add_person(self, person):
+        """
+        Enregistre une personne dans l'arbre et dans ses index
+        :param person:
+        :return:
+        """
+        key = (person.name, person.birthdate)
+        if key in self.persons_by_key:
+            raise FamilyTreeException(
+                f"{person.name} né le {format_str_date(person.birthdate)} est déjà déclaré"
+            )
+        self.persons.append(person)
+        self.persons_by_key[key] = person
+        self.persons_by_name.setdefault(person.name, []).append(person)
+
+    def remove_person(self, person):
         """
-        Retourne la personne dont le nom est passé en paramètre
+        Retire une personne de l'arbre et de ses index (ses liens ne sont pas modifiés)
+        :param person:
+        :return:
+        """
+        self.persons.remove(person)
+        del self.persons_by_key[(person.name, person.birthdate)]
+        homonyms = self.persons_by_name[person.name]
+        homonyms.remove(person)
+        if not homonyms:
+            del self.persons_by_name[person.name]
+        if self.racine is person:
+            self.racine = self.persons[0] if self.persons else None
+
+    def get_person(self, name, birthdate=None):
+        """
+        Retourne la personne dont le nom (et éventuellement la date de naissance,
+        pour distinguer les homonymes) est passé en paramètre
         :param name:
+        :param birthdate:
         :return:
         """
-        for person in self.persons:
-            if person.name == name:
-                return person
-        return None
+        if birthdate is not None:
+            person = self.persons_by_key.get((name, birthdate))
+            if person is None:
+                raise FamilyTreeException(
+                    f"{name} né le {format_str_date(birthdate)} n'est pas déclaré"
+                )
+            return person
+        homonyms = self.persons_by_name.get(name)
+        if homonyms is None:
+            raise FamilyTreeException(f"{name} n'est pas déclaré")
+        if len(homonyms) > 1:
+            raise FamilyTreeException(
+                f"{name} est ambigu ({len(homonyms)} personnes portent ce nom)"
+            )
+        return homonyms[0]
 
     def __str__(self):
         """
         Retourne une description de l'arbre généalogique
         :return:
         """
-        desc = ""
-        for person in self.persons:
-            desc += str(person) + "\n"
-        return desc
+        return "".join(str(person) + "\n" for person in self.persons)
 
-    def print_frise(self):
+    def get_events(self, start=None, end=None):
         """
-        Affiche la frise chronologique correspondante à l'arbre
+        Retourne la liste des évènements (date, description) triée par date, éventuellement
+        restreinte aux dates comprises entre start et end (incluses) : seuls les évènements
+        de la fenêtre sont triés. À date égale, l'ordre de déclaration des personnes est conservé
+        :param start:
+        :param end:
         :return:
         """
-        # Lister tous les évènements
-        events = {}
+        events = []
+        # Couples dont le mariage a déjà été ajouté (mariage de A et B, mariage de B et A)
+        weddings_added = set()
         for person in self.persons:
             # Ajout de la naissance
-            if person.birthdate not in events.keys():  # Premier ajout de la date
-                events[person.birthdate] = ["Naissance de " + person.name + "."]
-            else:
-                events[person.birthdate].append("Naissance de " + person.name + ".")
+            events.append((person.birthdate, "Naissance de " + person.name + "."))
             # Ajout de la mort
             if person.deathdate is not None:
-                if person.deathdate not in events.keys():
-                    events[person.deathdate] = ["† Décès de " + person.name + "."]
-                else:
-                    events[person.deathdate].append("† Décès de " + person.name + ".")
+                events.append((person.deathdate, "† Décès de " + person.name + "."))
             # Ajout du mariage
-            if person.spouse is not None:
-                if person.wedding_date is not None:
-                    if person.wedding_date not in events.keys():
-                        events[person.wedding_date] = ["♥ Mariage de " + person.name + " et " + person.spouse.name + "."]
-                    else:
-                        # Retirer les doublons (mariage de A et B, mariage de B et A)
-                        if "♥ Mariage de " + person.spouse.name + " et " + person.name + "." not in events[person.wedding_date]:
-                            events[person.wedding_date].append("♥ Mariage de " + person.name + " et " + person.spouse.name + ".")
-
-
-        # Affichage de la frise
-
-        print("###############################\n##### Frise chronologique #####\n###############################\n")
-        if self.racine.name[0] in ['A', 'E', 'I', 'O', 'U', 'Y']:
-            title_label = f"Arbre généalogique d'{self.racine.name}"
-        else:
-            title_label = f"Arbre généalogique de {self.racine.name}"
-        print(title_label + ".\n")
-
+            if person.spouse is not None and person.wedding_date is not None:
+                wedding = (frozenset((id(person), id(person.spouse))), person.wedding_date)
+                if wedding not in weddings_added:
+                    weddings_added.add(wedding)
+                    events.append((person.wedding_date, "♥ Mariage de " + person.name + " et " + person.spouse.name + "."))
+        if start is not None or end is not None:
+            events = [event for event in events
+                      if (start is None or event[0] >= start) and (end is None or event[0] <= end)]
+        # Le tri est stable : l'ordre d'ajout est conservé pour une même date
+        events.sort(key=lambda event: event[0])
+        return events
+
+    def iter_frise(self, start=None, end=None):
+        """
+        Génère les lignes (terminées par un retour à la ligne) de la frise chronologique
+        correspondante à l'arbre, éventuellement restreinte aux dates comprises entre start et end
+        :param start:
+        :param end:
+        :return:
+        """
+        yield "###############################\n##### Frise chronologique #####\n###############################\n\n"
+        yield self.get_title() + ".\n\n"
+
+        # siècles et décades déjà affichés
+        decades = set()
+        previous_date = None
+        for date, event in self.get_events(start, end):
+            # Les autres évènements d'une même date sont affichés en dessous du premier
+            if date == previous_date:
+                yield f"------------ {event}\n"
+                continue
+            previous_date = date
 
-        # liste contenant les décades déjà affichées
-        decades = []
-        for date in sorted(events.keys()):
             # Affichage des siècles :
             # Récupération du siècle
             century = date.year // 100
             if century not in decades:
-                decades.append(century)
+                decades.add(century)
                 # Affichage du siècle sur 3 lignes
-                print(f"\n###########################\n####### {century}è siècle  #######\n###########################\n")
+                yield f"\n###########################\n####### {century}è siècle  #######\n###########################\n\n"
 
             # Affichage des decades (sauf celles correspondant aux siècles):
             if date.year % 10 == 0 and date.year not in decades:
-                decades.append(date.year)
-                print(f"\n========== {date.year} ==========\n")
+                decades.add(date.year)
+                yield f"\n========== {date.year} ==========\n\n"
             # Affichage de la date et du premier évènement
-            print(f"{format_str_date(date)} : {events[date][0]}")
-
-            # Affichage des autres évènements
-            for event in events[date][1:]:
-                print(f"------------ {event}")
+            yield f"{format_str_date(date)} : {event}\n"
 
+    def print_frise(self, file=None, start=None, end=None):
+        """
+        Affiche la frise chronologique correspondante à l'arbre (sur la sortie standard
+        ou dans le fichier passé en paramètre), éventuellement restreinte aux dates comprises
+        entre start et end
+        :param file:
+        :param start:
+        :param end:
+        :return:
+        """
+        output = sys.stdout if file is None else file
+        output.writelines(self.iter_frise(start, end))
 
     def get_dict_gen(self):
         """
@@ -113,11 +191,7 @@ class FamilyTree:
         # on boucle sur toutes les personnes et on constitue le dictionnaire
         dict_gen = {}
         for person in self.persons:
-            # Si la génération a déjà été ajoutée
-            if person.gen in dict_gen.keys():
-                dict_gen[person.gen].append(person)
-            else:
-                dict_gen[person.gen] = [person]
+            dict_gen.setdefault(person.gen, []).append(person)
         return dict_gen
 
     def get_person_without_generation(self):
@@ -134,6 +208,70 @@ class FamilyTree:
                 persons_without_generation.append(person)
         return persons_without_generation
 
+    def check_no_cycle(self):
+        """
+        Vérifie que les liens de filiation ne forment pas de cycle (personne ancêtre d'elle-même)
+        par un tri topologique : chaque personne et chaque lien sont visités une seule fois
+        :return:
+        """
+        # Nombre de liens parent -> enfant entrant pour chaque personne
+        in_degree = {person: 0 for person in self.persons}
+        for person in self.persons:
+            for child in person.children:
+                in_degree[child] += 1
+        # On retire successivement les personnes dont tous les parents ont été retirés
+        queue = deque(person for person, degree in in_degree.items() if degree == 0)
+        n_removed = 0
+        while queue:
+            person = queue.popleft()
+            n_removed += 1
+            for child in person.children:
+                in_degree[child] -= 1
+                if in_degree[child] == 0:
+                    queue.append(child)
+        # Les personnes restantes appartiennent à un cycle
+        if n_removed < len(self.persons):
+            in_cycle = [person.name for person, degree in in_degree.items() if degree > 0]
+            raise FamilyTreeException(
+                f"Les liens de filiation forment un cycle (personnes concernées : {', '.join(in_cycle)})"
+            )
+
+    def define_generations(self):
+        """
+        Définit la génération de chaque personne reliée à la racine par un parcours en largeur
+        qui visite chaque personne une seule fois : la racine est à la génération 0, les parents
+        à +1, les enfants à -1 et les conjoints à la même génération.
+        Lève une FamilyTreeException si les liens de filiation forment un cycle.
+        Retourne la liste des conflits (personne, génération retenue, génération incompatible),
+        qui apparaissent en cas d'implexe (ancêtres communs à des générations différentes)
+        :return:
+        """
+        self.check_no_cycle()
+        for person in self.persons:
+            person.gen = None
+        conflicts = {}
+        if self.racine is not None:
+            self.racine.gen = 0
+            queue = deque([self.racine])
+            done = set()
+            while queue:
+                person = queue.popleft()
+                done.add(person)
+                # Voisins de la personne avec la génération qu'ils devraient avoir
+                neighbours = [(parent, person.gen + 1) for parent in person.parents if parent is not None]
+                neighbours += [(child, person.gen - 1) for child in person.children]
+                if person.spouse is not None:
+                    neighbours.append((person.spouse, person.gen))
+                for neighbour, gen in neighbours:
+                    if neighbour.gen is None:
+                        neighbour.gen = gen
+                        queue.append(neighbour)
+                    elif neighbour.gen != gen and neighbour in done:
+                        # Chaque lien est examiné des deux côtés : on ne le signale qu'une fois
+                        conflicts[(person, neighbour)] = (person, person.gen, neighbour.gen - (gen - person.gen))
+        self.generation_conflicts = list(conflicts.values())
+        return self.generation_conflicts
+
     def print_gen(self):
         """
         Affiche les générations de chacun
@@ -146,105 +284,204 @@ class FamilyTree:
             for person in dict_gen[gen]:
                 print(f"    {person.name}")
 
-    def print_tree(self):
+    def get_title(self):
         """
-        Affiche l'arbre généalogique sous la forme d'un graphique
+        Retourne le titre de l'arbre selon la première lettre du prénom de la racine
         :return:
         """
+        # Un bloc family_tree sans déclaration n'a pas de racine
+        if self.racine is None:
+            return "Arbre généalogique vide"
+        if self.racine.name[0] in ['A', 'E', 'I', 'O', 'U', 'Y']:
+            return f"Arbre généalogique d'{self.racine.name}"
+        else:
+            return f"Arbre généalogique de {self.racine.name}"
+
+    def get_window(self, persons, up=2, down=2):
+        """
+        Retourne les personnes de la fenêtre centrée sur une ou plusieurs personnes (un ensemble
+        de lignées) : leurs ancêtres jusqu'à up générations au-dessus, leurs descendants jusqu'à
+        down générations en dessous, et les conjoints de chacun. Seuls les liens de filiation des
+        personnes de la fenêtre sont parcourus : le coût dépend de la taille de la fenêtre, pas
+        de celle de l'arbre
+        :param persons: personne(s) au centre de la fenêtre
+        :param up:
+        :param down:
+        :return: la liste des personnes, dans l'ordre du parcours
+        """
+        if isinstance(persons, Person):
+            persons = [persons]
+        window = dict.fromkeys(persons)
+        for links, depth in (("parents", up), ("children", down)):
+            # Chaque sens est parcouru séparément : une personne déjà atteinte dans l'autre
+            # sens (lignées imbriquées) est tout de même développée
+            seen = set(persons)
+            frontier = list(persons)
+            for _ in range(depth):
+                next_frontier = []
+                for person in frontier:
+                    for relative in getattr(person, links):
+                        if relative is not None and relative not in seen:
+                            seen.add(relative)
+                            next_frontier.append(relative)
+                window.update(dict.fromkeys(next_frontier))
+                frontier = next_frontier
+        # Les conjoints sont ajoutés sans parcourir leur propre famille
+        for person in list(window):
+            if person.spouse is not None and person.spouse not in window:
+                window[person.spouse] = None
+        return list(window)
+
+    def iter_pages(self, page_size):
+        """
+        Découpe les personnes reliées à la racine en pages d'au plus page_size personnes,
+        dans l'ordre d'un parcours en largeur depuis la racine : les personnes proches
+        (conjoints, parents, enfants) se retrouvent le plus souvent sur la même page
+        :param page_size:
+        :return: un itérateur sur les listes de personnes de chaque page
+        """
+        if self.racine is None:
+            return
+        page = []
+        queue = deque([self.racine])
+        done = {self.racine}
+        while queue:
+            person = queue.popleft()
+            page.append(person)
+            if len(page) == page_size:
+                yield page
+                page = []
+            # Le conjoint passe en tête de file pour rester à côté de la personne
+            if person.spouse is not None and person.spouse not in done:
+                done.add(person.spouse)
+                queue.appendleft(person.spouse)
+            for relative in person.parents + person.children:
+                if relative is not None and relative not in done:
+                    done.add(relative)
+                    queue.append(relative)
+        if page:
+            yield page
+
+    def print_tree(self, view=True, persons=None):
+        """
+        Affiche l'arbre généalogique sous la forme d'un graphique
+        :param view: si False, le rendu est produit sans ouvrir de visionneuse
+        :param persons: personnes à afficher (par exemple une fenêtre de get_window), toutes par défaut
+        :return: le chemin du rendu
+        """
+        # graphviz n'est importé que pour le rendu
+        import graphviz as gv
+
         # Créer un nouveau graphique
         graph = gv.Graph(format='png')
+        self.emit_tree(graph, persons)
 
-        # Ajouter un titre en haut du graphique selon la première lettre du prénom
-        if self.racine.name[0] in ['A', 'E', 'I', 'O', 'U', 'Y']:
-            title_label = f"Arbre généalogique d'{self.racine.name}"
-        else:
-            title_label = f"Arbre généalogique de {self.racine.name}"
-        graph.attr(label=title_label, labelloc='t', labeljust='c', fontsize='20', fontcolor='blue')
+        # Afficher le graphique
+        return graph.render('tree', view=view)
 
-        # On détermine la génération des personnes de l'arbre
+    def write_tree(self, output, persons=None):
+        """
+        Écrit l'arbre généalogique au format DOT au fur et à mesure du parcours,
+        sans construire le graphique en mémoire ni lancer de visionneuse
+        :param output: chemin du fichier .gv ou flux texte
+        :param persons: personnes à écrire, toutes par défaut
+        :return:
+        """
+        with DotWriter(output) as graph:
+            self.emit_tree(graph, persons)
 
-        # Créer un dictionnaire contenant la profondeur = génération de chaque personne par parcours de graphe
-        dict_successeurs = {}
-        # On boucle sur toutes les personnes et on constitue le dictionnaire
-        for person in self.persons:
-            # On regarde s'il a des successeurs, i.e. des enfants
-            if len(person.children) > 0:
-                # On ajoute la personne dans le dictionnaire avec comme valeur la liste des enfants
-                dict_successeurs[person] = person.children
+    def write_pages(self, prefix, page_size):
+        """
+        Écrit l'arbre généalogique en une série de fichiers DOT d'au plus page_size personnes
+        (prefix-0000.gv, prefix-0001.gv...), chacun assez petit pour être mis en page.
+        Les liens entre deux pages ne sont pas tracés
+        :param prefix:
+        :param page_size:
+        :return: les chemins des fichiers écrits
+        """
+        paths = []
+        for number, page in enumerate(self.iter_pages(page_size)):
+            path = f"{prefix}-{number:04d}.gv"
+            with DotWriter(path) as graph:
+                self.emit_tree(graph, page, f"{self.get_title()} (page {number + 1})")
+            paths.append(path)
+        return paths
+
+    def emit_tree(self, graph, persons=None, title=None):
+        """
+        Ajoute les noeuds et les arêtes de l'arbre généalogique au graphique passé en paramètre
+        (tout objet proposant les méthodes attr, node et edge de graphviz).
+        Chaque personne, couple et lien de filiation n'est émis qu'une fois, en un seul parcours
+        des générations.
+        Si persons est donné, seules ces personnes et les liens entre elles sont émis, sans
+        parcourir le reste de l'arbre
+        :param graph:
+        :param persons:
+        :param title: titre du graphique (par défaut, celui de l'arbre)
+        :return:
+        """
+        # Ajouter un titre en haut du graphique
+        graph.attr(label=self.get_title() if title is None else title,
+                   labelloc='t', labeljust='c', fontsize='20', fontcolor='blue')
 
-        # On définit la génération pour chaque personne du graphe
-        # Pour la racine, on définit la génération à 0
-        self.racine.gen = 0
-        # On définit la génération pour tous les parents de manière récursive
-        define_parents_generation(self.racine, 1)
+        if persons is not None:
+            self.emit_persons(graph, persons, set(persons))
+            return
+
+        # On définit la génération pour chaque personne du graphe (racine : 0)
+        self.define_generations()
 
         #self.print_gen() A décommenter pour afficher les générations de chacun
 
         # On trace le graph
         # On boucle sur toutes les personnes par génération et on ajoute les noeuds
         dict_gen = self.get_dict_gen()
-        couples_edges_added = [] # liste des couples dont l'arête a déjà été ajoutée
-        child_edges_added = [] # liste des enfants dont l'arête a déjà été ajoutée avec leur parent
-
-        n_generations = len(dict_gen.keys())
-
-        for gen in range(n_generations):
-            # On ajoute les noeuds
-            for person in dict_gen[gen]:
-                # Ajouter un noeud pour chaque personne
-                # Ajout du noeud de la personne avec ses dates de naissance et de mort
-                color = "black"
-                # Pour la racine, on met en rouge
-                if person == self.racine:
-                    color = "red"
-
-                if person.deathdate is not None:
-                    graph.node(person.name,label=person.name + "\n" + format_str_date(person.birthdate) + " - " + format_str_date(person.deathdate) + "†", color = color, shape="box")
-                else:  # Si la personne est toujours en vie
-                    graph.node(person.name, label=person.name + "\n" + format_str_date(person.birthdate) + " - ", color = color, shape="box")
-
-                # Ajout des arêtes pour les couples en rose entre les nœuds de mariage et les personnes mariées
-                if person.spouse is not None :
-                    couple_name = person.get_couple_names()
-                    if couple_name not in couples_edges_added:
-                        # Création du noeud de mariage
-                        graph.node(couple_name, label="♥ " + format_str_date(person.wedding_date) + " ♥", shape="diamond", color="pink")
-                        # Ajout des arêtes entre le noeud de mariage et les personnes du couple
-                        graph.edge(person.name, couple_name, color="pink", splines="curved")
-                        graph.edge(person.spouse.name, couple_name, color="pink", splines="curved")
-                        couples_edges_added.append(couple_name)
-
-                # Ajouter une arête pour chaque enfant
-                for child in person.children:
-                    if child not in child_edges_added:
-                        graph.edge(couple_name, child.name, splines="curved")
-                        child_edges_added.append(child)
-
-
-        # Afficher le graphique
-        graph.render('tree', view=True)
 
+        # Les personnes sans lien avec la racine (génération None) ne sont pas tracées
+        generations = sorted(gen for gen in dict_gen.keys() if gen is not None)
+        self.emit_persons(graph, (person for gen in generations for person in dict_gen[gen]))
 
+    def emit_persons(self, graph, persons, included=None):
+        """
+        Ajoute au graphique les noeuds des personnes, de leurs couples et de leurs liens de filiation
+        :param graph:
+        :param persons:
+        :param included: si donné, les conjoints et enfants absents de cet ensemble sont ignorés
+        :return:
+        """
+        couples_edges_added = set() # couples dont l'arête a déjà été ajoutée
+        child_edges_added = set() # enfants dont l'arête a déjà été ajoutée avec leur parent
 
-def define_parents_generation(enfant,generation_depuis_racine):
-    """
-    Définit la génération des parents d'un enfant de manière récursive
-    :param enfant:
-    :param generation_depuis_racine:
-    :return:
-    """
-
-    # Tant qu'il y a des parents (cas d'arrêt)
-    if len(enfant.parents) > 0:
-        # On définit la génération des parents
-        for parent in enfant.parents:
-            parent.gen = generation_depuis_racine
-
-            #On complète pour les frères et soeurs qui n'auraient pas de génération définie
-            for child in parent.children:
-                if child.gen is None:
-                    child.gen = generation_depuis_racine - 1
+        for person in persons:
+            # Ajouter un noeud pour chaque personne
+            # Ajout du noeud de la personne avec ses dates de naissance et de mort
+            color = "black"
+            # Pour la racine, on met en rouge
+            if person == self.racine:
+                color = "red"
 
-        # On appelle la fonction pour les parents
-        for parent in enfant.parents:
-            define_parents_generation(parent, generation_depuis_racine + 1)
+            if person.deathdate is not None:
+                graph.node(person.name,label=person.name + "\n" + format_str_date(person.birthdate) + " - " + format_str_date(person.deathdate) + "†", color = color, shape="box")
+            else:  # Si la personne est toujours en vie
+                graph.node(person.name, label=person.name + "\n" + format_str_date(person.birthdate) + " - ", color = color, shape="box")
+
+            # Ajout des arêtes pour les couples en rose entre les nœuds de mariage et les personnes mariées
+            if person.spouse is not None and (included is None or person.spouse in included):
+                # Les enfants sont reliés au noeud de mariage
+                parent_node = person.get_couple_names()
+                if parent_node not in couples_edges_added:
+                    # Création du noeud de mariage
+                    graph.node(parent_node, label="♥ " + format_str_date(person.wedding_date) + " ♥", shape="diamond", color="pink")
+                    # Ajout des arêtes entre le noeud de mariage et les personnes du couple
+                    graph.edge(person.name, parent_node, color="pink", splines="curved")
+                    graph.edge(person.spouse.name, parent_node, color="pink", splines="curved")
+                    couples_edges_added.add(parent_node)
+            else:
+                # Sans conjoint, les enfants sont reliés directement à la personne
+                parent_node = person.name
+
+            # Ajouter une arête pour chaque enfant
+            for child in person.children:
+                if child not in child_edges_added and (included is None or child in included):
+                    graph.edge(parent_node, child.name, splines="curved")
+                    child_edges_added.add(child)
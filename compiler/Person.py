@@ -1,8 +1,10 @@
-from datetime import datetime
+from datetime import date
+
+from dates import parse_date
 
 def format_str_date(date):
     """
-    receive a date in datetime format and return a string
+    receive a date in date format and return a string
     :param date:
     :return:
     """
@@ -13,43 +15,52 @@ def format_str_date(date):
     else:
         return date.strftime("%d/%m/%Y")
 
+def to_date(value):
+    """
+    receive a date as a string (or already converted) and return it in date format
+    :param value:
+    :return:
+    """
+    if value is None or isinstance(value, date):
+        return value
+    return parse_date(value)
+
 class Person:
+    # Pas de __dict__ par personne : les attributs sont stockés dans des slots
+    __slots__ = ("name", "birthdate", "deathdate", "spouse", "wedding_date",
+                 "parents", "children", "gen")
+
     def __init__(self, f_tree, identifier, bdate, ddate):
         """
         Initialisation d'une personne à partir de l'arbre généalogique auquel elle appartient,
         de son nom, de sa date de naissance et, éventuellement, de sa date de décès
         """
         self.name = identifier
-        # enregistrer la date de naissance au format datetime
-        if bdate is not None:
-            self.birthdate = datetime.strptime(bdate, "%d/%m/%Y")
-        # enregistrer la date de décès au format datetime
-        if ddate is not None:
-            self.deathdate = datetime.strptime(ddate, "%d/%m/%Y")
-        else:
-            self.deathdate = None
+        # enregistrer les dates de naissance et de décès au format date
+        self.birthdate = to_date(bdate)
+        self.deathdate = to_date(ddate)
         self.spouse = None
         self.wedding_date = None
         self.parents = []
         self.children = []
         self.gen = None
-        f_tree.persons.append(self)
+        f_tree.add_person(self)
 
     def __str__(self):
         """
         Retourne une description de la personne
         :return:
         """
-        desc = str(f"{self.name} né le {format_str_date(self.birthdate)}")
+        desc = [f"{self.name} né le {format_str_date(self.birthdate)}"]
         if not self.deathdate is None:
-            desc += str(f" mort le {format_str_date(self.deathdate)}")
+            desc.append(f" mort le {format_str_date(self.deathdate)}")
         if not self.spouse is None:
-            desc += str(f" marié à {self.spouse.name}")
+            desc.append(f" marié à {self.spouse.name}")
         # si la liste des parents n'est pas vide
         if self.parents!=[]:
-          desc += str(f" enfant de {self.get_parents_name()}")
-        desc += ".\n"
-        return desc
+            desc.append(f" enfant de {self.get_parents_name()}")
+        desc.append(".\n")
+        return "".join(desc)
 
     def get_parents_name(self):
         """
@@ -86,8 +97,8 @@ class Person:
         spouse.spouse = self
         # On met à jour les dates de mariage
         if wdate is not None:
-            self.wedding_date = datetime.strptime(wdate, "%d/%m/%Y")
-            spouse.wedding_date = datetime.strptime(wdate, "%d/%m/%Y")
+            self.wedding_date = to_date(wdate)
+            spouse.wedding_date = self.wedding_date
         # Sinon, pas besoin, par défaut None lors de l'initialisation
 
     def define_familial_link(self, child):
@@ -97,10 +108,11 @@ class Person:
         :return:
         """
         self.children.append(child)
+        child.parents.append(self)
+        # Un parent sans conjoint ne laisse pas de place vide (None) dans la liste des parents
         if self.spouse is not None:
             self.spouse.children.append(child)
-        child.parents.append(self)
-        child.parents.append(self.spouse)
+            child.parents.append(self.spouse)
 
 
 
@@ -1,28 +1,310 @@
 # -*- encoding: utf-8 -*-
 
+import argparse
+import os
 import sys
+import time
 
-from lexer import Lexer
+from lexer import Lexer, ENGINES
 from p4rser import Parser
-import p4rser
+from FamilyTree import FamilyTreeException
+from diagnostics import Diagnostics, DEFAULT_MAX_ERRORS
+from instrument import Instrumentation, NULL_INSTRUMENTATION, write_report
+from validation import validate_columns
 
-if __name__ == "__main__":
-    lexer = Lexer()
-    filename = "../examples/test.txt"
-    with open(filename) as file:
-        content = file.readlines()
+# Sorties possibles du mode batch (batch.OUTPUTS) : le module batch, qui charge
+# concurrent.futures et le cache, n'est importé qu'en mode batch
+BATCH_OUTPUTS = ("frise", "tree", "ast")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compilateur d'arbres généalogiques")
+    parser.add_argument("filename", nargs="?", default="../examples/test.txt",
+                        help="fichier à compiler (par défaut ../examples/test.txt)")
+    parser.add_argument("--engine", choices=ENGINES, default="master",
+                        help="moteur du lexer")
+    parser.add_argument("--headless", action="store_true",
+                        help="produit les rendus sans ouvrir de visionneuse")
+    parser.add_argument("--check", action="store_true",
+                        help="vérifie seulement le fichier (lexing, parsing et cohérence de l'arbre), "
+                             "sans construire l'AST ni produire de rendu")
+    parser.add_argument("--lex-workers", type=int, default=1,
+                        help="nombre de processus du lexing (au-delà de 1, les gros fichiers sont "
+                             "découpés en blocs de lignes lexés en parallèle)")
+    parser.add_argument("--max-errors", type=int, default=DEFAULT_MAX_ERRORS,
+                        help="nombre d'erreurs signalées avant d'interrompre la compilation "
+                             f"(défaut : {DEFAULT_MAX_ERRORS}, 0 : pas de limite)")
+    parser.add_argument("--center", metavar="NOM[,NOM...]", default=None,
+                        help="n'affiche de l'arbre que la fenêtre autour de ces personnes "
+                             "(leurs lignées sur --up et --down générations)")
+    parser.add_argument("--up", type=int, default=2,
+                        help="générations d'ancêtres affichées avec --center (défaut : 2)")
+    parser.add_argument("--down", type=int, default=2,
+                        help="générations de descendants affichées avec --center (défaut : 2)")
+    parser.add_argument("--page-size", type=int, default=None,
+                        help="écrit l'arbre en une série de fichiers DOT tree-page-NNNN.gv "
+                             "d'au plus PAGE_SIZE personnes, sans mise en page")
+    parser.add_argument("--kinship", metavar="NOM1,NOM2", default=None,
+                        help="affiche la parenté entre deux personnes (lignée directe, ancêtres communs "
+                             "les plus proches, degré de cousinage), sans produire de rendu")
+    parser.add_argument("--merge", metavar="FICHIER", nargs="*", default=None,
+                        help="fusionne tous les arbres du fichier et des fichiers donnés "
+                             "(personnes confondues par nom et date de naissance)")
+    parser.add_argument("--batch", metavar="DOSSIER_OU_MOTIF",
+                        help="compile tous les .txt d'un dossier ou les fichiers d'un motif glob")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="nombre de processus du mode batch (par défaut, le nombre de coeurs)")
+    parser.add_argument("--out-dir", default="batch-output",
+                        help="dossier des sorties du mode batch")
+    parser.add_argument("--outputs", default=",".join(BATCH_OUTPUTS),
+                        help="sorties du mode batch, parmi : " + ",".join(BATCH_OUTPUTS))
+    parser.add_argument("--cache-dir", default=None,
+                        help="dossier du cache de compilation du mode batch (désactivé par défaut)")
+    parser.add_argument("--cache-size", type=int, default=256,
+                        help="taille maximale du cache, en Mo")
+    parser.add_argument("--profile", metavar="RAPPORT", nargs="?", const="-", default=None,
+                        help="mesure chaque phase et écrit le rapport JSON dans RAPPORT "
+                             "(sur la sortie d'erreur par défaut)")
+    parser.add_argument("--profile-functions", action="store_true",
+                        help="ajoute au rapport le profil des fonctions (cProfile)")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="ajoute au rapport le pic mémoire de chaque phase (tracemalloc)")
+    args = parser.parse_args(argv)
+    if args.center is not None and args.page_size:
+        parser.error("--center et --page-size ne peuvent pas être utilisés ensemble "
+                     "(la pagination porte sur tout l'arbre)")
+    return args
+
+
+def main_batch(args):
+    import batch
 
-    Lexems = lexer.lex(content)
-    print(Lexems)
-    p4rser = Parser(Lexems)
+    outputs = [output for output in args.outputs.split(",") if output]
+    unknown = set(outputs) - set(batch.OUTPUTS)
+    if unknown:
+        sys.exit(f"Sorties inconnues : {', '.join(sorted(unknown))}")
+    paths = batch.find_inputs(args.batch)
+    if not paths:
+        sys.exit(f"Aucun fichier trouvé pour {args.batch}")
+    start = time.perf_counter()
+    results = batch.run_batch(paths, args.out_dir, outputs, args.workers,
+                              args.cache_dir, args.cache_size * 2 ** 20, args.engine)
+    print(batch.format_summary(results, time.perf_counter() - start))
+    return 0 if all(result["ok"] for result in results) else 1
 
-    ftree, ast = p4rser.parse()
+
+def parse_file(filename, engine, build_ast, instrumentation, diagnostics, lex_workers=1, keep_columns=False):
+    """
+    Lexe et parse un fichier en relevant toutes ses erreurs dans diagnostics.
+    Retourne l'arbre généalogique, l'AST et le parser, ou None (après avoir affiché
+    les erreurs sur la sortie d'erreur) si le fichier contient des erreurs
+    :param filename:
+    :param engine:
+    :param build_ast:
+    :param instrumentation:
+    :param diagnostics:
+    :param lex_workers: nombre de processus du lexing
+    :param keep_columns: le parser tient à jour les colonnes de l'arbre (Parser.columns)
+    :return:
+    """
+    lexer = Lexer(engine=engine, diagnostics=diagnostics)
+    if lex_workers > 1:
+        lexems = lexer.iter_lex_file_parallel(filename, lex_workers)
+    else:
+        lexems = lexer.iter_lex_file(filename)
+
+    # Le parser consomme directement le flux de lexèmes : le temps de lexing est
+    # mesuré à chaque lexème produit et exclu de celui du parsing
+    lexems = instrumentation.iter_phase("lex", "tokens", lexems)
+    p4rser = Parser(lexems, build_ast=build_ast, diagnostics=diagnostics, keep_columns=keep_columns)
+    with instrumentation.phase("parse"):
+        ftree, ast = p4rser.parse()
+    instrumentation.count("statements", p4rser.statements)
+    instrumentation.count("lookups", p4rser.lookups)
+    instrumentation.count("persons", len(ftree.persons))
+    instrumentation.count("errors", len(diagnostics))
+    for warning in diagnostics.warnings:
+        print(warning, file=sys.stderr)
+    if diagnostics:
+        print(diagnostics.format(), file=sys.stderr)
+        return None
+    return ftree, ast, p4rser
+
+
+def compile_and_show(filename, engine="master", headless=False, instrumentation=NULL_INSTRUMENTATION,
+                     diagnostics=None, lex_workers=1, center=None, up=2, down=2, page_size=None):
+    """
+    Compile un fichier puis affiche la frise, l'arbre généalogique et l'AST (sauf pour une fenêtre
+    autour de center : l'AST, qui porte sur tout le fichier, n'est alors ni construit ni rendu).
+    Chaque phase est mesurée par instrumentation (sans effet si elle est désactivée).
+    Retourne l'arbre généalogique et l'AST, ou None si le fichier contient des erreurs
+    :param filename:
+    :param engine:
+    :param headless:
+    :param instrumentation:
+    :param diagnostics: collecteur des erreurs (par défaut, limite de DEFAULT_MAX_ERRORS)
+    :param lex_workers: nombre de processus du lexing
+    :param center: noms des personnes au centre de la fenêtre affichée (None : tout l'arbre),
+    incompatible avec page_size
+    :param up: générations d'ancêtres de la fenêtre
+    :param down: générations de descendants de la fenêtre
+    :param page_size: si donné, l'arbre est écrit en pages DOT d'au plus page_size personnes
+    :return:
+    """
+    if center is not None and page_size:
+        raise ValueError("Une fenêtre (center) ne peut pas être écrite en pages (page_size)")
+    parsed = parse_file(filename, engine, center is None, instrumentation,
+                        Diagnostics() if diagnostics is None else diagnostics, lex_workers)
+    if parsed is None:
+        return None
+    ftree, ast, _ = parsed
+    persons = None
+    if center is not None:
+        try:
+            persons = ftree.get_window([ftree.get_person(name) for name in center], up, down)
+        except FamilyTreeException as err:
+            print(err, file=sys.stderr)
+            return None
 
     # Affichage de la frise, de l'arbre généalogique et de l'AST
-    ftree.print_frise()
-    ftree.print_tree()
-    ast.show_AST()
+    with instrumentation.phase("frise"):
+        ftree.print_frise(instrumentation.wrap_stream(sys.stdout, "bytes_frise"))
+    with instrumentation.phase("tree"):
+        if page_size:
+            tree_paths = ftree.write_pages("tree-page", page_size)
+        else:
+            tree_paths = [ftree.print_tree(view=not headless, persons=persons)]
+    if ast is not None:
+        with instrumentation.phase("ast"):
+            ast_path = ast.show_AST(view=not headless)
+    if instrumentation.enabled:
+        instrumentation.count("bytes_tree", sum(os.path.getsize(path) for path in tree_paths))
+        if ast is not None:
+            instrumentation.count("bytes_ast", os.path.getsize(ast_path))
+    return ftree, ast
+
 
+def check(filename, engine="master", instrumentation=NULL_INSTRUMENTATION, diagnostics=None, lex_workers=1):
+    """
+    Vérifie un fichier sans construire l'AST ni importer graphviz : lexing, parsing,
+    absence de cycle dans les liens de filiation, cohérence des générations et des dates
+    (validation.validate_columns). Affiche un résumé et retourne l'arbre généalogique, ou None
+    si le fichier contient des erreurs ou des incohérences
+    :param filename:
+    :param engine:
+    :param instrumentation:
+    :param diagnostics: collecteur des erreurs (par défaut, limite de DEFAULT_MAX_ERRORS)
+    :param lex_workers: nombre de processus du lexing
+    :return:
+    """
+    parsed = parse_file(filename, engine, False, instrumentation,
+                        Diagnostics() if diagnostics is None else diagnostics, lex_workers, keep_columns=True)
+    if parsed is None:
+        return None
+    ftree, _, p4rser = parsed
 
+    # define_generations vérifie aussi l'absence de cycle
+    with instrumentation.phase("generations"):
+        conflicts = ftree.define_generations()
+    for person, gen, other_gen in conflicts:
+        print(f"Attention : {person.name} est à la fois à la génération {gen} et {other_gen}")
+    with instrumentation.phase("validate"):
+        # Les colonnes tenues à jour par le parser évitent un parcours des objets Person
+        validation = validate_columns(p4rser.columns())
+    instrumentation.count("inconsistencies", len(validation))
+    n_errors = 0
+    for diagnostic in validation:
+        if diagnostic.severity == "error":
+            n_errors += 1
+            print(f"Incohérence : {diagnostic}", file=sys.stderr)
+        else:
+            print(f"Attention : {diagnostic}")
+    if n_errors:
+        print(f"{n_errors} incohérence(s)", file=sys.stderr)
+        return None
+    print(f"Vérification réussie : {len(ftree.persons)} personnes, {p4rser.statements} instructions")
+    return ftree
 
 
+def main_kinship(args):
+    from kinship import KinshipIndex
+
+    names = args.kinship.split(",")
+    if len(names) != 2:
+        print("--kinship attend deux noms séparés par une virgule", file=sys.stderr)
+        return 1
+    parsed = parse_file(args.filename, args.engine, False, NULL_INSTRUMENTATION,
+                        Diagnostics(args.max_errors or None), args.lex_workers)
+    if parsed is None:
+        return 1
+    ftree = parsed[0]
+    # L'index n'est complété que pour les ancêtres des deux personnes
+    index = KinshipIndex(ftree)
+    try:
+        person1, person2 = (ftree.get_person(name) for name in names)
+        nearest = index.nearest_common_ancestors(person1, person2)
+    except FamilyTreeException as err:
+        print(err, file=sys.stderr)
+        return 1
+    for ancestor, descendant in ((person1, person2), (person2, person1)):
+        if index.is_ancestor(ancestor, descendant):
+            print(f"{ancestor.name} est un ancêtre de {descendant.name}")
+    if not nearest:
+        print(f"{person1.name} et {person2.name} n'ont pas d'ancêtre commun")
+        return 0
+    for ancestor, (depth1, depth2) in nearest:
+        print(f"Ancêtre commun le plus proche : {ancestor.name} ({depth1} génération(s) au-dessus de "
+              f"{person1.name}, {depth2} au-dessus de {person2.name})")
+    degree, gap = index.cousinship(person1, person2)
+    print(f"Degré de cousinage : {degree}, écart de {gap} génération(s)")
+    return 0
+
+
+def main_merge(args):
+    from workspace import Workspace
+
+    diagnostics = Diagnostics(args.max_errors or None)
+    workspace = Workspace()
+    for filename in [args.filename] + args.merge:
+        workspace.load_file(filename, args.engine, diagnostics)
+    if diagnostics:
+        print(diagnostics.format(), file=sys.stderr)
+        return 1
+    ftree = workspace.merge()
+    for name, birthdate, attribute, kept, rejected in workspace.conflicts:
+        print(f"Attention : {name} né le {birthdate:%d/%m/%Y} a deux valeurs pour {attribute} : "
+              f"{kept} (conservée) et {rejected}")
+    print(f"Fusion de {len(workspace.trees)} arbres : {len(ftree.persons)} personnes")
+    if args.check:
+        ftree.define_generations()
+    else:
+        ftree.print_frise()
+        ftree.print_tree(view=not args.headless)
+    return 0
+
+
+def main(args):
+    run = check if args.check else compile_and_show
+    options = {} if args.check else {"headless": args.headless, "up": args.up, "down": args.down,
+                                     "page_size": args.page_size}
+    if args.center is not None and not args.check:
+        options["center"] = args.center.split(",")
+    options["diagnostics"] = Diagnostics(args.max_errors or None)
+    options["lex_workers"] = args.lex_workers
+    if args.profile is None:
+        return 0 if run(args.filename, args.engine, **options) is not None else 1
+    instrumentation = Instrumentation(profile_functions=args.profile_functions,
+                                      trace_memory=args.profile_memory)
+    instrumentation.metadata.update(file=args.filename, engine=args.engine, check=args.check)
+    result = run(args.filename, args.engine, instrumentation=instrumentation, **options)
+    write_report(instrumentation.finish(), args.profile)
+    return 0 if result is not None else 1
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.batch:
+        sys.exit(main_batch(args))
+    if args.kinship is not None:
+        sys.exit(main_kinship(args))
+    sys.exit(main_merge(args) if args.merge is not None else main(args))
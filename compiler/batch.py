@@ -0,0 +1,208 @@
+# -*- encoding: utf-8 -*-
+
+import contextlib
+import glob
+import hashlib
+import io
+import os
+import time
+import traceback
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from cache import CompileCache, DEFAULT_MAX_BYTES, hash_file
+from columns import TreeColumns
+from diagnostics import Diagnostics
+from dot import DotWriter
+from lexer import Lexer, LexerException
+from p4rser import Parser, ParsingException
+from FamilyTree import FamilyTreeException
+
+# Sorties possibles d'une compilation
+OUTPUTS = ("frise", "tree", "ast")
+
+
+def find_inputs(target):
+    """
+    Retourne la liste triée des fichiers à compiler : tous les .txt d'un dossier,
+    les fichiers correspondant à un motif glob ou le fichier lui-même
+    :param target:
+    :return:
+    """
+    if os.path.isdir(target):
+        return sorted(glob.glob(os.path.join(target, "*.txt")))
+    return sorted(path for path in glob.glob(target) if os.path.isfile(path))
+
+
+def output_stems(paths):
+    """
+    Retourne le nom de base des sorties de chaque fichier d'entrée : le nom du fichier sans
+    extension, suivi d'une empreinte courte de son chemin lorsque plusieurs entrées (de dossiers
+    différents, par exemple) portent le même nom, pour qu'aucune n'écrase les sorties d'une autre
+    :param paths:
+    :return:
+    """
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    counts = Counter(stems)
+    return [stem if counts[stem] == 1 else
+            f"{stem}-{hashlib.sha256(os.path.abspath(path).encode('utf-8')).hexdigest()[:8]}"
+            for stem, path in zip(stems, paths)]
+
+
+def output_paths(path, out_dir, stem=None):
+    """
+    Retourne les chemins des sorties (frise, arbre, AST) d'un fichier d'entrée
+    :param path:
+    :param out_dir:
+    :param stem: nom de base des sorties (par défaut, le nom du fichier sans extension, voir output_stems)
+    :return:
+    """
+    if stem is None:
+        stem = os.path.splitext(os.path.basename(path))[0]
+    stem = os.path.join(out_dir, stem)
+    return {"frise": stem + ".frise.txt", "tree": stem + ".tree.gv", "ast": stem + ".ast.gv"}
+
+
+def compile_file(path, out_dir, outputs=OUTPUTS, cache_dir=None, engine="master", stem=None):
+    """
+    Compile un fichier (lexing, parsing puis sorties demandées) et retourne un dictionnaire
+    résumant le résultat et la durée de chaque phase. Les erreurs sont capturées pour
+    qu'un fichier invalide n'interrompe pas le traitement par lots.
+    Avec un cache, un fichier inchangé ne coûte que le calcul de son empreinte et la
+    recopie des sorties déjà produites
+    :param path:
+    :param out_dir:
+    :param outputs:
+    :param cache_dir: dossier du cache de compilation (None : pas de cache)
+    :param engine: moteur du lexer (tous les moteurs produisent les mêmes lexèmes : il ne
+    fait pas partie de la clef de cache)
+    :param stem: nom de base des sorties (voir output_paths)
+    :return:
+    """
+    result = {"file": path, "ok": False, "cached": False, "error": None, "timings": {}}
+    paths = output_paths(path, out_dir, stem)
+    start = time.perf_counter()
+    try:
+        if cache_dir is not None:
+            phase_start = time.perf_counter()
+            cache = CompileCache(cache_dir)
+            key = hash_file(path, outputs)
+            artifacts = cache.get(key)
+            result["timings"]["cache"] = time.perf_counter() - phase_start
+            if artifacts is not None:
+                write_artifacts(artifacts, paths, outputs)
+                result["ok"] = result["cached"] = True
+                result["total"] = time.perf_counter() - start
+                return result
+
+        # Les messages de progression du parser ne sont pas affichés
+        with contextlib.redirect_stdout(io.StringIO()):
+            phase_start = time.perf_counter()
+            # Toutes les erreurs du fichier sont relevées en une seule passe
+            diagnostics = Diagnostics()
+            lexems = Lexer(engine=engine, diagnostics=diagnostics).iter_lex_file(path)
+            if "ast" in outputs:
+                with DotWriter(paths["ast"], directed=True) as ast_graph:
+                    ftree, _ = Parser(lexems, ast_graph=ast_graph, diagnostics=diagnostics).parse()
+            else:
+                # Sans AST demandé, le parsing ne construit aucun graphique
+                ftree, _ = Parser(lexems, build_ast=False, diagnostics=diagnostics).parse()
+            result["timings"]["lex_parse"] = time.perf_counter() - phase_start
+        if diagnostics.warnings:
+            result["warnings"] = [warning.to_dict() for warning in diagnostics.warnings]
+        if diagnostics:
+            result["error"] = diagnostics.format()
+            result["diagnostics"] = [diagnostic.to_dict() for diagnostic in diagnostics.sorted()]
+            result["total"] = time.perf_counter() - start
+            return result
+
+        if "frise" in outputs:
+            phase_start = time.perf_counter()
+            with open(paths["frise"], "w", encoding="utf-8") as frise_file:
+                ftree.print_frise(frise_file)
+            result["timings"]["frise"] = time.perf_counter() - phase_start
+
+        if "tree" in outputs:
+            phase_start = time.perf_counter()
+            ftree.write_tree(paths["tree"])
+            result["timings"]["tree"] = time.perf_counter() - phase_start
+
+        if cache_dir is not None:
+            artifacts = {"columns": TreeColumns.from_tree(ftree)}
+            for output in outputs:
+                with open(paths[output], encoding="utf-8") as output_file:
+                    artifacts[output] = output_file.read()
+            cache.put(key, artifacts)
+
+        result["ok"] = True
+    except (LexerException, ParsingException, FamilyTreeException) as err:
+        result["error"] = f"{type(err).__name__}: {(str(err).splitlines() or [''])[0]}"
+    except Exception as err:
+        # Erreur inattendue : on garde la trace complète pour le diagnostic
+        result["error"] = f"{type(err).__name__}: {err}\n{traceback.format_exc()}"
+    result["total"] = time.perf_counter() - start
+    return result
+
+
+def write_artifacts(artifacts, paths, outputs):
+    """
+    Écrit les sorties demandées à partir des artefacts du cache
+    :param artifacts:
+    :param paths:
+    :param outputs:
+    :return:
+    """
+    for output in outputs:
+        with open(paths[output], "w", encoding="utf-8") as output_file:
+            output_file.write(artifacts[output])
+
+
+def run_batch(paths, out_dir, outputs=OUTPUTS, workers=None, cache_dir=None, cache_max_bytes=DEFAULT_MAX_BYTES,
+              engine="master"):
+    """
+    Compile les fichiers en parallèle sur plusieurs processus et retourne les résultats
+    dans l'ordre des fichiers. Les sorties de fichiers de même nom sont distinguées (output_stems)
+    :param paths:
+    :param out_dir:
+    :param outputs:
+    :param workers: nombre de processus (par défaut, le nombre de coeurs)
+    :param cache_dir: dossier du cache de compilation (None : pas de cache)
+    :param cache_max_bytes: taille maximale du cache, atteinte par éviction LRU en fin de traitement
+    :param engine: moteur du lexer
+    :return:
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(compile_file, path, out_dir, outputs, cache_dir, engine, stem)
+                   for path, stem in zip(paths, output_stems(paths))]
+        results = [future.result() for future in futures]
+    if cache_dir is not None:
+        CompileCache(cache_dir, cache_max_bytes).evict()
+    return results
+
+
+def format_summary(results, elapsed=None):
+    """
+    Retourne le résumé d'un traitement par lots : une ligne par fichier avec sa durée
+    (ou son erreur), puis les totaux
+    :param results:
+    :param elapsed: durée totale du traitement
+    :return:
+    """
+    lines = []
+    for result in results:
+        if result["ok"]:
+            phases = " ".join(f"{phase}={duration:.3f}s" for phase, duration in result["timings"].items())
+            status = "CACHE " if result["cached"] else "OK    "
+            lines.append(f"{status} {result['total']:.3f}s  {result['file']}  ({phases})")
+        else:
+            error = result["error"].replace("\n", "\n    ")
+            lines.append(f"ERREUR {result['total']:.3f}s  {result['file']}  {error}")
+    n_ok = sum(1 for result in results if result["ok"])
+    n_cached = sum(1 for result in results if result["cached"])
+    summary = (f"{len(results)} fichiers, {n_ok} compilés (dont {n_cached} depuis le cache), "
+               f"{len(results) - n_ok} en erreur")
+    if elapsed is not None:
+        summary += f", {elapsed:.3f}s au total"
+    lines.append(summary)
+    return "\n".join(lines)
@@ -0,0 +1,172 @@
+# -*- encoding: utf-8 -*-
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from dot import DotWriter
+from generator import write_program
+from lexer import Lexer
+from p4rser import Parser
+
+DEFAULT_SIZES = "1000,100000,1000000"
+# Un temps est considéré comme une régression au-delà de 25 % de plus que la référence
+DEFAULT_TOLERANCE = 1.25
+
+
+def measure(phase, results, function, trace_memory):
+    """
+    Exécute une phase, enregistre sa durée (et son pic mémoire) dans results
+    et retourne son résultat
+    :param phase:
+    :param results:
+    :param function:
+    :param trace_memory:
+    :return:
+    """
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    value = function()
+    duration = time.perf_counter() - start
+    results[phase] = {"seconds": duration}
+    if trace_memory:
+        results[phase]["peak_mib"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return value
+
+
+def run_size(path, trace_memory=False, lex_workers=0):
+    """
+    Mesure séparément chaque phase de la compilation d'un fichier
+    :param path:
+    :param trace_memory:
+    :param lex_workers: si non nul, mesure aussi le lexing parallèle avec ce nombre de processus
+    :return:
+    """
+    results = {}
+    lexems = measure("lex", results, lambda: Lexer().lex_file(path), trace_memory)
+    if lex_workers:
+        # Blocs de 1 Mo, pour que les petites tailles soient aussi découpées
+        measure("lex_parallel", results,
+                lambda: list(Lexer().iter_lex_file_parallel(path, lex_workers, chunk_size=2 ** 20)),
+                trace_memory)
+        results["lex_parallel"]["lexems_per_s"] = len(lexems) / results["lex_parallel"]["seconds"]
+    n_lexems = len(lexems)
+
+    def check():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return Parser(lexems, build_ast=False).parse()[0]
+
+    def parse():
+        with contextlib.redirect_stdout(io.StringIO()), DotWriter(os.devnull, directed=True) as ast_graph:
+            return Parser(lexems, ast_graph=ast_graph).parse()[0]
+
+    # Parsing seul (mode vérification, sans AST), puis parsing complet avec l'AST
+    measure("check", results, check, trace_memory)
+    ftree = measure("parse", results, parse, trace_memory)
+    del lexems
+    n_persons = len(ftree.persons)
+    measure("generations", results, ftree.define_generations, trace_memory)
+    with open(os.devnull, "w", encoding="utf-8") as null_output:
+        measure("frise", results, lambda: ftree.print_frise(null_output), trace_memory)
+        measure("dot", results, lambda: ftree.write_tree(null_output), trace_memory)
+
+    # Débits
+    results["lex"]["lexems_per_s"] = n_lexems / results["lex"]["seconds"]
+    for phase in ("check", "parse", "generations", "frise", "dot"):
+        results[phase]["persons_per_s"] = n_persons / results[phase]["seconds"]
+    return {"persons": n_persons, "lexems": n_lexems, "phases": results}
+
+
+def format_report(report, baseline=None, tolerance=DEFAULT_TOLERANCE):
+    """
+    Retourne le rapport lisible d'une série de mesures, comparées à la référence si elle est donnée,
+    ainsi que la liste des régressions
+    :param report:
+    :param baseline:
+    :param tolerance:
+    :return:
+    """
+    lines = []
+    regressions = []
+    for size, size_report in report.items():
+        lines.append(f"== {size} personnes ({size_report['lexems']} lexèmes) ==")
+        for phase, values in size_report["phases"].items():
+            line = f"  {phase:<12} {values['seconds']:9.3f}s"
+            rate = values.get("persons_per_s", values.get("lexems_per_s"))
+            unit = "personnes/s" if "persons_per_s" in values else "lexèmes/s"
+            line += f"  {rate:14,.0f} {unit}"
+            if "peak_mib" in values:
+                line += f"  pic {values['peak_mib']:.1f} Mio"
+            reference = (baseline or {}).get(size, {}).get("phases", {}).get(phase)
+            if reference is not None:
+                ratio = values["seconds"] / reference["seconds"]
+                line += f"  x{ratio:.2f} / référence"
+                if ratio > tolerance:
+                    line += "  RÉGRESSION"
+                    regressions.append((size, phase, ratio))
+            lines.append(line)
+    return "\n".join(lines), regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mesure des performances du compilateur")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help=f"tailles des arbres générés, séparées par des virgules (défaut : {DEFAULT_SIZES})")
+    parser.add_argument("--depth", type=int, default=20, help="nombre de générations des arbres générés")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--lex-workers", type=int, default=0,
+                        help="mesure aussi le lexing parallèle avec ce nombre de processus")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="nombre de répétitions (le meilleur temps est retenu)")
+    parser.add_argument("--memory", action="store_true",
+                        help="mesure le pic mémoire de chaque phase (tracemalloc, plus lent)")
+    parser.add_argument("--baseline", default="benchmark_baseline.json", help="fichier des mesures de référence")
+    parser.add_argument("--save-baseline", action="store_true", help="enregistre les mesures comme référence")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="rapport de temps au-delà duquel une phase est en régression")
+    parser.add_argument("--json", action="store_true", help="affiche les mesures au format JSON")
+    args = parser.parse_args(argv)
+
+    report = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in (int(size) for size in args.sizes.split(",")):
+            path = os.path.join(directory, f"tree_{size}.txt")
+            write_program(path, population=size, depth=args.depth, seed=args.seed)
+            # On garde le meilleur temps de chaque phase sur les répétitions
+            report[str(size)] = run_size(path, lex_workers=args.lex_workers)
+            for _ in range(args.repeat - 1):
+                repeat_report = run_size(path, lex_workers=args.lex_workers)
+                for phase, values in report[str(size)]["phases"].items():
+                    if repeat_report["phases"][phase]["seconds"] < values["seconds"]:
+                        values.update(repeat_report["phases"][phase])
+            if args.memory:
+                # Passe séparée : tracemalloc fausserait les temps mesurés
+                memory_report = run_size(path, trace_memory=True, lex_workers=args.lex_workers)
+                for phase, values in report[str(size)]["phases"].items():
+                    values["peak_mib"] = memory_report["phases"][phase]["peak_mib"]
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+    text, regressions = format_report(report, baseline, args.tolerance)
+    print(json.dumps(report, indent=2) if args.json else text)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f"Référence enregistrée dans {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+# -*- encoding: utf-8 -*-
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+from constants import COMPILER_VERSION
+
+# Taille maximale par défaut du cache : 256 Mo
+DEFAULT_MAX_BYTES = 256 * 2 ** 20
+
+
+def hash_file(path, options=()):
+    """
+    Retourne la clef de cache d'un fichier : empreinte SHA-256 de son contenu,
+    de la version du compilateur et des options de compilation
+    :param path:
+    :param options:
+    :return:
+    """
+    digest = new_digest(options)
+    with open(path, "rb") as input_file:
+        for chunk in iter(lambda: input_file.read(2 ** 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_text(text, options=()):
+    """
+    Retourne la clef de cache d'un source déjà en mémoire (même empreinte que hash_file
+    pour le fichier correspondant encodé en UTF-8)
+    :param text:
+    :param options:
+    :return:
+    """
+    digest = new_digest(options)
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def new_digest(options):
+    """
+    Retourne une empreinte SHA-256 initialisée avec la version du compilateur et les options
+    :param options:
+    :return:
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{COMPILER_VERSION}\0{sorted(options)!r}\0".encode("utf-8"))
+    return digest
+
+
+class CompileCache:
+    """
+    Cache disque des artefacts de compilation (modèle de l'arbre sérialisé, frise, DOT),
+    indexé par l'empreinte du contenu de l'entrée. Chaque entrée est un fichier unique
+    écrit de manière atomique ; la date de modification sert de date de dernier accès
+    pour l'éviction LRU
+    """
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key + ".pickle")
+
+    def get(self, key):
+        """
+        Retourne les artefacts associés à la clef (dictionnaire nom -> contenu), ou None
+        :param key:
+        :return:
+        """
+        path = self.entry_path(key)
+        try:
+            with open(path, "rb") as entry_file:
+                artifacts = pickle.load(entry_file)
+            # Mise à jour de la date d'accès pour l'éviction LRU
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Entrée tronquée, corrompue ou écrite par une version dont les classes ont changé
+            # (AttributeError, ImportError, ValueError...) : c'est un défaut de cache et
+            # l'entrée est supprimée
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            return None
+        return artifacts
+
+    def put(self, key, artifacts):
+        """
+        Enregistre les artefacts associés à la clef
+        :param key:
+        :param artifacts: dictionnaire nom -> contenu (objets sérialisables)
+        :return:
+        """
+        # Écriture dans un fichier temporaire puis renommage : un autre processus
+        # ne peut jamais lire une entrée incomplète
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as entry_file:
+                pickle.dump(artifacts, entry_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.entry_path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def evict(self):
+        """
+        Supprime les entrées les moins récemment utilisées jusqu'à ce que la taille
+        du cache soit inférieure à max_bytes. Retourne le nombre d'entrées supprimées
+        :return:
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pickle"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        n_evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            n_evicted += 1
+        return n_evicted
@@ -0,0 +1,292 @@
+from array import array
+from collections import Counter
+from datetime import date
+from itertools import accumulate, repeat
+
+# Valeurs sentinelles des colonnes entières
+NO_DATE = 0  # les ordinaux de dates commencent à 1
+NO_PERSON = -1
+NO_GEN = -2 ** 31
+
+
+def date_to_ordinal(value):
+    """
+    Convertit une date (ou None) en ordinal entier
+    :param value:
+    :return:
+    """
+    return NO_DATE if value is None else value.toordinal()
+
+
+def ordinal_to_date(ordinal):
+    """
+    Convertit un ordinal entier en date (ou None)
+    :param ordinal:
+    :return:
+    """
+    return None if ordinal == NO_DATE else date.fromordinal(ordinal)
+
+
+class PersonView:
+    """
+    Vue en lecture seule d'une personne stockée dans des colonnes, qui expose
+    les mêmes attributs qu'un objet Person sans le matérialiser
+    """
+    __slots__ = ("columns", "id")
+
+    def __init__(self, columns, person_id):
+        self.columns = columns
+        self.id = person_id
+
+    def __eq__(self, other):
+        return isinstance(other, PersonView) and other.columns is self.columns and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f"PersonView({self.id}, {self.name!r})"
+
+    @property
+    def name(self):
+        return self.columns.names[self.id]
+
+    @property
+    def birthdate(self):
+        return ordinal_to_date(self.columns.birth[self.id])
+
+    @property
+    def deathdate(self):
+        return ordinal_to_date(self.columns.death[self.id])
+
+    @property
+    def wedding_date(self):
+        return ordinal_to_date(self.columns.wedding[self.id])
+
+    @property
+    def gen(self):
+        gen = self.columns.gen[self.id]
+        return None if gen == NO_GEN else gen
+
+    @property
+    def spouse(self):
+        return self.columns.view(self.columns.spouse[self.id])
+
+    @property
+    def parents(self):
+        return [self.columns.view(i) for i in self.columns.parents_of(self.id)]
+
+    @property
+    def children(self):
+        return [self.columns.view(i) for i in self.columns.children_of(self.id)]
+
+
+class TreeColumns:
+    """
+    Stockage colonnaire compact d'un arbre généalogique.
+    Chaque personne est identifiée par son rang dans FamilyTree.persons ; ses dates sont des
+    ordinaux entiers et les liens de filiation sont des listes d'adjacence au format CSR
+    (offsets[i]:offsets[i + 1] délimite les identifiants des parents / enfants de i).
+    Les colonnes peuvent être des array ou des memoryview (lecture sans copie).
+    """
+    __slots__ = ("names", "birth", "death", "wedding", "spouse", "gen",
+                 "parent_offsets", "parent_ids", "child_offsets", "child_ids", "racine")
+
+    def __init__(self, names, birth, death, wedding, spouse, gen,
+                 parent_offsets, parent_ids, child_offsets, child_ids, racine=NO_PERSON):
+        self.names = names
+        self.birth = birth
+        self.death = death
+        self.wedding = wedding
+        self.spouse = spouse
+        self.gen = gen
+        self.parent_offsets = parent_offsets
+        self.parent_ids = parent_ids
+        self.child_offsets = child_offsets
+        self.child_ids = child_ids
+        self.racine = racine
+
+    def __len__(self):
+        return len(self.birth)
+
+    @classmethod
+    def from_tree(cls, tree):
+        """
+        Construit les colonnes à partir d'un FamilyTree
+        :param tree:
+        :return:
+        """
+        ids = {person: i for i, person in enumerate(tree.persons)}
+        ids[None] = NO_PERSON
+        names = [person.name for person in tree.persons]
+        birth = array('i', (date_to_ordinal(person.birthdate) for person in tree.persons))
+        death = array('i', (date_to_ordinal(person.deathdate) for person in tree.persons))
+        wedding = array('i', (date_to_ordinal(person.wedding_date) for person in tree.persons))
+        spouse = array('i', (ids[person.spouse] for person in tree.persons))
+        gen = array('i', (NO_GEN if person.gen is None else person.gen for person in tree.persons))
+        # Les parents inconnus (None, arbres relus d'anciens fichiers) ont l'identifiant NO_PERSON
+        parent_offsets, parent_ids = to_csr([ids[p] for p in person.parents] for person in tree.persons)
+        child_offsets, child_ids = to_csr([ids[c] for c in person.children] for person in tree.persons)
+        return cls(names, birth, death, wedding, spouse, gen,
+                   parent_offsets, parent_ids, child_offsets, child_ids, ids[tree.racine])
+
+    def to_tree(self):
+        """
+        Reconstruit un FamilyTree (avec ses objets Person) à partir des colonnes
+        :return:
+        """
+        from FamilyTree import FamilyTree
+        from Person import Person
+
+        tree = FamilyTree()
+        persons = [Person(tree, self.names[i], ordinal_to_date(self.birth[i]),
+                          ordinal_to_date(self.death[i])) for i in range(len(self))]
+        for i, person in enumerate(persons):
+            if self.spouse[i] != NO_PERSON:
+                person.spouse = persons[self.spouse[i]]
+            person.wedding_date = ordinal_to_date(self.wedding[i])
+            person.gen = None if self.gen[i] == NO_GEN else self.gen[i]
+            person.parents = [None if p == NO_PERSON else persons[p] for p in self.parents_of(i)]
+            person.children = [persons[c] for c in self.children_of(i)]
+        if self.racine != NO_PERSON:
+            tree.racine = persons[self.racine]
+        return tree
+
+    def parents_of(self, person_id):
+        return self.parent_ids[self.parent_offsets[person_id]:self.parent_offsets[person_id + 1]]
+
+    def children_of(self, person_id):
+        return self.child_ids[self.child_offsets[person_id]:self.child_offsets[person_id + 1]]
+
+    def view(self, person_id):
+        """
+        Retourne la vue de la personne d'identifiant person_id (None pour NO_PERSON)
+        :param person_id:
+        :return:
+        """
+        return None if person_id == NO_PERSON else PersonView(self, person_id)
+
+    def persons(self):
+        """
+        Itère sur les vues de toutes les personnes
+        :return:
+        """
+        return (PersonView(self, i) for i in range(len(self)))
+
+
+class ColumnsBuilder:
+    """
+    Colonnes d'un arbre tenues à jour par le parser (TreeBuilder) pendant la construction de l'arbre :
+    chaque déclaration et chaque lien y est reporté après avoir été appliqué aux objets Person,
+    ce qui évite de reparcourir toutes les personnes (TreeColumns.from_tree) pour valider l'arbre.
+    Les liens de filiation sont conservés comme arêtes (parent, enfant), converties en CSR par to_columns.
+    Les générations, calculées après le parsing, ne sont pas renseignées (NO_GEN)
+    """
+    __slots__ = ("ids", "names", "birth", "death", "wedding", "spouse", "edge_parents", "edge_children")
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        self.birth = array('i')
+        self.death = array('i')
+        self.wedding = array('i')
+        self.spouse = array('i')
+        self.edge_parents = array('i')
+        self.edge_children = array('i')
+
+    def add_person(self, person):
+        """
+        Ajoute une personne déclarée (son identifiant est son rang de déclaration)
+        :param person:
+        :return:
+        """
+        self.ids[person] = len(self.names)
+        self.names.append(person.name)
+        self.birth.append(date_to_ordinal(person.birthdate))
+        self.death.append(date_to_ordinal(person.deathdate))
+        self.wedding.append(NO_DATE)
+        self.spouse.append(NO_PERSON)
+
+    def add_marriage(self, person, spouse):
+        """
+        Reporte le mariage de deux personnes, après Person.define_mariage_link
+        :param person:
+        :param spouse:
+        :return:
+        """
+        for one, other in ((person, spouse), (spouse, person)):
+            identifier = self.ids[one]
+            self.spouse[identifier] = self.ids[other]
+            self.wedding[identifier] = date_to_ordinal(one.wedding_date)
+
+    def add_filiation(self, parent, child):
+        """
+        Reporte le lien de filiation d'un parent (et de son conjoint) vers un enfant,
+        après Person.define_familial_link
+        :param parent:
+        :param child:
+        :return:
+        """
+        for one in (parent, parent.spouse):
+            if one is not None:
+                self.edge_parents.append(self.ids[one])
+                self.edge_children.append(self.ids[child])
+
+    def to_columns(self, racine=None, use_numpy=None):
+        """
+        Retourne les colonnes (TreeColumns) de l'arbre construit jusqu'ici
+        :param racine: racine de l'arbre (Person)
+        :param use_numpy: voir edges_to_csr
+        :return:
+        """
+        size = len(self.names)
+        parent_offsets, parent_ids = edges_to_csr(self.edge_children, self.edge_parents, size, use_numpy)
+        child_offsets, child_ids = edges_to_csr(self.edge_parents, self.edge_children, size, use_numpy)
+        return TreeColumns(self.names, self.birth, self.death, self.wedding, self.spouse,
+                           array('i', [NO_GEN]) * size, parent_offsets, parent_ids,
+                           child_offsets, child_ids, self.ids.get(racine, NO_PERSON))
+
+
+def edges_to_csr(keys, values, size, use_numpy=None):
+    """
+    Regroupe des arêtes (keys[k], values[k]) en listes d'adjacence CSR indexées par keys,
+    dans l'ordre des arêtes (le tri est stable). Avec NumPy (s'il est installé), les tableaux
+    retournés sont des memoryview sur les tableaux NumPy ; sinon le tri, le comptage et
+    les offsets sont faits par sorted, Counter et accumulate, sans boucle Python par arête
+    :param keys: array
+    :param values: array
+    :param size: nombre de listes d'adjacence
+    :param use_numpy: None : NumPy s'il est disponible ; False : jamais
+    :return:
+    """
+    if use_numpy is not False:
+        try:
+            import numpy as np
+        except ImportError:
+            if use_numpy:
+                raise
+        else:
+            keys = np.asarray(keys, dtype=np.int32)
+            ids = np.asarray(values, dtype=np.int32)[np.argsort(keys, kind="stable")]
+            offsets = np.zeros(size + 1, dtype=np.int32)
+            np.cumsum(np.bincount(keys, minlength=size), out=offsets[1:])
+            return memoryview(offsets), memoryview(ids)
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    ids = array('i', map(values.__getitem__, order))
+    counts = Counter(keys)
+    offsets = array('i', accumulate(map(counts.get, range(size), repeat(0)), initial=0))
+    return offsets, ids
+
+
+def to_csr(adjacency):
+    """
+    Convertit des listes d'adjacence en deux tableaux (offsets, identifiants)
+    :param adjacency:
+    :return:
+    """
+    offsets = array('i', [0])
+    ids = array('i')
+    for neighbours in adjacency:
+        ids.extend(neighbours)
+        offsets.append(len(ids))
+    return offsets, ids
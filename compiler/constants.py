@@ -20,3 +20,7 @@ LEXEM_REGEXES = [
     (r'[a-zA-Z]+', "NAME"),
 
 ]
+
+# Version of the compiler, part of the compile cache keys:
+# bump it whenever the outputs for a given input change
+COMPILER_VERSION = "0.3.0"
@@ -0,0 +1,30 @@
+from datetime import date
+
+# Dates déjà converties : une même chaîne donne toujours le même objet date
+_DATE_CACHE = {}
+
+
+def parse_date(text):
+    """
+    Convertit une date "jj/mm/aaaa" en objet date.
+    Le lexer garantit la forme \\d{1,2}/\\d{1,2}/\\d{4} : un simple découpage suffit, sans strptime.
+    Lève une ValueError si la date n'existe pas dans le calendrier (ex : 31/02/2000)
+    :param text:
+    :return:
+    """
+    try:
+        return _DATE_CACHE[text]
+    except KeyError:
+        pass
+    day, month, year = text.split("/")
+    value = date(int(year), int(month), int(day))
+    _DATE_CACHE[text] = value
+    return value
+
+
+def clear_date_cache():
+    """
+    Vide le cache des dates converties
+    :return:
+    """
+    _DATE_CACHE.clear()
@@ -0,0 +1,96 @@
+# -*- encoding: utf-8 -*-
+
+# Nombre d'erreurs au-delà duquel la compilation s'arrête
+DEFAULT_MAX_ERRORS = 100
+
+
+class TooManyErrors(Exception):
+    pass
+
+
+class Diagnostic:
+    """
+    Erreur relevée pendant la compilation : son origine ("lexer" ou "parser"),
+    son message et sa position dans la source (None si elle est inconnue, par
+    exemple en fin de fichier)
+    """
+    __slots__ = ("source", "message", "line", "column")
+
+    def __init__(self, source, message, line=None, column=None):
+        self.source = source
+        self.message = message
+        self.line = line
+        self.column = column
+
+    @property
+    def position(self):
+        return [self.line, self.column]
+
+    def __repr__(self):
+        return f"Diagnostic({self.source!r}, {self.message!r}, {self.line}, {self.column})"
+
+    def __str__(self):
+        return self.message
+
+    def to_dict(self):
+        return {"source": self.source, "message": self.message, "line": self.line, "column": self.column}
+
+
+class Diagnostics:
+    """
+    Erreurs d'une compilation, partagées par le lexer et le parser pour tout signaler
+    en une seule passe. Au-delà de max_errors erreurs (None : pas de limite), add lève
+    TooManyErrors pour interrompre la compilation.
+    Les avertissements (warn) sont conservés à part : ils n'interrompent ni ne font
+    échouer la compilation
+    """
+    def __init__(self, max_errors=DEFAULT_MAX_ERRORS):
+        self.max_errors = max_errors
+        self.items = []
+        self.warnings = []
+        self.truncated = False
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def add(self, diagnostic):
+        """
+        Enregistre une erreur
+        :param diagnostic:
+        :return:
+        """
+        self.items.append(diagnostic)
+        if self.max_errors is not None and len(self.items) >= self.max_errors:
+            self.truncated = True
+            raise TooManyErrors(f"Compilation interrompue après {len(self.items)} erreurs")
+
+    def warn(self, diagnostic):
+        """
+        Enregistre un avertissement
+        :param diagnostic:
+        :return:
+        """
+        self.warnings.append(diagnostic)
+
+    def sorted(self):
+        """
+        Retourne les erreurs dans l'ordre de la source (celles sans position à la fin)
+        :return:
+        """
+        return sorted(self.items, key=lambda diagnostic: (diagnostic.line is None,
+                                                          diagnostic.line or 0, diagnostic.column or 0))
+
+    def format(self):
+        """
+        Retourne le rapport des erreurs : une ligne par erreur, puis le total
+        :return:
+        """
+        lines = [str(diagnostic) for diagnostic in self.sorted()]
+        summary = f"{len(self.items)} erreur(s)"
+        if self.truncated:
+            summary += f" (limite de {self.max_errors} atteinte, compilation interrompue)"
+        lines.append(summary)
+        return "\n".join(lines)
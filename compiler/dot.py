@@ -0,0 +1,104 @@
+def quote(value):
+    """
+    Retourne un identifiant ou une valeur d'attribut DOT entre guillemets
+    (les retours à la ligne deviennent la séquence \\n de DOT : une instruction par ligne)
+    :param value:
+    :return:
+    """
+    return '"' + str(value).replace('"', '\\"').replace("\n", "\\n") + '"'
+
+
+def format_attributes(label, attrs):
+    """
+    Retourne la liste d'attributs DOT " [k=v ...]" (vide s'il n'y en a pas)
+    :param label:
+    :param attrs:
+    :return:
+    """
+    if label is not None:
+        attrs = dict(label=label, **attrs)
+    if not attrs:
+        return ""
+    return " [" + " ".join(f"{key}={quote(value)}" for key, value in attrs.items()) + "]"
+
+
+class DotWriter:
+    """
+    Graphique DOT écrit au fil de l'eau dans un fichier (ou tout flux texte, par exemple
+    socket.makefile('w')) : contrairement à graphviz.Graph, les noeuds et les arêtes ne sont
+    pas conservés en mémoire. Propose les méthodes attr, node, edge et render de graphviz
+    """
+    def __init__(self, output, directed=False):
+        """
+        :param output: chemin du fichier .gv à écrire ou flux texte déjà ouvert
+        :param directed: graphe orienté (digraph) ou non (graph)
+        """
+        if isinstance(output, str):
+            self.stream = open(output, "w", encoding="utf-8")
+            self.owns_stream = True
+        else:
+            self.stream = output
+            self.owns_stream = False
+        self.edge_op = " -> " if directed else " -- "
+        self.closed = False
+        self.stream.write("digraph {\n" if directed else "graph {\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def attr(self, **attrs):
+        """
+        Ajoute des attributs au graphique
+        :param attrs:
+        :return:
+        """
+        self.stream.write("\tgraph" + format_attributes(None, attrs) + "\n")
+
+    def node(self, name, label=None, **attrs):
+        """
+        Ajoute un noeud au graphique
+        :param name:
+        :param label:
+        :param attrs:
+        :return:
+        """
+        self.stream.write("\t" + quote(name) + format_attributes(label, attrs) + "\n")
+
+    def edge(self, tail_name, head_name, label=None, **attrs):
+        """
+        Ajoute une arête au graphique
+        :param tail_name:
+        :param head_name:
+        :param label:
+        :param attrs:
+        :return:
+        """
+        self.stream.write("\t" + quote(tail_name) + self.edge_op + quote(head_name)
+                          + format_attributes(label, attrs) + "\n")
+
+    def close(self):
+        """
+        Termine le graphique et ferme le fichier s'il a été ouvert par le DotWriter
+        :return:
+        """
+        if self.closed:
+            return
+        self.stream.write("}\n")
+        self.closed = True
+        if self.owns_stream:
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+    def render(self, filename=None, view=False):
+        """
+        Le fichier DOT est déjà écrit : render se contente de le terminer, sans mise en page
+        ni ouverture de visionneuse (mode sans affichage pour les traitements par lots)
+        :param filename: ignoré, pour la compatibilité avec graphviz
+        :param view: ignoré, pour la compatibilité avec graphviz
+        :return:
+        """
+        self.close()
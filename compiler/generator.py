@@ -0,0 +1,168 @@
+# -*- encoding: utf-8 -*-
+
+import argparse
+import random
+import string
+
+FIRST_NAMES = ["Antoine", "Marine", "Genevieve", "Pierre", "Jacques", "Augustine", "Rene",
+               "Mathilde", "Charles", "Anne", "Fernand", "Yvonne", "Joseph", "Claire", "Aude"]
+
+
+def encode_name(index):
+    """
+    Retourne un nom unique composé uniquement de lettres (les noms du langage sont [a-zA-Z]+)
+    :param index:
+    :return:
+    """
+    first_name = FIRST_NAMES[index % len(FIRST_NAMES)]
+    letters = []
+    while True:
+        index, rest = divmod(index, 26)
+        letters.append(string.ascii_uppercase[rest])
+        if index == 0:
+            break
+    return first_name + "".join(reversed(letters))
+
+
+def format_date(year, rng):
+    return f"{rng.randint(1, 28)}/{rng.randint(1, 12):02d}/{year}"
+
+
+def generate_program(population=1000, depth=10, marriage_rate=0.7, collapse_rate=0.05,
+                     comment_rate=0.05, seed=0):
+    """
+    Génère (ligne par ligne) un programme family_tree valide et reproductible :
+    population personnes réparties sur depth générations, une proportion marriage_rate de
+    personnes mariées, une proportion collapse_rate de mariages entre cousins (implexe)
+    et une proportion comment_rate de lignes de commentaires.
+    La racine (première personne déclarée) appartient à la génération la plus jeune
+    :param population:
+    :param depth:
+    :param marriage_rate:
+    :param collapse_rate:
+    :param comment_rate:
+    :param seed:
+    :return:
+    """
+    rng = random.Random(seed)
+    depth = max(1, min(depth, population))
+    # Environ 32 ans entre deux générations (mariage à 18-26 ans, enfants dans les 12 ans)
+    base_year = max(1000, 2000 - 32 * depth)
+
+    birth_years = []
+    # Couple des parents de chaque personne (indice dans couples) ou None
+    parent_couple = []
+    couples = []  # (personne1, personne2, année de mariage)
+    links = []  # (parent, enfant)
+    previous_generation = []
+    for generation in range(depth):
+        size = population // depth + (population % depth if generation == depth - 1 else 0)
+        first_couple = len(couples)
+        # Mariages dans la génération précédente
+        pool = previous_generation[:]
+        rng.shuffle(pool)
+        married = set()
+        # Regroupement par grands-parents, pour les mariages entre cousins
+        cousins = {}
+        for person in pool:
+            couple = parent_couple[person]
+            if couple is not None:
+                grandparent_couple = parent_couple[couples[couple][0]]
+                if grandparent_couple is not None:
+                    cousins.setdefault(grandparent_couple, []).append(person)
+        next_index = 0
+        for person in pool:
+            if person in married or rng.random() >= marriage_rate:
+                continue
+            spouse = None
+            couple = parent_couple[person]
+            if rng.random() < collapse_rate and couple is not None:
+                grandparent_couple = parent_couple[couples[couple][0]]
+                for relative in cousins.get(grandparent_couple, []):
+                    if relative != person and relative not in married and parent_couple[relative] != couple:
+                        spouse = relative
+                        break
+            while spouse is None and next_index < len(pool):
+                candidate = pool[next_index]
+                next_index += 1
+                if candidate != person and candidate not in married:
+                    spouse = candidate
+            if spouse is None:
+                break
+            married.update((person, spouse))
+            wedding_year = max(birth_years[person], birth_years[spouse]) + rng.randint(18, 26)
+            couples.append((person, spouse, wedding_year))
+
+        # Naissances de la génération
+        generation_couples = range(first_couple, len(couples))
+        current_generation = []
+        for _ in range(size):
+            person = len(birth_years)
+            if generation_couples:
+                couple = rng.choice(generation_couples)
+                birth_years.append(couples[couple][2] + rng.randint(1, 12))
+                parent_couple.append(couple)
+                links.append((couples[couple][0], person))
+            else:
+                birth_years.append(base_year + 32 * generation + rng.randint(0, 10))
+                parent_couple.append(None)
+            current_generation.append(person)
+        previous_generation = current_generation
+
+    # La racine : une personne de la dernière génération, avec des parents si possible
+    with_parents = [person for person in previous_generation if parent_couple[person] is not None]
+    racine = with_parents[0] if with_parents else previous_generation[0]
+    order = [racine] + [person for person in range(len(birth_years)) if person != racine]
+
+    def comment():
+        if rng.random() < comment_rate:
+            return f"// commentaire {rng.randint(0, 10 ** 6)}"
+        return None
+
+    yield "family_tree {"
+    for person in order:
+        line = comment()
+        if line:
+            yield line
+        year = birth_years[person]
+        death_year = year + rng.randint(50, 95)
+        death = format_date(death_year, rng) if death_year < 2020 else ""
+        yield f"{encode_name(person)}({format_date(year, rng)}-{death});"
+    for person, spouse, wedding_year in couples:
+        line = comment()
+        if line:
+            yield line
+        yield f"{encode_name(person)} <=> {encode_name(spouse)}({format_date(wedding_year, rng)});"
+    for parent, child in links:
+        line = comment()
+        if line:
+            yield line
+        yield f"{encode_name(parent)} -> {encode_name(child)};"
+    yield "}"
+
+
+def write_program(path, **params):
+    """
+    Écrit un programme généré dans un fichier (voir generate_program pour les paramètres)
+    :param path:
+    :param params:
+    :return:
+    """
+    with open(path, "w", encoding="utf-8") as output_file:
+        for line in generate_program(**params):
+            output_file.write(line + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Générateur de programmes family_tree synthétiques")
+    parser.add_argument("output", help="fichier à écrire")
+    parser.add_argument("--population", type=int, default=1000)
+    parser.add_argument("--depth", type=int, default=10)
+    parser.add_argument("--marriage-rate", type=float, default=0.7)
+    parser.add_argument("--collapse-rate", type=float, default=0.05)
+    parser.add_argument("--comment-rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_program(args.output, population=args.population, depth=args.depth,
+                  marriage_rate=args.marriage_rate, collapse_rate=args.collapse_rate,
+                  comment_rate=args.comment_rate, seed=args.seed)
@@ -0,0 +1,559 @@
+# -*- encoding: utf-8 -*-
+
+from bisect import bisect_left, bisect_right, insort
+from itertools import chain
+from operator import attrgetter
+
+from AST import ASTRenderer
+from lexer import Lexer
+from nodes import Declaration, MaritalLink
+from p4rser import Parser, ParsingException, TreeBuilder
+from Person import Person, to_date
+
+# Écart entre les rangs de deux instructions consécutives : les instructions insérées entre
+# elles reçoivent des rangs intermédiaires, sans renuméroter les autres
+ORDER_STEP = 2 ** 16
+
+order_key = attrgetter("order")
+
+
+def content_key(tokens):
+    """
+    Retourne la clef de contenu d'une instruction : l'étiquette et la valeur de ses lexèmes avec leur
+    position relative au premier lexème (décalage de ligne ; colonne, décalée sur la première ligne).
+    Deux instructions de même clef ne diffèrent que par leur position dans la source
+    :param tokens:
+    :return:
+    """
+    first = tokens[0]
+    return tuple((token.tag, token.value, token.line - first.line,
+                  token.column - first.column if token.line == first.line else token.column)
+                 for token in tokens)
+
+
+def split_statements(tokens, header, footer):
+    """
+    Découpe les lexèmes (sans les commentaires) d'une zone du source en instructions terminées par ';'.
+    Retourne la liste des instructions, ou None si la zone ne se découpe pas ainsi (entête ou fin du bloc
+    family_tree incorrects, fin de bloc au milieu de la zone, dernière instruction non terminée)
+    :param tokens:
+    :param header: la zone commence au début du source (par l'entête 'family_tree' '{')
+    :param footer: la zone s'étend jusqu'à la fin du source (et se termine par '}')
+    :return:
+    """
+    start = 0
+    if header:
+        if len(tokens) < 2 or tokens[0].tag != "KW_TREE" or tokens[1].tag != "L_CURL_BRACKET":
+            return None
+        start = 2
+    statements = []
+    while start < len(tokens):
+        if tokens[start].tag == "R_CURL_BRACKET":
+            # Les lexèmes suivant la fin du bloc sont ignorés, comme par le parser
+            return statements if footer else None
+        stop = start
+        while stop < len(tokens) and tokens[stop].tag != "TERMINATOR":
+            stop += 1
+        if stop == len(tokens):
+            return None
+        statements.append(tokens[start:stop + 1])
+        start = stop + 1
+    return None if footer else statements
+
+
+class StatementEntry:
+    """
+    Instruction de la compilation incrémentale : ses lexèmes et sa clef de contenu, son noeud,
+    son rang (les rangs suivent l'ordre des instructions), les lignes d'AST qu'elle produit
+    et, pour une déclaration, la personne créée
+    """
+    __slots__ = ("tokens", "key", "node", "order", "first_line", "last_line", "ast_lines", "person")
+
+    def __init__(self, tokens, node, key=None):
+        self.tokens = tokens
+        self.key = content_key(tokens) if key is None else key
+        self.node = node
+        self.order = 0
+        self.first_line = tokens[0].line
+        self.last_line = tokens[-1].line
+        self.ast_lines = []
+        self.person = None
+
+    def move(self, tokens):
+        """
+        Reporte sur l'instruction la position de ses lexèmes dans le source modifié
+        :param tokens: lexèmes de même clef de contenu
+        :return:
+        """
+        self.node.shift(tokens[0].line - self.first_line, tokens[0].column - self.tokens[0].column)
+        self.tokens = tokens
+        self.first_line = tokens[0].line
+        self.last_line = tokens[-1].line
+
+    def shift(self, delta):
+        self.node.shift(delta)
+        self.first_line += delta
+        self.last_line += delta
+
+
+class IncrementalCompilation:
+    """
+    Compilation d'un texte source conservée d'une modification à l'autre (intégration éditeur).
+    Une modification ne relexe que les lignes modifiées et ne reparse que les instructions ajoutées ;
+    seuls les liens des personnes citées par les instructions ajoutées ou supprimées (et de leurs
+    proches) et les noeuds d'AST de ces instructions sont recalculés. L'arbre et l'AST obtenus sont
+    identiques à ceux d'une compilation complète du nouveau texte ; en cas d'erreur, le source est
+    recompilé entièrement pour signaler la même erreur qu'une compilation complète.
+    Le graphique de l'AST doit garder ses lignes dans une liste body (comme graphviz.Digraph)
+    """
+    def __init__(self, text, ast_graph_factory=None):
+        """
+        :param text: texte source initial
+        :param ast_graph_factory: fonction retournant un nouveau graphique pour l'AST
+        (par défaut, un graphviz.Digraph)
+        """
+        self.ast_graph_factory = ast_graph_factory
+        self.lexer = Lexer()
+        self.lines = []
+        # Lexèmes de chaque ligne (None si la ligne contient une erreur lexicale)
+        self.line_lexems = []
+        self.n_invalid_lines = 0
+        # Instructions de la dernière compilation réussie, dans l'ordre (None après une erreur)
+        self.entries = None
+        # Instructions citant chaque nom, triées par rang : déclarations, mariages et liens de filiation
+        self.declarations = {}
+        self.marriages = {}
+        self.filiations = {}
+        self.ftree = None
+        self.ast = None
+        # Déclaration de la racine de l'arbre
+        self.first_declaration = None
+        # Nombre de lignes de l'AST précédant celles des instructions
+        self.ast_header = 0
+        self.edit(1, 0, text)
+
+    @property
+    def text(self):
+        return "\n".join(self.lines)
+
+    @property
+    def statements(self):
+        """
+        Noeuds des instructions de la dernière compilation réussie (None après une erreur)
+        :return:
+        """
+        if self.entries is None:
+            return None
+        return [entry.node for entry in self.entries]
+
+    def edit(self, first_line, last_line, text):
+        """
+        Remplace les lignes first_line à last_line (numérotées à partir de 1, incluses) par text
+        (pour une insertion avant la ligne n : first_line = n, last_line = n - 1),
+        puis met à jour l'arbre et l'AST, qui sont retournés
+        :param first_line:
+        :param last_line:
+        :param text:
+        :return:
+        """
+        new_lines = text.split("\n")
+        delta = len(new_lines) - (last_line - first_line + 1)
+        removed = self.line_lexems[first_line - 1:last_line]
+        self.n_invalid_lines -= sum(1 for lexems in removed if lexems is None)
+        self.lines[first_line - 1:last_line] = new_lines
+        self.line_lexems[first_line - 1:last_line] = [None] * len(new_lines)
+        self.n_invalid_lines += len(new_lines)
+
+        # Les positions des instructions ne correspondent plus au source tant qu'il n'est pas recompilé
+        entries, self.entries = self.entries, None
+        self.relex_invalid_lines(first_line - 1, first_line - 1 + len(new_lines))
+        if entries is None or not self.patch(entries, first_line, last_line, delta):
+            self.rebuild()
+        return self.ftree, self.ast
+
+    def relex_invalid_lines(self, start, stop):
+        """
+        Lexe les lignes d'indice start à stop (exclu), ainsi que les lignes encore en erreur
+        :param start:
+        :param stop:
+        :return:
+        """
+        to_lex = list(range(start, stop))
+        if self.n_invalid_lines > len(to_lex):
+            to_lex = [index for index, lexems in enumerate(self.line_lexems) if lexems is None]
+        for index in to_lex:
+            self.lexer.lexems = []
+            self.lexer.lex_line(index + 1, self.lines[index])
+            self.line_lexems[index] = self.lexer.lexems
+            self.n_invalid_lines -= 1
+
+    def gather(self, after=None, after_line=None, before=None, before_line=None):
+        """
+        Retourne les lexèmes (sans les commentaires) situés entre le lexème after, de la ligne after_line
+        (exclu, début du source si None) et le lexème before, de la ligne before_line (exclu, fin du
+        source si None). Les numéros de ligne des lexèmes retournés sont mis à jour (ceux des autres
+        lexèmes ne le sont pas : seules les positions des instructions sont décalées)
+        :param after:
+        :param after_line:
+        :param before:
+        :param before_line:
+        :return:
+        """
+        first = 0 if after is None else after_line - 1
+        last = len(self.lines) if before is None else before_line
+        started = after is None
+        tokens = []
+        for index in range(first, last):
+            for lexem in self.line_lexems[index]:
+                if not started:
+                    started = lexem is after
+                elif lexem is before:
+                    return tokens
+                elif lexem.tag != "COMMENT":
+                    lexem.line = index + 1
+                    tokens.append(lexem)
+        return tokens
+
+    def rebuild(self):
+        """
+        Recompile entièrement le source, instruction par instruction, comme le parser :
+        la première erreur rencontrée est levée
+        :return:
+        """
+        self.entries = None
+        tokens = self.gather()
+        header = Parser(tokens[:2])
+        header.expect("KW_TREE")
+        header.expect("L_CURL_BRACKET")
+
+        builder = TreeBuilder()
+        self.ftree = builder.tree
+        self.ast = ASTRenderer(self.ast_graph_factory() if self.ast_graph_factory is not None else None)
+        self.ast_header = len(self.ast.graph.body)
+        self.first_declaration = None
+        self.declarations, self.marriages, self.filiations = {}, {}, {}
+        entries = []
+        start = 2
+        while True:
+            if start >= len(tokens):
+                raise ParsingException("ERROR: No more lexems left.")
+            if tokens[start].tag == "R_CURL_BRACKET":
+                break
+            stop = start
+            while stop < len(tokens) and tokens[stop].tag != "TERMINATOR":
+                stop += 1
+            entry = StatementEntry(tokens[start:stop + 1], Parser(tokens[start:stop + 1]).read_stmt())
+            start = stop + 1
+            entry.node.accept(builder)
+            if isinstance(entry.node, Declaration):
+                entry.person = self.ftree.persons[-1]
+                if self.first_declaration is None:
+                    self.first_declaration = entry
+            self.render(entry)
+            entry.order = ORDER_STEP * (len(entries) + 1)
+            self.index(entry)
+            entries.append(entry)
+        self.entries = entries
+        self.ast.graph.body[self.ast_header:] = chain.from_iterable(entry.ast_lines for entry in entries)
+        return self.ftree, self.ast
+
+    def patch(self, entries, first_line, last_line, delta):
+        """
+        Met à jour l'arbre et l'AST après le remplacement des lignes first_line à last_line par
+        des lignes en nombre différent de delta. Retourne False si le source doit être recompilé
+        entièrement (source incorrect, fin du bloc family_tree déplacée...)
+        :param entries: instructions de la compilation précédente
+        :param first_line:
+        :param last_line:
+        :param delta:
+        :return:
+        """
+        # Instructions entièrement avant les lignes modifiées (inchangées) et instructions
+        # entières à partir de stop, après les lignes modifiées (seulement décalées)
+        start = bisect_left(entries, first_line, key=attrgetter("last_line"))
+        stop = bisect_right(entries, last_line, key=attrgetter("first_line"))
+        after = (entries[start - 1].tokens[-1], entries[start - 1].last_line) if start > 0 else (None, None)
+        while True:
+            if stop < len(entries):
+                tokens = self.gather(*after, entries[stop].tokens[0], entries[stop].first_line + delta)
+            else:
+                tokens = self.gather(*after)
+            chunks = split_statements(tokens, start == 0, stop == len(entries))
+            if chunks is not None:
+                break
+            if stop == len(entries):
+                return False
+            # La dernière instruction de la zone se termine plus loin : la zone s'étend à l'instruction suivante
+            stop += 1
+
+        # Les instructions de même contenu en début et en fin de zone sont conservées
+        old = entries[start:stop]
+        keys = [content_key(chunk) for chunk in chunks]
+        n_kept = min(len(old), len(chunks))
+        prefix = 0
+        while prefix < n_kept and old[prefix].key == keys[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < n_kept - prefix and old[len(old) - 1 - suffix].key == keys[len(chunks) - 1 - suffix]:
+            suffix += 1
+        try:
+            added = [StatementEntry(chunk, Parser(chunk).read_stmt(), key)
+                     for chunk, key in zip(chunks[prefix:len(chunks) - suffix], keys[prefix:len(keys) - suffix])]
+        except ParsingException:
+            return False
+        removed = old[prefix:len(old) - suffix]
+        for entry, chunk in chain(zip(old[:prefix], chunks), zip(old[len(old) - suffix:], chunks[len(chunks) - suffix:])):
+            entry.move(chunk)
+        if delta != 0:
+            for entry in entries[stop:]:
+                entry.shift(delta)
+
+        new_entries = entries[:start + prefix] + added + entries[stop - suffix:]
+        self.number(new_entries, start + prefix, len(added))
+        self.entries = new_entries
+        try:
+            if not self.update(removed, added):
+                return False
+        except Exception:
+            self.entries = None
+            raise
+        return True
+
+    @staticmethod
+    def number(entries, first, count):
+        """
+        Attribue un rang aux count instructions insérées à partir de l'indice first
+        (en renumérotant toutes les instructions si les rangs voisins sont trop proches)
+        :param entries:
+        :param first:
+        :param count:
+        :return:
+        """
+        if count == 0:
+            return
+        low = entries[first - 1].order if first > 0 else 0
+        if first + count < len(entries):
+            high = entries[first + count].order
+        else:
+            high = low + ORDER_STEP * (count + 1)
+        if high - low > count:
+            step = (high - low) // (count + 1)
+            for rank, entry in enumerate(entries[first:first + count], 1):
+                entry.order = low + step * rank
+        else:
+            for rank, entry in enumerate(entries, 1):
+                entry.order = ORDER_STEP * rank
+
+    def index(self, entry):
+        node = entry.node
+        if isinstance(node, Declaration):
+            insort(self.declarations.setdefault(node.name.value, []), entry, key=order_key)
+            return
+        index = self.marriages if isinstance(node, MaritalLink) else self.filiations
+        for name in set(name.value for name in node.names):
+            insort(index.setdefault(name, []), entry, key=order_key)
+
+    def unindex(self, entry):
+        node = entry.node
+        if isinstance(node, Declaration):
+            index, names = self.declarations, [node.name.value]
+        else:
+            index = self.marriages if isinstance(node, MaritalLink) else self.filiations
+            names = set(name.value for name in node.names)
+        for name in names:
+            entries = index[name]
+            entries.remove(entry)
+            if not entries:
+                del index[name]
+
+    def update(self, removed, added):
+        """
+        Retire de l'arbre et de l'AST les instructions supprimées, y ajoute les nouvelles et recalcule
+        les liens des personnes concernées. Retourne False si le nouveau source est incorrect
+        (personne déclarée deux fois, lien vers une personne non encore déclarée)
+        :param removed:
+        :param added:
+        :return:
+        """
+        tree = self.ftree
+        dirty = set()
+        declared = set()
+        for entry in removed:
+            self.unindex(entry)
+            dirty.update(name.value for name in entry.node.names)
+            if entry.person is not None:
+                declared.add(entry.person.name)
+                tree.remove_person(entry.person)
+        for entry in added:
+            self.index(entry)
+            dirty.update(name.value for name in entry.node.names)
+            node = entry.node
+            if isinstance(node, Declaration):
+                declared.add(node.name.value)
+                if (node.name.value, to_date(node.birthdate)) in tree.persons_by_key:
+                    return False
+                entry.person = person = Person(tree, node.name.value, node.birthdate, node.deathdate)
+                # La personne est placée selon l'ordre des déclarations
+                self.insert_person(tree.persons, person)
+                self.insert_person(tree.persons_by_name[person.name], person)
+
+        for name in dirty:
+            links = [index[name][0].order for index in (self.marriages, self.filiations) if name in index]
+            declarations = self.declarations.get(name)
+            if links and (declarations is None or min(links) < declarations[0].order):
+                return False
+
+        # Personnes dont les liens peuvent avoir changé : celles qui sont citées par les instructions
+        # modifiées, celles qui leur sont liées et les personnes liées à ces dernières
+        affected = set(dirty)
+        for _ in range(2):
+            for name in list(affected):
+                affected.update(self.neighbours(name))
+        for name in affected:
+            for person in tree.persons_by_name.get(name, ()):
+                person.spouse = person.wedding_date = None
+                person.parents = []
+                person.children = []
+        for name in affected:
+            if name in tree.persons_by_name:
+                self.relink(tree.persons_by_name[name][0])
+        tree.racine = tree.persons[0] if tree.persons else None
+
+        self.update_ast(added, removed, declared)
+        return True
+
+    def insert_person(self, persons, person):
+        """
+        Déplace la personne person, ajoutée à la fin de persons, à la place de sa déclaration
+        :param persons:
+        :param person:
+        :return:
+        """
+        persons.pop()
+        order = self.declaration_entry(person).order
+        persons.insert(bisect_left(persons, order, key=lambda other: self.declaration_entry(other).order), person)
+
+    def declaration_entry(self, person):
+        for entry in self.declarations[person.name]:
+            if entry.person is person:
+                return entry
+        raise KeyError(person.name)
+
+    def neighbours(self, name):
+        """
+        Noms cités avec name par un mariage ou un lien de filiation
+        :param name:
+        :return:
+        """
+        for index in (self.marriages, self.filiations):
+            for entry in index.get(name, ()):
+                for other in entry.node.names:
+                    yield other.value
+
+    def resolve(self, name):
+        # Comme TreeBuilder, un lien désigne le premier homonyme déclaré
+        return self.ftree.persons_by_name[name][0]
+
+    def spouse_at(self, person, entry):
+        """
+        Retourne le conjoint de person au moment de l'instruction entry (défini par son dernier mariage
+        précédent), ou None
+        :param person:
+        :param entry:
+        :return:
+        """
+        marriages = self.marriages.get(person.name, [])
+        rank = bisect_left(marriages, entry.order, key=order_key)
+        if rank == 0:
+            return None
+        node = marriages[rank - 1].node
+        return self.resolve(node.spouse2.value if node.spouse1.value == person.name else node.spouse1.value)
+
+    def relink(self, person):
+        """
+        Recalcule les liens d'une personne à partir des instructions qui la concernent, dans l'ordre
+        du source, comme s'ils avaient été définis par TreeBuilder
+        :param person:
+        :return:
+        """
+        name = person.name
+        partners = set()
+        for entry in self.marriages.get(name, ()):
+            node = entry.node
+            other = node.spouse2.value if node.spouse1.value == name else node.spouse1.value
+            partners.add(other)
+            person.spouse = self.resolve(other)
+            if node.wedding_date is not None:
+                person.wedding_date = to_date(node.wedding_date)
+
+        # Liens de filiation où la personne est parent, enfant, ou conjoint du parent
+        filiations = {id(entry): entry for other in chain([name], partners)
+                      for entry in self.filiations.get(other, ())}
+        for entry in sorted(filiations.values(), key=order_key):
+            parent = self.resolve(entry.node.parent.value)
+            child = self.resolve(entry.node.child.value)
+            spouse = self.spouse_at(parent, entry)
+            if parent is person:
+                person.children.append(child)
+            if spouse is person:
+                person.children.append(child)
+            if child is person:
+                person.parents.append(parent)
+                if spouse is not None:
+                    person.parents.append(spouse)
+
+    def render(self, entry):
+        """
+        Dessine l'instruction et conserve ses lignes d'AST, retirées du graphique
+        :param entry:
+        :return:
+        """
+        body = self.ast.graph.body
+        start = len(body)
+        entry.node.accept(self.ast)
+        entry.ast_lines = body[start:]
+        del body[start:]
+
+    def update_ast(self, added, removed, declared):
+        """
+        Redessine les instructions ajoutées et celles dont le dessin dépend des déclarations modifiées
+        (liens citant un nom déclaré, première déclaration), puis réassemble l'AST
+        :param added:
+        :param removed:
+        :param declared: noms dont les déclarations ont changé
+        :return:
+        """
+        renderer = self.ast
+        persons, persons_by_name = self.ftree.persons, self.ftree.persons_by_name
+        first = self.declaration_entry(persons[0]) if persons else None
+        to_render = {id(entry): entry for entry in added}
+        old_first = self.first_declaration
+        if first is not old_first:
+            if first is not None:
+                to_render[id(first)] = first
+            # L'ancienne racine est redessinée si elle n'a pas été supprimée
+            if old_first is not None and old_first.person in persons_by_name.get(old_first.person.name, ()):
+                to_render[id(old_first)] = old_first
+            self.first_declaration = first
+            renderer.racine = None if first is None else first.node
+        for name in declared:
+            for index in (self.marriages, self.filiations):
+                for entry in index.get(name, ()):
+                    to_render[id(entry)] = entry
+        declared = declared | {entry.node.name.value for entry in to_render.values() if entry.person is not None}
+
+        # Les liens sont dessinés avec les dates de naissance des premiers homonymes déclarés
+        self.reset_birthdates(declared)
+        for entry in to_render.values():
+            self.render(entry)
+        # Les déclarations redessinées ont ajouté leur date de naissance
+        self.reset_birthdates(declared)
+        if to_render or removed:
+            renderer.graph.body[self.ast_header:] = chain.from_iterable(entry.ast_lines for entry in self.entries)
+
+    def reset_birthdates(self, names):
+        for name in names:
+            if name in self.declarations:
+                self.ast.birthdates[name] = [entry.node.birthdate for entry in self.declarations[name]]
+            else:
+                self.ast.birthdates.pop(name, None)
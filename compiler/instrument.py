@@ -0,0 +1,247 @@
+# -*- encoding: utf-8 -*-
+
+import contextlib
+import io
+import json
+import sys
+import time
+import tracemalloc
+
+# Nombre de fonctions conservées dans le rapport de cProfile
+DEFAULT_TOP_FUNCTIONS = 25
+
+
+class CountingStream:
+    """
+    Flux texte qui transmet les écritures au flux enveloppé en comptant les octets émis
+    """
+    def __init__(self, stream, instrumentation, counter):
+        self.stream = stream
+        self.instrumentation = instrumentation
+        self.counter = counter
+
+    def write(self, text):
+        self.instrumentation.count(self.counter, len(text.encode("utf-8")))
+        return self.stream.write(text)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class Instrumentation:
+    """
+    Mesures d'une compilation : durée de chaque phase, compteurs (lexèmes, instructions,
+    recherches de personnes, octets émis), et en option profil des fonctions (cProfile)
+    et pic mémoire de chaque phase (tracemalloc).
+    Les phases peuvent s'imbriquer : la durée d'une phase exclut celle des phases qu'elle
+    contient (le lexing, consommé au fil du parsing, n'est pas compté dans le parsing)
+    """
+    enabled = True
+
+    def __init__(self, profile_functions=False, trace_memory=False, callback=None,
+                 top_functions=DEFAULT_TOP_FUNCTIONS):
+        """
+        :param profile_functions: active cProfile pendant toute la compilation
+        :param trace_memory: mesure le pic mémoire des phases de premier niveau
+        :param callback: fonction appelée avec le rapport (dictionnaire) par finish
+        :param top_functions: nombre de fonctions du profil conservées dans le rapport
+        """
+        self.callback = callback
+        self.top_functions = top_functions
+        self.timings = {}
+        self.counters = {}
+        self.memory = {}
+        self.metadata = {}
+        # Pile des phases en cours : (nom, début, durée des phases imbriquées)
+        self.stack = []
+        self.start_time = time.perf_counter()
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.profiler = None
+        if profile_functions:
+            # cProfile et pstats ne sont importés que si le profil est demandé
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def start(self, name):
+        """
+        Démarre une phase
+        :param name:
+        :return:
+        """
+        if self.trace_memory and not self.stack:
+            tracemalloc.reset_peak()
+        self.stack.append([name, time.perf_counter(), 0.0])
+
+    def stop(self):
+        """
+        Termine la phase en cours
+        :return:
+        """
+        name, start, nested = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        self.timings[name] = self.timings.get(name, 0.0) + elapsed - nested
+        if self.stack:
+            self.stack[-1][2] += elapsed
+        elif self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            self.memory[name] = max(self.memory.get(name, 0.0), peak)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Mesure la durée du bloc sous le nom de phase name
+        :param name:
+        :return:
+        """
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def count(self, counter, value=1):
+        """
+        Incrémente un compteur
+        :param counter:
+        :param value:
+        :return:
+        """
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def iter_phase(self, name, counter, iterable):
+        """
+        Enveloppe un itérable (par exemple le flux de lexèmes) : le temps passé à produire
+        chaque élément est compté dans la phase name et les éléments dans le compteur counter
+        :param name:
+        :param counter:
+        :param iterable:
+        :return:
+        """
+        iterator = iter(iterable)
+        count = 0
+        try:
+            while True:
+                self.start(name)
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    self.stop()
+                count += 1
+                yield item
+        finally:
+            self.count(counter, count)
+
+    def wrap_stream(self, stream, counter):
+        """
+        Retourne un flux qui compte dans counter les octets écrits sur stream
+        :param stream:
+        :param counter:
+        :return:
+        """
+        return CountingStream(stream, self, counter)
+
+    def report(self):
+        """
+        Retourne le rapport des mesures, sérialisable en JSON
+        :return:
+        """
+        counters = dict(self.counters)
+        if counters.get("statements"):
+            counters["lookups_per_statement"] = counters.get("lookups", 0) / counters["statements"]
+        report = dict(self.metadata)
+        report["total_seconds"] = time.perf_counter() - self.start_time
+        report["phases"] = {name: {"seconds": seconds} for name, seconds in self.timings.items()}
+        for name, peak in self.memory.items():
+            report["phases"][name]["peak_mib"] = peak
+        report["counters"] = counters
+        if self.profiler is not None:
+            report["functions"] = self.profile_report()
+        return report
+
+    def profile_report(self):
+        """
+        Retourne les fonctions les plus coûteuses (temps cumulé) relevées par cProfile
+        :return:
+        """
+        import pstats
+        stats = pstats.Stats(self.profiler, stream=io.StringIO())
+        functions = []
+        for (filename, line, function), (_, calls, tottime, cumtime, _) in stats.stats.items():
+            functions.append({"function": f"{filename}:{line}({function})", "calls": calls,
+                              "tottime": tottime, "cumtime": cumtime})
+        functions.sort(key=lambda entry: entry["cumtime"], reverse=True)
+        return functions[:self.top_functions]
+
+    def finish(self):
+        """
+        Arrête les mesures, transmet le rapport à la fonction de rappel et le retourne
+        :return:
+        """
+        if self.profiler is not None:
+            self.profiler.disable()
+        report = self.report()
+        if self.trace_memory:
+            tracemalloc.stop()
+        if self.callback is not None:
+            self.callback(report)
+        return report
+
+
+class NullInstrumentation:
+    """
+    Instrumentation désactivée : mêmes méthodes qu'Instrumentation, sans aucune mesure
+    (les itérables et les flux sont retournés tels quels)
+    """
+    enabled = False
+
+    def start(self, name):
+        pass
+
+    def stop(self):
+        pass
+
+    def phase(self, name):
+        return contextlib.nullcontext()
+
+    def count(self, counter, value=1):
+        pass
+
+    def iter_phase(self, name, counter, iterable):
+        return iterable
+
+    def wrap_stream(self, stream, counter):
+        return stream
+
+    def report(self):
+        return {}
+
+    def finish(self):
+        return {}
+
+
+NULL_INSTRUMENTATION = NullInstrumentation()
+
+
+def write_report(report, output="-"):
+    """
+    Écrit le rapport au format JSON dans un fichier, ou sur la sortie d'erreur pour "-"
+    (la sortie standard porte déjà la frise)
+    :param report:
+    :param output:
+    :return:
+    """
+    if output == "-":
+        json.dump(report, sys.stderr, indent=2)
+        sys.stderr.write("\n")
+    else:
+        with open(output, "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, indent=2)
@@ -0,0 +1,279 @@
+from array import array
+from bisect import bisect_left
+from collections import deque
+from itertools import chain
+
+from FamilyTree import FamilyTreeException
+
+
+class AncestorClosure:
+    """
+    Fermeture des ancêtres d'une personne, stockée de façon compacte : identifiants entiers
+    des ancêtres triés et distances correspondantes (nombre de générations), dans deux array
+    """
+    __slots__ = ("ids", "depths")
+
+    def __init__(self, ids, depths):
+        self.ids = ids
+        self.depths = depths
+
+    def __len__(self):
+        return len(self.ids)
+
+    def depth(self, ancestor_id):
+        """
+        Retourne la distance de l'ancêtre d'identifiant ancestor_id (recherche dichotomique),
+        ou None s'il n'est pas un ancêtre
+        :param ancestor_id:
+        :return:
+        """
+        index = bisect_left(self.ids, ancestor_id)
+        if index < len(self.ids) and self.ids[index] == ancestor_id:
+            return self.depths[index]
+        return None
+
+
+class KinshipIndex:
+    """
+    Index de parenté d'un arbre généalogique : pour chaque personne, la fermeture de ses
+    ancêtres avec leur distance (nombre de générations), calculée une seule fois à partir
+    de celles de ses parents puis conservée.
+    Comme chaque personne a deux parents, les liens forment un graphe orienté acyclique et
+    non un arbre : on indexe donc les fermetures d'ancêtres plutôt qu'un parcours eulérien.
+    Les personnes sont numérotées et chaque fermeture est un couple d'array d'entiers
+    (identifiants triés et distances, 8 octets par ancêtre), partagé par les enfants d'un
+    même couple. « X est-il un ancêtre de Y » est une recherche dichotomique et l'ancêtre
+    commun le plus proche ne parcourt que la plus petite des deux fermetures
+    """
+    def __init__(self, tree):
+        self.tree = tree
+        # Identifiants entiers des personnes (attribués dans l'ordre de l'arbre, puis à la demande)
+        self.ids = {}
+        self.persons = []
+        # identifiant -> AncestorClosure
+        self.closures = {}
+        # identifiants triés des parents -> fermeture commune à leurs enfants
+        self.families = {}
+
+    def get_id(self, person):
+        """
+        Retourne l'identifiant entier d'une personne (attribué à sa première utilisation)
+        :param person:
+        :return:
+        """
+        identifier = self.ids.get(person)
+        if identifier is None:
+            identifier = self.ids[person] = len(self.persons)
+            self.persons.append(person)
+        return identifier
+
+    def build(self):
+        """
+        Calcule la fermeture des ancêtres de toutes les personnes, des plus anciennes aux
+        plus jeunes (tri topologique). Lève une FamilyTreeException en cas de cycle
+        :return:
+        """
+        self.tree.check_no_cycle()
+        for person in self.tree.persons:
+            self.get_id(person)
+        in_degree = {person: len(get_parents(person)) for person in self.tree.persons}
+        queue = deque(person for person, degree in in_degree.items() if degree == 0)
+        while queue:
+            person = queue.popleft()
+            self.closures[self.ids[person]] = self.merge_parents(person)
+            for child in set(person.children):
+                in_degree[child] -= 1
+                if in_degree[child] == 0:
+                    queue.append(child)
+        return self
+
+    def family_key(self, person):
+        """
+        Retourne les identifiants triés des parents d'une personne (clef de la fermeture partagée
+        par les enfants d'un même couple)
+        :param person:
+        :return:
+        """
+        return tuple(sorted(self.get_id(parent) for parent in get_parents(person)))
+
+    def merge_parents(self, person):
+        """
+        Calcule la fermeture des ancêtres d'une personne à partir de celles de ses parents
+        (qui doivent déjà être indexées), ou retourne celle de ses frères et soeurs
+        :param person:
+        :return:
+        """
+        parents = self.family_key(person)
+        closure = self.families.get(parents)
+        if closure is not None:
+            return closure
+        merged = {}
+        for parent in parents:
+            parent_closure = self.closures[parent]
+            depths = dict(zip(parent_closure.ids, map((1).__add__, parent_closure.depths)))
+            depths[parent] = 1
+            # Un ancêtre des deux parents garde la plus petite distance
+            for ancestor in depths.keys() & merged.keys():
+                if merged[ancestor] < depths[ancestor]:
+                    depths[ancestor] = merged[ancestor]
+            merged.update(depths)
+        ids = sorted(merged)
+        closure = AncestorClosure(array('i', ids), array('i', map(merged.__getitem__, ids)))
+        self.families[parents] = closure
+        return closure
+
+    def closure(self, person):
+        """
+        Retourne la fermeture des ancêtres d'une personne, en complétant l'index
+        si nécessaire (parcours itératif, sans récursion)
+        :param person:
+        :return:
+        """
+        closure = self.closures.get(self.get_id(person))
+        if closure is not None:
+            return closure
+        # Parcours en profondeur : une personne est indexée après tous ses parents
+        stack = [(person, False)]
+        in_progress = set()
+        while stack:
+            current, parents_done = stack.pop()
+            identifier = self.get_id(current)
+            if identifier in self.closures:
+                continue
+            if parents_done:
+                in_progress.discard(current)
+                self.closures[identifier] = self.merge_parents(current)
+                continue
+            in_progress.add(current)
+            stack.append((current, True))
+            for parent in get_parents(current):
+                if parent in in_progress:
+                    raise FamilyTreeException(f"Les liens de filiation de {current.name} forment un cycle")
+                if self.get_id(parent) not in self.closures:
+                    stack.append((parent, False))
+        return self.closures[self.ids[person]]
+
+    def ancestor_depths(self, person):
+        """
+        Retourne le dictionnaire {ancêtre: distance} d'une personne
+        :param person:
+        :return:
+        """
+        closure = self.closure(person)
+        return {self.persons[ancestor]: depth for ancestor, depth in zip(closure.ids, closure.depths)}
+
+    def is_ancestor(self, ancestor, person):
+        """
+        Indique si ancestor est un ancêtre de person
+        :param ancestor:
+        :param person:
+        :return:
+        """
+        return self.closure(person).depth(self.get_id(ancestor)) is not None
+
+    def common_ancestors(self, person1, person2):
+        """
+        Retourne les ancêtres communs (chaque personne comptant comme son propre ancêtre,
+        à la distance 0) sous la forme {ancêtre: (distance depuis person1, distance depuis person2)}
+        :param person1:
+        :param person2:
+        :return:
+        """
+        closure1 = self.closure(person1)
+        closure2 = self.closure(person2)
+        id1, id2 = self.get_id(person1), self.get_id(person2)
+        # Intersection des fermetures (ensembles d'entiers), puis recherche des distances des seuls ancêtres communs
+        if len(closure1) > len(closure2):
+            common_ids = set(closure2.ids).intersection(closure1.ids)
+        else:
+            common_ids = set(closure1.ids).intersection(closure2.ids)
+        # Chaque personne compte comme son propre ancêtre
+        for identifier, closure in ((id1, closure2), (id2, closure1)):
+            if identifier == id1 == id2 or closure.depth(identifier) is not None:
+                common_ids.add(identifier)
+        common = {}
+        for ancestor in sorted(common_ids):
+            depth1 = 0 if ancestor == id1 else closure1.depth(ancestor)
+            depth2 = 0 if ancestor == id2 else closure2.depth(ancestor)
+            common[self.persons[ancestor]] = (depth1, depth2)
+        return common
+
+    def nearest_common_ancestors(self, person1, person2):
+        """
+        Retourne la liste des ancêtres communs les plus proches (souvent un couple)
+        et leurs distances, ou une liste vide s'il n'y en a pas
+        :param person1:
+        :param person2:
+        :return:
+        """
+        common = self.common_ancestors(person1, person2)
+        if not common:
+            return []
+        best = min(sum(depths) for depths in common.values())
+        return [(ancestor, depths) for ancestor, depths in common.items() if sum(depths) == best]
+
+    def cousinship(self, person1, person2):
+        """
+        Retourne le degré de cousinage (degré, nombre de générations d'écart) entre deux personnes,
+        ou None si elles n'ont pas d'ancêtre commun.
+        Degré 0 : frères et soeurs (ou lignée directe si l'une descend de l'autre),
+        degré 1 : cousins germains, degré 2 : cousins issus de germains, etc.
+        :param person1:
+        :param person2:
+        :return:
+        """
+        nearest = self.nearest_common_ancestors(person1, person2)
+        if not nearest:
+            return None
+        depth1, depth2 = nearest[0][1]
+        return max(min(depth1, depth2) - 1, 0), abs(depth1 - depth2)
+
+    def descendants(self, person):
+        """
+        Retourne l'ensemble des descendants d'une personne (parcours en largeur,
+        proportionnel au nombre de descendants)
+        :param person:
+        :return:
+        """
+        found = set()
+        queue = deque([person])
+        while queue:
+            for child in queue.popleft().children:
+                if child not in found:
+                    found.add(child)
+                    queue.append(child)
+        return found
+
+    def add_familial_link(self, parent, child):
+        """
+        Ajoute un lien de filiation (comme l'instruction parent -> child) et met l'index à jour :
+        seules les fermetures de l'enfant et de ses descendants sont invalidées
+        :param parent:
+        :param child:
+        :return:
+        """
+        if parent is child or self.is_ancestor(child, parent):
+            raise FamilyTreeException(f"Le lien {parent.name} -> {child.name} formerait un cycle")
+        parent.define_familial_link(child)
+        self.invalidate(child)
+
+    def invalidate(self, person):
+        """
+        Retire de l'index la fermeture d'une personne et celles de ses descendants
+        :param person:
+        :return:
+        """
+        for invalid in chain([person], self.descendants(person)):
+            self.closures.pop(self.get_id(invalid), None)
+            # La fermeture partagée avec les frères et soeurs est aussi périmée
+            self.families.pop(self.family_key(invalid), None)
+
+
+def get_parents(person):
+    """
+    Retourne les parents connus d'une personne, sans doublon
+    (les arbres relus d'anciens fichiers binaires peuvent contenir des parents inconnus, None)
+    :param person:
+    :return:
+    """
+    return list(dict.fromkeys(parent for parent in person.parents if parent is not None))
@@ -1,7 +1,13 @@
 # -*- encoding: utf-8 -*-
 
+import os
 import re
+import mmap
+from array import array
+from collections import deque
+from itertools import accumulate, islice
 from constants import LEXEM_REGEXES
+from diagnostics import Diagnostic, Diagnostics
 
 import logging
 import datetime
@@ -19,22 +25,97 @@ class Lexem:
     - Tag: Type of the lexem, matched with the regex
     - Value: Its actual value (e.g. the identifier name)
     - Position: Line number and position in the line
+    The position is stored as two integer slots (line, column) to keep
+    lexems small, and rebuilt as a [line, column] list on access.
     """
 
+    __slots__ = ("tag", "value", "line", "column")
+
     def __init__(self, tag, value, position):
         self.tag = tag
         self.value = value
-        self.position = position
+        self.line, self.column = position
+
+    @property
+    def position(self):
+        return [self.line, self.column]
 
     def __repr__(self):
         return f"{self.tag}({self.value})"
 
 
+def compile_master_regex(lexem_regexes):
+    """
+    Compiles all the (pattern, tag) pairs into a single alternation.
+    Each pattern becomes a named group (T0, T1, ...) tried in the list order,
+    so the first matching alternative wins exactly like the legacy engine.
+    Returns the compiled regex and the group name -> tag mapping.
+    """
+    groups = []
+    tags = {}
+    for index, (pattern, tag) in enumerate(lexem_regexes):
+        group_name = f"T{index}"
+        groups.append(f"(?P<{group_name}>{pattern})")
+        tags[group_name] = tag
+    return re.compile("|".join(groups)), tags
+
+
+MASTER_REGEX, MASTER_TAGS = compile_master_regex(LEXEM_REGEXES)
+
+ENGINES = ("master", "legacy")
+
+# Tags of the kept lexems, indexed to send lexems between processes as bytes
+TAGS = [tag for tag in dict.fromkeys(tag for _, tag in LEXEM_REGEXES) if tag is not None]
+TAG_INDEX = {tag: index for index, tag in enumerate(TAGS)}
+
+# Size of the chunks lexed in parallel (in bytes)
+DEFAULT_CHUNK_SIZE = 8 * 2 ** 20
+
+
+def iter_lines(source, encoding="utf-8"):
+    """
+    Lazily yields the text lines of a source, without loading it as a whole.
+    The source can be a str, a bytes-like buffer (bytes, bytearray, mmap),
+    a file object opened in text or binary mode, or any iterable of lines.
+    Buffers (and files opened in binary mode) are split on "\n" only, unlike
+    readlines() on a text-mode file, which uses universal newlines: the "\r"
+    of "\r\n" stays at the end of the line (lex_line strips it), but a lone
+    "\r" does not end a line and is left inside it, where it is not a valid
+    lexem. Line numbers and columns thus match lex_file only for sources
+    whose lines end with "\n" or "\r\n". Text-mode file objects keep their
+    own newline handling. iter_lex_file and iter_lex_file_parallel read the
+    file in binary mode, so they recognise "\n" only as well.
+    """
+    if isinstance(source, (str, bytes, bytearray, mmap.mmap)):
+        newline = "\n" if isinstance(source, str) else b"\n"
+        start = 0
+        end = len(source)
+        while start < end:
+            stop = source.find(newline, start)
+            if stop == -1:
+                stop = end
+            line = source[start:stop]
+            start = stop + 1
+            yield line if isinstance(line, str) else line.decode(encoding)
+    else:
+        for line in source:
+            yield line if isinstance(line, str) else line.decode(encoding)
+
+
 class Lexer:
-    def __init__(self):
+    def __init__(self, engine="master", diagnostics=None):
         """
         Component in charge lexical analysis.
+        The engine is either "master" (single compiled alternation, default)
+        or "legacy" (one regex tried after the other at each position).
+        Without diagnostics, the first unknown character raises a LexerException.
+        With a diagnostics.Diagnostics collector, each run of unknown characters
+        is reported to it and skipped, and lexing goes on.
         """
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown lexer engine {engine!r}, expected one of {ENGINES}")
+        self.engine = engine
+        self.diagnostics = diagnostics
         self.lexems = []
         self.current_line_number = 0
         self.current_position = 0
@@ -56,22 +137,140 @@ class Lexer:
         Creates a lexem for every matched regular expression.
         Crawls through the input (list of lines).
         """
-        for line_nb, line in enumerate(input):
-            self.current_position = 0
-            self.current_line_number = (
-                line_nb + 1
-            )  # Python starts at 0, we need to start at 1
-            line = line.strip()
-            try:
-                self.match_line(line)
-            except LexerException as err:
-                logger.exception(err)
-                raise
+        # Python starts at 0, we need to start at 1
+        for line_nb, line in enumerate(input, 1):
+            self.lex_line(line_nb, line)
         return self.lexems
 
+    def lex_line(self, line_nb, line):
+        """
+        Appends the lexems of a single line to the lexems list.
+        """
+        self.current_position = 0
+        self.current_line_number = line_nb
+        line = line.strip()
+        try:
+            self.match_line(line)
+        except LexerException as err:
+            logger.exception(err)
+            raise
+
+    def iter_lex(self, source, first_line=1):
+        """
+        Streaming version of lex: lazily yields the lexems of a source
+        (see iter_lines for the accepted types), line after line.
+        Only the lexems of the current line are kept in memory.
+        """
+        for line_nb, line in enumerate(iter_lines(source), first_line):
+            start = len(self.lexems)
+            self.lex_line(line_nb, line)
+            if len(self.lexems) > start:
+                yield from self.lexems[start:]
+                del self.lexems[start:]
+
+    def iter_lex_file(self, file, use_mmap=True):
+        """
+        Streaming version of lex_file: the file is memory-mapped (or read
+        line by line) instead of being loaded with readlines().
+        """
+        with open(file, "rb") as input_file:
+            if not use_mmap:
+                yield from self.iter_lex(input_file)
+                return
+            try:
+                buffer = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be memory-mapped
+                return
+            with buffer:
+                yield from self.iter_lex(buffer)
+
+    def iter_lex_file_parallel(self, file, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Parallel version of iter_lex_file: the file is split into chunks of whole
+        lines (the grammar has no multi-line lexem), lexed in a process pool, and
+        the lexems are yielded in file order with their global line numbers.
+        Lexer errors surface in the same order as with iter_lex_file: diagnostics
+        are added line by line, and a LexerException is raised after the lexems
+        that precede it.
+        Files smaller than a chunk are lexed sequentially.
+        """
+        if os.path.getsize(file) <= chunk_size:
+            yield from self.iter_lex_file(file)
+            return
+        from concurrent.futures import ProcessPoolExecutor
+
+        bounds = split_lines(file, chunk_size)
+        workers = workers or os.cpu_count() or 1
+        executor = ProcessPoolExecutor(max_workers=workers)
+        try:
+            # First line number of each chunk
+            counts = executor.map(count_lines, [file] * len(bounds), *zip(*bounds))
+            first_lines = list(accumulate(counts, initial=1))
+            chunks = iter(zip(bounds, first_lines))
+
+            def submit(chunk):
+                (start, stop), first_line = chunk
+                return executor.submit(lex_chunk, file, start, stop, first_line, self.engine,
+                                       self.diagnostics is not None)
+
+            # Only a few chunks are lexed ahead of the consumer
+            pending = deque(submit(chunk) for chunk in islice(chunks, 2 * workers))
+            while pending:
+                result = pending.popleft().result()
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    pending.append(submit(chunk))
+                yield from self.merge_chunk(*result)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def merge_chunk(self, tags, values, value_ids, lines, columns, errors, exception):
+        """
+        Yields the lexems of a chunk returned by lex_chunk. Its diagnostics are
+        added before the lexems of their line, and its exception is raised last.
+        """
+        lexems = map(Lexem, map(TAGS.__getitem__, tags), map(values.__getitem__, value_ids),
+                     zip(lines, columns))
+        errors = deque(errors)
+        for lexem in lexems:
+            while errors and errors[0][1] <= lexem.line:
+                self.diagnostics.add(Diagnostic("lexer", *errors.popleft()))
+            yield lexem
+        while errors:
+            self.diagnostics.add(Diagnostic("lexer", *errors.popleft()))
+        if exception is not None:
+            raise exception
+
     def match_line(self, line):
         """
-        Tries to match a line with all regexes.
+        Tries to match a line with all regexes, using the selected engine.
+        """
+        if self.engine == "master":
+            self.match_line_master(line)
+        else:
+            self.match_line_legacy(line)
+
+    def match_line_master(self, line):
+        """
+        Scans a line in one pass with the precompiled master regex.
+        """
+        scanner = MASTER_REGEX.scanner(line, self.current_position)
+        while self.current_position < len(line):
+            match = scanner.match()
+            if match is None:
+                self.recover(line)
+                scanner = MASTER_REGEX.scanner(line, self.current_position)
+                continue
+            tag = MASTER_TAGS[match.lastgroup]
+            # Whitespaces have a None tag and are not kept
+            if tag is not None:
+                self.append_lexem(tag, match.group(0))
+            self.current_position = match.end(0)
+
+    def match_line_legacy(self, line):
+        """
+        Tries to match a line with all regexes, one after the other.
         """
         while self.current_position < len(line):
             # Test all regexes in order
@@ -82,15 +281,40 @@ class Lexer:
                 if match:
                     break
             # If all regexes were tested and none matched,
-            # raise an error!
+            # raise an error (or skip the unknown characters)!
             if not match:
-                raise LexerException(
-                    f"ERROR (lexer) at: ({self.current_line_number},{self.current_position}):\n"
-                    + line.strip() + "\n"
-                    + " " * len(line[: self.current_position])
-                    + "^" * len(line[self.current_position - 1 :])
-                    + f"\nLexems: {self.lexems}"
-                )
+                self.recover(line)
+
+    def recover(self, line):
+        """
+        Handles unknown characters at the current position: raises a LexerException,
+        or, when collecting diagnostics, reports the whole run of unknown
+        characters and moves past it.
+        """
+        if self.diagnostics is None:
+            self.raise_error(line)
+        start = self.current_position
+        position = start + 1
+        while position < len(line) and MASTER_REGEX.match(line, position) is None:
+            position += 1
+        self.current_position = position
+        self.diagnostics.add(Diagnostic(
+            "lexer",
+            f"ERROR (lexer) at: ({self.current_line_number},{start}): unexpected characters {line[start:position]!r}",
+            self.current_line_number, start,
+        ))
+
+    def raise_error(self, line):
+        """
+        Raises a LexerException pointing at the current position of the line.
+        """
+        raise LexerException(
+            f"ERROR (lexer) at: ({self.current_line_number},{self.current_position}):\n"
+            + line.strip() + "\n"
+            + " " * len(line[: self.current_position])
+            + "^" * len(line[self.current_position - 1 :])
+            + f"\nLexems: {self.lexems}"
+        )
 
     def match_lexem(self, line, lexem_regex):
         """
@@ -118,3 +342,64 @@ class Lexer:
         lexem = Lexem(tag, data, [self.current_line_number, self.current_position])
         self.lexems.append(lexem)
 
+
+
+# ==========================
+#      Parallel Lexing
+# ==========================
+
+def split_lines(file, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Returns the (start, stop) byte offsets of the chunks of a file:
+    about chunk_size bytes each, every chunk ending after a newline.
+    """
+    bounds = []
+    with open(file, "rb") as input_file, \
+            mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        start = 0
+        while start < len(buffer):
+            newline = buffer.find(b"\n", start + chunk_size)
+            stop = len(buffer) if newline == -1 else newline + 1
+            bounds.append((start, stop))
+            start = stop
+    return bounds
+
+
+def count_lines(file, start, stop):
+    """
+    Returns the number of newlines between two byte offsets of a file.
+    """
+    with open(file, "rb") as input_file, \
+            mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        return buffer[start:stop].count(b"\n")
+
+
+def lex_chunk(file, start, stop, first_line, engine="master", collect_errors=False):
+    """
+    Lexes the lines of a file between two byte offsets (in a worker process).
+    Returns the lexems as compact columns (tag indices, table of the distinct
+    values, value indices, lines, columns), which are much cheaper to send back
+    than Lexem objects, the diagnostics as (message, line, column) tuples, and
+    the LexerException that stopped the lexing, if any.
+    """
+    diagnostics = Diagnostics(None) if collect_errors else None
+    lexer = Lexer(engine, diagnostics)
+    tags = bytearray()
+    # Names and dates are repeated many times: each distinct value is sent once
+    values = {}
+    value_ids = array("i")
+    lines = array("i")
+    columns = array("i")
+    exception = None
+    with open(file, "rb") as input_file, \
+            mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        try:
+            for lexem in lexer.iter_lex(buffer[start:stop], first_line):
+                tags.append(TAG_INDEX[lexem.tag])
+                value_ids.append(values.setdefault(lexem.value, len(values)))
+                lines.append(lexem.line)
+                columns.append(lexem.column)
+        except LexerException as err:
+            exception = err
+    errors = [(diagnostic.message, diagnostic.line, diagnostic.column) for diagnostic in diagnostics or ()]
+    return bytes(tags), list(values), value_ids, lines, columns, errors, exception
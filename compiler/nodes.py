@@ -0,0 +1,179 @@
+# -*- encoding: utf-8 -*-
+
+# Noeuds de l'arbre syntaxique abstrait produit par le parser.
+# Les dates sont conservées telles qu'écrites dans la source (déjà validées par le parser) :
+# leur interprétation appartient aux passes (construction de l'arbre généalogique, rendu...)
+
+from abc import ABCMeta, abstractmethod
+
+
+class Node:
+    """
+    Noeud de l'AST. Chaque type de noeud a un nom (kind) qui désigne la méthode
+    visit_<kind> appelée par accept sur un visiteur
+    """
+    __slots__ = ()
+    kind = None
+
+    def accept(self, visitor):
+        """
+        Applique le visiteur au noeud
+        :param visitor:
+        :return: le résultat de la méthode visit_<kind> du visiteur
+        """
+        return getattr(visitor, "visit_" + self.kind)(self)
+
+    @property
+    def position(self):
+        return [self.line, self.column]
+
+
+class Name(Node):
+    """
+    Nom d'une personne, avec sa position dans la source
+    """
+    __slots__ = ("value", "line", "column")
+
+    def __init__(self, value, line, column):
+        self.value = value
+        self.line = line
+        self.column = column
+
+    def __repr__(self):
+        return f"Name({self.value!r}, {self.line}, {self.column})"
+
+    def shift(self, delta, column_delta=0):
+        self.line += delta
+        self.column += column_delta
+
+
+class Statement(Node, metaclass=ABCMeta):
+    """
+    Instruction du programme : sa position est celle du premier nom
+    """
+    __slots__ = ()
+
+    @property
+    @abstractmethod
+    def names(self):
+        """
+        Noms cités par l'instruction, dans l'ordre de la source
+        :return:
+        """
+
+    @property
+    def line(self):
+        return self.names[0].line
+
+    @property
+    def column(self):
+        return self.names[0].column
+
+    def shift(self, delta, column_delta=0):
+        """
+        Décale les positions de l'instruction (lignes insérées ou supprimées avant elle,
+        texte inséré ou supprimé avant elle sur sa première ligne)
+        :param delta: décalage des numéros de ligne
+        :param column_delta: décalage des colonnes des noms situés sur la première ligne
+        :return:
+        """
+        first_line = self.line
+        for name in self.names:
+            name.shift(delta, column_delta if name.line == first_line else 0)
+
+
+class Declaration(Statement):
+    """
+    NAME '(' DATE '-' (DATE)? ')' ';'
+    """
+    __slots__ = ("name", "birthdate", "deathdate")
+    kind = "declaration"
+
+    def __init__(self, name, birthdate, deathdate=None):
+        self.name = name
+        self.birthdate = birthdate
+        self.deathdate = deathdate
+
+    def __repr__(self):
+        return f"Declaration({self.name!r}, {self.birthdate!r}, {self.deathdate!r})"
+
+    @property
+    def names(self):
+        return (self.name,)
+
+
+class MaritalLink(Statement):
+    """
+    NAME '<=>' NAME ('(' DATE ')')? ';'
+    """
+    __slots__ = ("spouse1", "spouse2", "wedding_date")
+    kind = "marital_link"
+
+    def __init__(self, spouse1, spouse2, wedding_date=None):
+        self.spouse1 = spouse1
+        self.spouse2 = spouse2
+        self.wedding_date = wedding_date
+
+    def __repr__(self):
+        return f"MaritalLink({self.spouse1!r}, {self.spouse2!r}, {self.wedding_date!r})"
+
+    @property
+    def names(self):
+        return (self.spouse1, self.spouse2)
+
+
+class FamilialLink(Statement):
+    """
+    NAME '->' NAME ';'
+    """
+    __slots__ = ("parent", "child")
+    kind = "familial_link"
+
+    def __init__(self, parent, child):
+        self.parent = parent
+        self.child = child
+
+    def __repr__(self):
+        return f"FamilialLink({self.parent!r}, {self.child!r})"
+
+    @property
+    def names(self):
+        return (self.parent, self.child)
+
+
+class FamilyTreeNode(Node):
+    """
+    'family_tree' '{' statement* '}'
+    """
+    __slots__ = ("statements", "line", "column")
+    kind = "family_tree"
+
+    def __init__(self, statements, line, column):
+        self.statements = statements
+        self.line = line
+        self.column = column
+
+    def __repr__(self):
+        return f"FamilyTreeNode({len(self.statements)} instructions)"
+
+
+class Visitor:
+    """
+    Passe sur l'AST : une méthode visit_<kind> par type de noeud.
+    Par défaut, visiter l'arbre complet visite chacune de ses instructions dans l'ordre
+    """
+    def visit(self, node):
+        return node.accept(self)
+
+    def visit_family_tree(self, node):
+        for statement in node.statements:
+            statement.accept(self)
+
+    def visit_declaration(self, node):
+        pass
+
+    def visit_marital_link(self, node):
+        pass
+
+    def visit_familial_link(self, node):
+        pass
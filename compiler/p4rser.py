@@ -1,10 +1,15 @@
 # -*- encoding: utf-8 -*-
 
 import logging
+from collections import deque
 
-import AST
 import FamilyTree as FT
+from AST import ASTRenderer
 from Person import Person
+from columns import ColumnsBuilder
+from dates import parse_date
+from diagnostics import Diagnostic, TooManyErrors
+from nodes import Declaration, FamilialLink, FamilyTreeNode, MaritalLink, Name, Visitor
 
 logger = logging.getLogger(__name__)
 
@@ -14,11 +19,36 @@ class ParsingException(Exception):
 
 
 class Parser:
-    def __init__(self, lexems):
+    def __init__(self, lexems, ast_graph=None, build_ast=True, diagnostics=None, keep_columns=False):
         """
         Component in charge of syntaxic analysis.
+        The lexems can be a list or any iterable, e.g. the Lexer.iter_lex stream:
+        they are consumed one by one, with a small lookahead buffer.
+        Each statement is read into an AST node (see nodes.py), then handed to
+        the passes: the TreeBuilder, which builds the FamilyTree, and the
+        ASTRenderer, which draws the AST on ast_graph (a graphviz Digraph by
+        default, or a dot.DotWriter to stream it to disk).
+        With build_ast=False (check-only mode), the AST is not rendered and parse
+        returns None in its place: graphviz is never imported.
+        Without diagnostics, the first error raises a ParsingException. With a
+        diagnostics.Diagnostics collector, errors are reported to it and the
+        parser resynchronises on the next ';' or '}' (panic mode), so that one
+        pass reports every error, up to the collector limit.
+        With keep_columns=True, the TreeBuilder also keeps the tree's columns
+        up to date (columns.ColumnsBuilder, see the columns method), so that
+        validation does not walk every Person again.
         """
-        self.lexems = lexems
+        self.lexems = iter(lexems)
+        self.ast_graph = ast_graph
+        self.build_ast = build_ast
+        self.diagnostics = diagnostics
+        self.keep_columns = keep_columns
+        self.lookahead = deque()
+        self.keyword = None
+        self.builder = None
+        self.renderer = None
+        # Number of statements read
+        self.statements = 0
 
     # ==========================
     #      Helper Functions
@@ -26,19 +56,32 @@ class Parser:
 
     def accept(self):
         """
-        Pops the lexem out of the lexems list.
+        Pops the lexem out of the lexems stream.
         """
         self.show_next()
-        return self.lexems.pop(0)
+        return self.lookahead.popleft()
 
     def show_next(self, n=1):
         """
-        Returns the next token in the list WITHOUT popping it.
+        Returns the next token in the stream WITHOUT popping it.
         """
         try:
-            return self.lexems[n - 1]
+            self.fill_lookahead(n)
+            return self.lookahead[n - 1]
         except IndexError:
-            self.error("No more lexems left.")
+            raise ParsingException("ERROR: No more lexems left.") from None
+
+    def fill_lookahead(self, n):
+        """
+        Pulls lexems from the stream until n of them are buffered.
+        Comments are filtered out on the fly.
+        """
+        while len(self.lookahead) < n:
+            lexem = next(self.lexems, None)
+            if lexem is None:
+                return
+            if lexem.tag != "COMMENT":
+                self.lookahead.append(lexem)
 
     def expect(self, tag):
         """
@@ -51,11 +94,33 @@ class Parser:
             )
         return self.accept()
 
-    def remove_comments(self):
+    def expect_date(self):
+        """
+        Pops the next DATE lexem and checks that it is a valid calendar date.
+        Returns its value.
+        """
+        lexem = self.expect("DATE")
+        try:
+            parse_date(lexem.value)
+        except ValueError as err:
+            raise ParsingException(
+                f"ERROR at {str(lexem.position)}: Invalid date {lexem.value} ({err})"
+            ) from err
+        return lexem.value
+
+    def expect_name(self):
+        """
+        Pops the next NAME lexem and returns it as a Name node.
+        """
+        lexem = self.expect("NAME")
+        return Name(lexem.value, lexem.line, lexem.column)
+
+    @property
+    def lookups(self):
         """
-        Removes the comments from the token list by testing their tags.
+        Number of person lookups made while building the tree.
         """
-        self.lexems = [lexem for lexem in self.lexems if lexem.tag != "COMMENT"]
+        return self.builder.lookups if self.builder is not None else 0
 
     # ==========================
     #     Parsing Functions
@@ -64,108 +129,287 @@ class Parser:
     def parse(self):
         """
         Main function: launches the parsing operation given a lexem list.
+        When collecting diagnostics, the tree built so far is returned even if
+        errors were found (or if the error limit stopped the parsing).
         """
         try:
-            self.remove_comments()
-            ftree,ast = self.parse_family_tree()
+            ftree, ast = self.parse_family_tree()
+        except ParsingException as err:
+            logger.exception(err)
+            raise
+        except TooManyErrors:
+            ftree, ast = self.builder.tree, self.renderer
+        if not self.diagnostics:
             print("Parsing effectué avec succès")
-            return ftree, ast
+        return ftree, ast
+
+    def parse_all(self):
+        """
+        Parses every family_tree block of the lexems stream (several trees can
+        follow each other in one file). Returns the list of (tree, AST) pairs.
+        """
+        trees = []
+        try:
+            while True:
+                trees.append(self.parse_family_tree())
+                self.fill_lookahead(1)
+                if not self.lookahead:
+                    break
         except ParsingException as err:
             logger.exception(err)
             raise
+        except TooManyErrors:
+            # The tree being parsed when the limit was reached is kept
+            if not trees or trees[-1][0] is not self.builder.tree:
+                trees.append((self.builder.tree, self.renderer))
+        if not self.diagnostics:
+            print(f"Parsing effectué avec succès ({len(trees)} arbre(s))")
+        return trees
 
     def parse_family_tree(self):
         """
         Parses a family tree which is a succession of statements.
+        Each statement goes through the passes as soon as it is read, so that
+        the whole program never has to be held in memory.
+        Returns the family tree and the AST renderer (None in check-only mode).
+        """
+        self.builder = TreeBuilder(diagnostics=self.diagnostics,
+                                   columns=ColumnsBuilder() if self.keep_columns else None)
+        self.renderer = ASTRenderer(self.ast_graph) if self.build_ast else None
+        passes = [self.builder] if self.renderer is None else [self.builder, self.renderer]
+        for statement in self.iter_statements():
+            try:
+                for visitor in passes:
+                    statement.accept(visitor)
+            except ParsingException as err:
+                # Semantic error: the statement is left out
+                if self.diagnostics is None:
+                    raise
+                self.report(err, statement.line, statement.column)
+        return self.builder.tree, self.renderer
+
+    def columns(self):
+        """
+        Returns the columns (columns.TreeColumns) of the last tree parsed,
+        kept by the TreeBuilder (requires keep_columns=True).
+        """
+        if self.builder is None or self.builder.columns is None:
+            raise ValueError("columns are only kept with keep_columns=True")
+        return self.builder.columns.to_columns(self.builder.tree.racine)
+
+    def parse_program(self):
+        """
+        Parses the whole program into a FamilyTreeNode, without running any pass.
+        """
+        statements = list(self.iter_statements())
+        if self.keyword is None:
+            return FamilyTreeNode(statements, None, None)
+        return FamilyTreeNode(statements, self.keyword.line, self.keyword.column)
+
+    def iter_statements(self):
         """
-        self.expect("KW_TREE")
-        # on créé l'instance d'AST
-        global ast
-        ast = AST.AST()
-        # on crée l'instance d'arbre
-        global ftree
-        ftree = FT.FamilyTree()
-        self.expect("L_CURL_BRACKET")
-        while self.show_next().tag != "R_CURL_BRACKET":
-            self.parse_stmt(ftree, ast)
+        'family_tree' '{' statement* '}'
+        Yields the statement nodes one by one.
+        """
+        if not self.read_header():
+            # The end of the stream was reached while recovering from a header error
+            return
+        while True:
+            try:
+                if self.show_next().tag == "R_CURL_BRACKET":
+                    break
+                statement = self.read_stmt()
+            except ParsingException as err:
+                if self.diagnostics is None:
+                    raise
+                if not self.recover(err):
+                    return
+                continue
+            yield statement
         self.expect("R_CURL_BRACKET")
 
-        return ftree, ast
+    def read_header(self):
+        """
+        'family_tree' '{'
+        Returns False if the end of the stream was reached while recovering
+        from a header error.
+        """
+        try:
+            self.keyword = self.expect("KW_TREE")
+            self.expect("L_CURL_BRACKET")
+        except ParsingException as err:
+            if self.diagnostics is None:
+                raise
+            return self.recover(err, stop_tags=("L_CURL_BRACKET",), keep_tags=())
+        return True
 
-    def parse_stmt(self, tree, ast=None):
+    def read_stmt(self):
         """
         declaration | familial_link | marital_link
-        :return:
+        Returns the statement node, without applying it to any tree.
         """
+        self.statements += 1
         next_tag = self.show_next().tag
         if next_tag == "NAME" and self.show_next(n=2).tag == "L_PAREN":
-            self.parse_declaration(tree, ast)
+            return self.read_declaration()
         elif next_tag == "NAME" and self.show_next(n=2).tag == "MARITAL_LINK":
-            self.parse_marital_link(tree, ast)
+            return self.read_marital_link()
         elif next_tag == "NAME" and self.show_next(n=2).tag == "FAMILIAL_LINK":
-            self.parse_familial_link(tree, ast)
+            return self.read_familial_link()
         else:
             self.error("Expecting declaration, marital_link or familial_link")
 
-    def parse_declaration(self, tree, ast=None):
+    def read_declaration(self):
         """
-        NAME '(' DATE '-' (DATE)? ')';'
+        NAME '(' DATE '-' (DATE)? ')' ';'
         """
-        name = self.expect('NAME').value  # on récupère le nom de la personne
+        name = self.expect_name()  # on récupère le nom de la personne
         self.expect("L_PAREN")
-        bdate = self.expect("DATE").value  # on récupère la date de naissance
+        bdate = self.expect_date()  # on récupère la date de naissance
         self.expect("RANGE")
         # La seconde date est facultative, pas besoin de vérifier si elle existe
         if self.show_next().tag == "DATE":
-            ddate = self.expect("DATE").value  # on récupère la date de décès
+            ddate = self.expect_date()  # on récupère la date de décès
         else:
             ddate = None
         self.expect("R_PAREN")
         self.expect("TERMINATOR")
-        # On crée l'objet Person
-        # Si c'est la première personne de l'arbre, on la définit comme racine
-        if tree.racine is None:
-            tree.racine = Person(tree, name, bdate, ddate)
-            # Ajout à l'AST
-            ast.def_declaration(name, bdate, ddate, racine=True)
-        else:
-            Person(tree, name, bdate, ddate)
-            # Ajout à l'AST
-            ast.def_declaration(name, bdate, ddate)
+        return Declaration(name, bdate, ddate)
 
-    def parse_familial_link(self, tree, ast=None):
+    def read_familial_link(self):
         """
         NAME '->' NAME ';'
-        :return:
         """
-        name_parent = self.expect('NAME').value  # on récupère le nom de la personne
+        parent = self.expect_name()  # on récupère le nom de la personne
         self.expect("FAMILIAL_LINK")
-        name_child = self.expect("NAME").value  # on récupère le nom de la personne
+        child = self.expect_name()  # on récupère le nom de la personne
         self.expect("TERMINATOR")
+        return FamilialLink(parent, child)
 
-        # On crée le lien
-        tree.get_person(name_parent).define_familial_link(tree.get_person(name_child))
-
-    def parse_marital_link(self, tree,ast=None):
+    def read_marital_link(self):
         """
-        NAME '<=>' NAME ';'
-        :return:
+        NAME '<=>' NAME ('(' DATE ')')? ';'
         """
-        spouse1 = self.expect('NAME').value  # on récupère le nom de la personne
+        spouse1 = self.expect_name()  # on récupère le nom de la personne
         self.expect("MARITAL_LINK")
-        spouse2 = self.expect("NAME").value  # on récupère le nom de la personne
+        spouse2 = self.expect_name()  # on récupère le nom de la personne
         #On prend en compte la date du mariage si elle est définie
         if self.show_next().tag == "L_PAREN":
             self.expect("L_PAREN")
-            mdate = self.expect("DATE").value
+            mdate = self.expect_date()
             self.expect("R_PAREN")
         else:
             mdate = None
         self.expect("TERMINATOR")
-        # On crée le lien
-        tree.get_person(spouse1).define_mariage_link(tree.get_person(spouse2), mdate)
-        # On ajoute sur l'ast
-        ast.def_marital_link(spouse1,tree.get_person(spouse1).birthdate, spouse2,tree.get_person(spouse2).birthdate, wedding_date=mdate)
+        return MaritalLink(spouse1, spouse2, mdate)
 
     def error(self, param):
-        print(param)
+        """
+        Raises a ParsingException at the position of the next lexem.
+        """
+        raise ParsingException(f"ERROR at {str(self.show_next().position)}: {param}")
+
+    # ==========================
+    #      Error Recovery
+    # ==========================
+
+    def report(self, err, line=None, column=None):
+        """
+        Adds a parsing error to the diagnostics.
+        """
+        self.diagnostics.add(Diagnostic("parser", (str(err).splitlines() or [""])[0], line, column))
+
+    def recover(self, err, stop_tags=("TERMINATOR",), keep_tags=("R_CURL_BRACKET",)):
+        """
+        Panic mode: reports the error at the next lexem, then skips lexems up to
+        the next stop tag (consumed) or keep tag (left in the stream).
+        Returns False if the end of the stream was reached instead.
+        """
+        self.fill_lookahead(1)
+        if self.lookahead:
+            self.report(err, self.lookahead[0].line, self.lookahead[0].column)
+        else:
+            self.report(err)
+        while True:
+            self.fill_lookahead(1)
+            if not self.lookahead:
+                return False
+            tag = self.lookahead[0].tag
+            if tag in keep_tags:
+                return True
+            self.lookahead.popleft()
+            if tag in stop_tags:
+                return True
+
+
+class TreeBuilder(Visitor):
+    """
+    Semantic pass: builds the FamilyTree from the statement nodes, in order.
+    Semantic errors (duplicate or unknown persons) are raised as
+    ParsingException at the position of the offending name.
+    A link naming homonyms only gets a warning (added to diagnostics, or
+    logged without a collector).
+    With a columns.ColumnsBuilder, each declaration and link is also
+    reported to it once applied to the Person objects.
+    """
+    def __init__(self, tree=None, diagnostics=None, columns=None):
+        self.tree = FT.FamilyTree() if tree is None else tree
+        self.diagnostics = diagnostics
+        self.columns = columns
+        # Number of person lookups
+        self.lookups = 0
+
+    def get_person(self, name):
+        """
+        Looks up the person named by a Name node in the family tree.
+        The language has no way to tell homonyms apart in a link: as before
+        homonyms were indexed, the first person declared under that name is used.
+        """
+        self.lookups += 1
+        homonyms = self.tree.persons_by_name.get(name.value)
+        if homonyms is not None and len(homonyms) > 1:
+            self.warn(name, f"{name.value} est ambigu ({len(homonyms)} personnes portent ce nom), "
+                            f"la première déclarée est retenue")
+            return homonyms[0]
+        try:
+            return self.tree.get_person(name.value)
+        except FT.FamilyTreeException as err:
+            raise ParsingException(f"ERROR at {str(name.position)}: {err}") from err
+
+    def warn(self, name, message):
+        """
+        Reports a warning at the position of a Name node.
+        """
+        message = f"WARNING at {str(name.position)}: {message}"
+        if self.diagnostics is None:
+            logger.warning(message)
+        else:
+            self.diagnostics.warn(Diagnostic("parser", message, name.line, name.column))
+
+    def visit_declaration(self, node):
+        # On crée l'objet Person
+        try:
+            person = Person(self.tree, node.name.value, node.birthdate, node.deathdate)
+        except FT.FamilyTreeException as err:
+            raise ParsingException(f"ERROR at {str(node.name.position)}: {err}") from err
+        # Si c'est la première personne de l'arbre, on la définit comme racine
+        if self.tree.racine is None:
+            self.tree.racine = person
+        if self.columns is not None:
+            self.columns.add_person(person)
+
+    def visit_familial_link(self, node):
+        # On crée le lien
+        parent = self.get_person(node.parent)
+        child = self.get_person(node.child)
+        parent.define_familial_link(child)
+        if self.columns is not None:
+            self.columns.add_filiation(parent, child)
+
+    def visit_marital_link(self, node):
+        # On crée le lien
+        spouse1 = self.get_person(node.spouse1)
+        spouse2 = self.get_person(node.spouse2)
+        spouse1.define_mariage_link(spouse2, node.wedding_date)
+        if self.columns is not None:
+            self.columns.add_marriage(spouse1, spouse2)
@@ -0,0 +1,384 @@
+# -*- encoding: utf-8 -*-
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import socket
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from cache import hash_text
+from columns import TreeColumns
+from dates import parse_date
+from diagnostics import Diagnostics
+from lexer import Lexer, LexerException
+from p4rser import Parser, ParsingException
+from FamilyTree import FamilyTreeException
+
+# Service de compilation local : le protocole est une requête JSON par ligne, suivie
+# d'une réponse JSON par ligne, sur un socket Unix ou un port TCP de la machine locale.
+# Requêtes ("key" : empreinte rendue par "compile" ; "source" : texte du programme,
+# compilé si besoin) :
+#   {"op": "compile", "source": ...}
+#   {"op": "frise", "key" | "source": ..., "start": "jj/mm/aaaa", "end": "jj/mm/aaaa"}
+#   {"op": "generations", "key" | "source": ...}
+#   {"op": "dot", "key" | "source": ...}
+#   {"op": "stats"}
+
+# Nombre d'arbres gardés en mémoire par défaut
+DEFAULT_MAX_TREES = 32
+# Taille maximale d'une requête (source compris)
+MAX_REQUEST_BYTES = 256 * 2 ** 20
+DEFAULT_PORT = 8765
+
+
+class ServerException(Exception):
+    pass
+
+
+class RawJSON:
+    """
+    Valeur déjà encodée en JSON (UTF-8), recopiée telle quelle dans les réponses : les
+    grosses réponses d'un arbre chaud (frise, DOT) ne sont sérialisées qu'une fois
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, value):
+        self.data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+def encode_response(response):
+    """
+    Encode une réponse en une ligne JSON, en recopiant les valeurs RawJSON déjà encodées
+    :param response:
+    :return:
+    """
+    fields = {name: value for name, value in response.items() if not isinstance(value, RawJSON)}
+    data = json.dumps(fields, ensure_ascii=False).encode("utf-8")
+    raw = [(name, value) for name, value in response.items() if isinstance(value, RawJSON)]
+    if raw:
+        parts = [data[:-1]]
+        for name, value in raw:
+            parts += [b", ", json.dumps(name).encode("utf-8"), b": ", value.data]
+        data = b"".join(parts) + b"}"
+    return data + b"\n"
+
+
+def compile_source(text):
+    """
+    Compile un source (lexing, parsing et générations) et retourne un dictionnaire contenant
+    les colonnes de l'arbre et ses conflits de génération (identifiant de la personne et les deux
+    générations), ou l'erreur et les diagnostics. Exécutée dans un processus du pool : le résultat
+    est transmis sous forme colonnaire, compacte à sérialiser (voir rebuild_tree)
+    :param text:
+    :return:
+    """
+    diagnostics = Diagnostics()
+    try:
+        # Les messages de progression du parser ne sont pas affichés
+        with contextlib.redirect_stdout(io.StringIO()):
+            lexems = Lexer(diagnostics=diagnostics).iter_lex(text)
+            ftree, _ = Parser(lexems, build_ast=False, diagnostics=diagnostics).parse()
+        if diagnostics:
+            return {"error": diagnostics.format(),
+                    "diagnostics": [diagnostic.to_dict() for diagnostic in diagnostics.sorted()]}
+        # define_generations vérifie aussi l'absence de cycle
+        conflicts = ftree.define_generations()
+    except (LexerException, ParsingException, FamilyTreeException) as err:
+        return {"error": f"{type(err).__name__}: {(str(err).splitlines() or [''])[0]}"}
+    # Les colonnes ne portent pas les conflits : ils sont transmis à part, par identifiants
+    ids = {person: i for i, person in enumerate(ftree.persons)} if conflicts else {}
+    return {"columns": TreeColumns.from_tree(ftree),
+            "conflicts": [(ids[person], gen, other_gen) for person, gen, other_gen in conflicts]}
+
+
+def rebuild_tree(result):
+    """
+    Reconstruit l'arbre compilé par compile_source, avec ses conflits de génération
+    :param result:
+    :return:
+    """
+    tree = result["columns"].to_tree()
+    tree.generation_conflicts = [(tree.persons[person], gen, other_gen)
+                                 for person, gen, other_gen in result["conflicts"]]
+    return tree
+
+
+class CompiledTree:
+    """
+    Arbre compilé gardé en mémoire, avec ses réponses déjà calculées et encodées : une
+    requête répétée sur un arbre chaud ne coûte que la recherche et l'envoi de la réponse
+    """
+    def __init__(self, key, tree):
+        self.key = key
+        self.tree = tree
+        self.results = {}
+
+    def frise(self, start=None, end=None):
+        """
+        Retourne la frise chronologique, éventuellement restreinte aux dates comprises entre start et end.
+        Seule la frise complète est conservée : une fenêtre ne trie que ses propres évènements
+        :param start:
+        :param end:
+        :return:
+        """
+        if start is not None or end is not None:
+            return "".join(self.tree.iter_frise(start, end))
+        if "frise" not in self.results:
+            self.results["frise"] = RawJSON("".join(self.tree.iter_frise()))
+        return self.results["frise"]
+
+    def generations(self):
+        """
+        Retourne les générations (déjà définies à la compilation) : numéro -> noms des personnes,
+        les personnes sans lien avec la racine et les conflits de génération
+        :return:
+        """
+        if "generations" not in self.results:
+            dict_gen = self.tree.get_dict_gen()
+            self.results["generations"] = {
+                "generations": RawJSON({str(gen): [person.name for person in dict_gen[gen]]
+                                        for gen in sorted(gen for gen in dict_gen if gen is not None)}),
+                "unconnected": RawJSON([person.name for person in dict_gen.get(None, [])]),
+                "conflicts": RawJSON([[person.name, gen, other_gen]
+                                      for person, gen, other_gen in self.tree.generation_conflicts]),
+            }
+        return self.results["generations"]
+
+    def dot(self):
+        """
+        Retourne l'arbre généalogique au format DOT
+        :return:
+        """
+        if "dot" not in self.results:
+            output = io.StringIO()
+            self.tree.write_tree(output)
+            self.results["dot"] = RawJSON(output.getvalue())
+        return self.results["dot"]
+
+
+class TreeStore:
+    """
+    Arbres compilés indexés par l'empreinte de leur source, avec éviction LRU au-delà
+    de max_trees arbres. La compilation est exécutée dans executor pour ne pas bloquer
+    la boucle d'évènements ; deux requêtes simultanées sur un même source ne le compilent
+    qu'une fois
+    """
+    def __init__(self, executor, max_trees=DEFAULT_MAX_TREES):
+        self.executor = executor
+        self.max_trees = max_trees
+        self.trees = OrderedDict()
+        # Compilations en cours : empreinte -> future
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Retourne l'arbre compilé d'empreinte key
+        :param key:
+        :return:
+        """
+        entry = self.trees.get(key)
+        if entry is None:
+            raise ServerException(f"Arbre inconnu ou évincé : {key} (renvoyer le source)")
+        self.trees.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    async def compile(self, text):
+        """
+        Retourne l'arbre compilé du source (compilé seulement s'il n'est pas déjà en mémoire)
+        et s'il était déjà en mémoire
+        :param text:
+        :return:
+        """
+        key = hash_text(text)
+        if key in self.trees:
+            return self.get(key), True
+        if key not in self.pending:
+            self.misses += 1
+            self.pending[key] = asyncio.ensure_future(self.load(key, text))
+        # shield : l'annulation d'une requête n'interrompt pas la compilation partagée
+        return await asyncio.shield(self.pending[key]), False
+
+    async def load(self, key, text):
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self.executor, compile_source, text)
+            if "error" in result:
+                raise ServerException(result["error"], result.get("diagnostics", []))
+            # Reconstruction des objets Person hors de la boucle d'évènements
+            tree = await loop.run_in_executor(None, rebuild_tree, result)
+        finally:
+            del self.pending[key]
+        entry = CompiledTree(key, tree)
+        self.trees[key] = entry
+        while len(self.trees) > self.max_trees:
+            self.trees.popitem(last=False)
+        return entry
+
+
+def string_parameter(request, name, *default):
+    """
+    Retourne le paramètre name de la requête, qui doit être une chaîne
+    (ou, s'il est absent et qu'une valeur par défaut est donnée, cette valeur)
+    :param request:
+    :param name:
+    :param default:
+    :return:
+    """
+    if name not in request and default:
+        return default[0]
+    value = request[name]
+    if not isinstance(value, str):
+        raise ServerException(f"Le paramètre {name} doit être une chaîne")
+    return value
+
+
+class CompileServer:
+    """
+    Service de compilation : lit les requêtes JSON (une par ligne) de chaque client et
+    répond dans l'ordre des requêtes
+    """
+    def __init__(self, store):
+        self.store = store
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Requête plus longue que MAX_REQUEST_BYTES : la connexion est fermée
+                    writer.write(encode_response({"ok": False, "error": "Requête trop longue"}))
+                    break
+                if not line:
+                    break
+                writer.write(encode_response(await self.handle_request(line)))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, line):
+        """
+        Traite une requête et retourne la réponse (erreurs comprises)
+        :param line:
+        :return:
+        """
+        try:
+            request = json.loads(line)
+            response = await self.dispatch(request)
+            response["ok"] = True
+        except ServerException as err:
+            response = {"ok": False, "error": err.args[0]}
+            if len(err.args) > 1:
+                response["diagnostics"] = err.args[1]
+        except (ValueError, KeyError, TypeError, FamilyTreeException) as err:
+            response = {"ok": False, "error": f"{type(err).__name__}: {err}"}
+        except Exception as err:
+            # Toute autre erreur (processus de compilation interrompu...) est renvoyée au client :
+            # la connexion reste ouverte pour ses requêtes suivantes
+            response = {"ok": False, "error": f"Erreur interne : {type(err).__name__}: {err}"}
+        return response
+
+    async def dispatch(self, request):
+        if not isinstance(request, dict):
+            raise ServerException("La requête doit être un objet JSON")
+        op = request["op"]
+        if op == "stats":
+            return {"trees": len(self.store.trees), "hits": self.store.hits, "misses": self.store.misses,
+                    "pending": len(self.store.pending)}
+        if "key" in request:
+            entry, cached = self.store.get(string_parameter(request, "key")), True
+        else:
+            entry, cached = await self.store.compile(string_parameter(request, "source"))
+        response = {"key": entry.key, "cached": cached}
+        if op == "compile":
+            response["persons"] = len(entry.tree.persons)
+            response["generation_conflicts"] = len(entry.tree.generation_conflicts)
+        elif op == "frise":
+            start, end = string_parameter(request, "start", None), string_parameter(request, "end", None)
+            response["frise"] = entry.frise(None if start is None else parse_date(start),
+                                            None if end is None else parse_date(end))
+        elif op == "generations":
+            response.update(entry.generations())
+        elif op == "dot":
+            response["dot"] = entry.dot()
+        else:
+            raise ServerException(f"Opération inconnue : {op}")
+        return response
+
+
+async def serve(store, socket_path=None, host="127.0.0.1", port=DEFAULT_PORT):
+    """
+    Lance le service sur le socket Unix socket_path, ou sinon sur host:port
+    :param store:
+    :param socket_path:
+    :param host:
+    :param port:
+    :return:
+    """
+    server = CompileServer(store)
+    if socket_path is not None:
+        listener = await asyncio.start_unix_server(server.handle_client, socket_path, limit=MAX_REQUEST_BYTES)
+    else:
+        listener = await asyncio.start_server(server.handle_client, host, port, limit=MAX_REQUEST_BYTES)
+    address = socket_path if socket_path is not None else f"{host}:{port}"
+    print(f"Service de compilation à l'écoute sur {address}", file=sys.stderr)
+    async with listener:
+        await listener.serve_forever()
+
+
+def send_request(request, socket_path=None, host="127.0.0.1", port=DEFAULT_PORT):
+    """
+    Client minimal : envoie une requête au service et retourne sa réponse
+    :param request:
+    :param socket_path:
+    :param host:
+    :param port:
+    :return:
+    """
+    if socket_path is not None:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(socket_path)
+    else:
+        connection = socket.create_connection((host, port))
+    with connection, connection.makefile("rwb") as stream:
+        stream.write(json.dumps(request, ensure_ascii=False).encode("utf-8") + b"\n")
+        stream.flush()
+        return json.loads(stream.readline())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Service local de compilation d'arbres généalogiques")
+    parser.add_argument("--socket", default=None, help="socket Unix d'écoute (sinon, TCP sur --host:--port)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-trees", type=int, default=DEFAULT_MAX_TREES,
+                        help=f"nombre d'arbres gardés en mémoire (défaut : {DEFAULT_MAX_TREES})")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="nombre de processus de compilation (par défaut, le nombre de coeurs ; "
+                             "0 : compilation dans des threads)")
+    args = parser.parse_args(argv)
+
+    if args.workers == 0:
+        executor = ThreadPoolExecutor()
+    else:
+        executor = ProcessPoolExecutor(max_workers=args.workers)
+    with executor:
+        store = TreeStore(executor, args.max_trees)
+        try:
+            asyncio.run(serve(store, args.socket, args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
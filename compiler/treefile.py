@@ -0,0 +1,175 @@
+import mmap
+import os
+import struct
+from array import array
+
+from columns import TreeColumns, PersonView
+
+# En-tête : signature, version, marqueur d'ordre des octets, nombre de personnes,
+# racine, nombre d'identifiants de parents et d'enfants, taille de la table des noms
+MAGIC = b"FTRB"
+VERSION = 1
+BYTE_ORDER_MARK = 0x01020304
+HEADER = struct.Struct("=4sIIIiIII")
+
+
+class TreeFileException(Exception):
+    pass
+
+
+def write_tree_file(tree, path):
+    """
+    Écrit un arbre généalogique au format binaire : en-tête puis colonnes d'entiers 32 bits
+    (offsets de la table des noms, dates en ordinaux, conjoints, générations, listes
+    d'adjacence CSR des parents et des enfants), puis la table des noms en UTF-8
+    :param tree: FamilyTree ou TreeColumns
+    :param path:
+    :return:
+    """
+    columns = tree if isinstance(tree, TreeColumns) else TreeColumns.from_tree(tree)
+    encoded_names = [name.encode("utf-8") for name in columns.names]
+    name_offsets = array('i', [0])
+    for name in encoded_names:
+        name_offsets.append(name_offsets[-1] + len(name))
+    with open(path, "wb") as output_file:
+        output_file.write(HEADER.pack(MAGIC, VERSION, BYTE_ORDER_MARK, len(columns), columns.racine,
+                                      len(columns.parent_ids), len(columns.child_ids), name_offsets[-1]))
+        for column in (name_offsets, columns.birth, columns.death, columns.wedding, columns.spouse,
+                       columns.gen, columns.parent_offsets, columns.parent_ids,
+                       columns.child_offsets, columns.child_ids):
+            output_file.write(column if isinstance(column, array) else array('i', column))
+        output_file.writelines(encoded_names)
+
+
+class NameTable:
+    """
+    Table des noms lue sans copie : un nom n'est décodé que lorsqu'il est demandé
+    """
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return str(self.blob[self.offsets[index]:self.offsets[index + 1]], "utf-8")
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+
+class TreeFile:
+    """
+    Arbre généalogique binaire projeté en mémoire (mmap) : les colonnes sont des memoryview
+    sur le fichier, sans copie ni création des objets Person. L'ouverture ne lit que l'en-tête
+    """
+    def __init__(self, path):
+        with open(path, "rb") as input_file:
+            # Un fichier vide ne peut pas être projeté en mémoire
+            if os.fstat(input_file.fileno()).st_size < HEADER.size:
+                raise TreeFileException("Fichier trop court pour être un arbre binaire")
+            self.mmap = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self.mmap)
+        self.name_index = None
+        try:
+            self.columns = self.map_columns()
+        except Exception:
+            self.close()
+            raise
+
+    def map_columns(self):
+        """
+        Découpe le fichier en colonnes (memoryview d'entiers 32 bits)
+        :return:
+        """
+        if len(self.buffer) < HEADER.size:
+            raise TreeFileException("Fichier trop court pour être un arbre binaire")
+        magic, version, mark, n_persons, racine, n_parent_ids, n_child_ids, names_size = \
+            HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise TreeFileException("Ce fichier n'est pas un arbre binaire")
+        if version != VERSION:
+            raise TreeFileException(f"Version {version} du format non prise en charge")
+        if mark != BYTE_ORDER_MARK:
+            raise TreeFileException("Fichier écrit sur une machine d'ordre des octets différent")
+
+        position = HEADER.size
+        sections = []
+        for length in (n_persons + 1, n_persons, n_persons, n_persons, n_persons, n_persons,
+                       n_persons + 1, n_parent_ids, n_persons + 1, n_child_ids):
+            size = length * 4
+            # Une section incomplète ne peut pas être découpée en entiers de 4 octets
+            if position + size > len(self.buffer):
+                raise TreeFileException("Fichier tronqué")
+            sections.append(self.buffer[position:position + size].cast('i'))
+            position += size
+        if position + names_size > len(self.buffer):
+            raise TreeFileException("Fichier tronqué")
+        name_offsets, birth, death, wedding, spouse, gen, parent_offsets, parent_ids, child_offsets, child_ids = sections
+        names = NameTable(name_offsets, self.buffer[position:position + names_size])
+        return TreeColumns(names, birth, death, wedding, spouse, gen,
+                           parent_offsets, parent_ids, child_offsets, child_ids, racine)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.columns)
+
+    @property
+    def racine(self):
+        return self.columns.view(self.columns.racine)
+
+    def person(self, person_id):
+        """
+        Retourne la vue (PersonView) de la personne d'identifiant person_id
+        :param person_id:
+        :return:
+        """
+        return PersonView(self.columns, person_id)
+
+    def find(self, name):
+        """
+        Retourne les vues des personnes portant ce nom. L'index des noms n'est construit
+        qu'à la première recherche
+        :param name:
+        :return:
+        """
+        if self.name_index is None:
+            self.name_index = {}
+            for person_id, person_name in enumerate(self.columns.names):
+                self.name_index.setdefault(person_name, []).append(person_id)
+        return [self.person(person_id) for person_id in self.name_index.get(name, [])]
+
+    def to_tree(self):
+        """
+        Matérialise l'arbre complet (objets Person)
+        :return:
+        """
+        return self.columns.to_tree()
+
+    def close(self):
+        """
+        Libère les vues sur le fichier puis le ferme
+        :return:
+        """
+        self.columns = None
+        self.buffer.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            # Des vues sont encore utilisées : le fichier sera fermé par le ramasse-miettes
+            pass
+
+
+def load_tree_file(path):
+    """
+    Ouvre un arbre généalogique binaire écrit par write_tree_file
+    :param path:
+    :return:
+    """
+    return TreeFile(path)
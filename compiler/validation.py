@@ -0,0 +1,193 @@
+# -*- encoding: utf-8 -*-
+
+from array import array
+from itertools import chain, compress, repeat
+from operator import and_, gt, itemgetter, lt, ne, sub
+
+from columns import NO_DATE, NO_PERSON, TreeColumns, ordinal_to_date
+from diagnostics import Diagnostic, Diagnostics
+from Person import format_str_date
+
+# Vérifications de cohérence de l'arbre
+CHILD_BEFORE_PARENT = "child_before_parent"
+DEATH_BEFORE_BIRTH = "death_before_birth"
+WEDDING_AFTER_DEATH = "wedding_after_death"
+UNKNOWN_PARENT = "unknown_parent"
+CHECKS = (DEATH_BEFORE_BIRTH, CHILD_BEFORE_PARENT, WEDDING_AFTER_DEATH, UNKNOWN_PARENT)
+
+# Gravité de chaque vérification : un parent inconnu n'est pas une incohérence
+SEVERITIES = {
+    CHILD_BEFORE_PARENT: "error",
+    DEATH_BEFORE_BIRTH: "error",
+    WEDDING_AFTER_DEATH: "error",
+    UNKNOWN_PARENT: "warning",
+}
+
+
+class ValidationDiagnostic(Diagnostic):
+    """
+    Incohérence relevée par la validation : la vérification en cause, sa gravité,
+    la personne concernée et l'autre personne du lien (parent, conjoint), sous forme
+    d'identifiants (rangs dans FamilyTree.persons) et de noms
+    """
+    __slots__ = ("check", "severity", "person", "other", "names")
+
+    def __init__(self, check, message, person, other=None, names=None):
+        super().__init__("validation", message)
+        self.check = check
+        self.severity = SEVERITIES[check]
+        self.person = person
+        self.other = other
+        self.names = names
+
+    def to_dict(self):
+        result = super().to_dict()
+        result.update(check=self.check, severity=self.severity, person=self.person, other=self.other)
+        if self.names is not None:
+            result["person_name"] = self.names[self.person]
+            result["other_name"] = None if self.other is None else self.names[self.other]
+        return result
+
+
+def find_inconsistencies(columns, use_numpy=None):
+    """
+    Applique les vérifications à toutes les personnes et à tous les liens de l'arbre à la fois,
+    sur les colonnes d'ordinaux de dates. Retourne, pour chaque vérification, la liste des
+    couples (personne, autre personne ou None) en défaut, dans l'ordre des identifiants.
+    Chaque lien parent -> enfant n'est compté qu'une fois, même si l'enfant a été déclaré
+    pour les deux époux ; l'autre personne d'un parent inconnu est le seul parent connu.
+    NumPy est utilisé s'il est installé (comparaisons vectorisées sur les colonnes, sans copie) ;
+    sinon les colonnes sont parcourues par les itérateurs natifs (map, compress)
+    :param columns: TreeColumns (colonnes array ou memoryview)
+    :param use_numpy: None : NumPy s'il est disponible ; False : jamais
+    :return:
+    """
+    if use_numpy is not False:
+        try:
+            import numpy
+        except ImportError:
+            if use_numpy:
+                raise
+        else:
+            return find_inconsistencies_numpy(columns, numpy)
+    return find_inconsistencies_python(columns)
+
+
+def find_inconsistencies_numpy(columns, np):
+    birth = np.asarray(columns.birth, dtype=np.int32)
+    death = np.asarray(columns.death, dtype=np.int32)
+    wedding = np.asarray(columns.wedding, dtype=np.int32)
+    spouse = np.asarray(columns.spouse, dtype=np.int32)
+    ids = np.arange(len(birth), dtype=np.int32)
+    results = {}
+
+    bad = (death != NO_DATE) & (death < birth)
+    results[DEATH_BEFORE_BIRTH] = [(person, None) for person in ids[bad].tolist()]
+
+    # Une arête par lien enfant -> parent : l'enfant de chaque arête est déduit des offsets CSR.
+    # Un enfant déclaré pour chacun des deux époux est relié deux fois au même parent : les arêtes,
+    # codées enfant * n + parent, sont triées (par enfant puis par parent) et dédoublonnées
+    # (np.sort puis un masque : np.unique n'est pas toujours fait par tri et est plus lent)
+    parent_ids = np.asarray(columns.parent_ids, dtype=np.int64)
+    edge_children = np.repeat(ids.astype(np.int64), np.diff(np.asarray(columns.parent_offsets, dtype=np.int64)))
+    known = parent_ids != NO_PERSON
+    edges = np.sort(edge_children[known] * len(birth) + parent_ids[known])
+    edges = edges[np.concatenate(([True], edges[1:] != edges[:-1]))]
+    edge_children, edge_parents = np.divmod(edges, len(birth))
+
+    bad = birth[edge_children] < birth[edge_parents]
+    results[CHILD_BEFORE_PARENT] = list(zip(edge_children[bad].tolist(), edge_parents[bad].tolist()))
+
+    # Le conjoint NO_PERSON (-1) indexerait la dernière personne : il est exclu par le masque
+    married = (wedding != NO_DATE) & (spouse != NO_PERSON)
+    spouse_death = death[np.where(married, spouse, 0)]
+    bad = married & (spouse_death != NO_DATE) & (wedding > spouse_death)
+    results[WEDDING_AFTER_DEATH] = list(zip(ids[bad].tolist(), spouse[bad].tolist()))
+
+    # Un seul parent connu : l'enfant n'a qu'une arête, la première (et dernière) de son groupe
+    single = np.ones(len(edges), dtype=bool)
+    same_child = edge_children[1:] == edge_children[:-1]
+    single[1:] &= ~same_child
+    single[:-1] &= ~same_child
+    results[UNKNOWN_PARENT] = list(zip(edge_children[single].tolist(), edge_parents[single].tolist()))
+    return results
+
+
+def find_inconsistencies_python(columns):
+    # Sans NumPy, les colonnes sont parcourues par map, zip et compress : les boucles sont
+    # faites en C, sans bytecode Python par personne ni par lien
+    birth, death, wedding, spouse = columns.birth, columns.death, columns.wedding, columns.spouse
+    ids = range(len(birth))
+    results = {}
+
+    # NO_DATE vaut 0 : bool(date) indique si la date est connue
+    bad = map(and_, map(bool, death), map(lt, death, birth))
+    results[DEATH_BEFORE_BIRTH] = list(zip(compress(ids, bad), repeat(None)))
+
+    # Arêtes (enfant, parent) dédoublonnées et triées, comme avec np.unique
+    parent_offsets, parent_ids = columns.parent_offsets, columns.parent_ids
+    edge_children = chain.from_iterable(map(repeat, ids, map(sub, parent_offsets[1:], parent_offsets[:-1])))
+    edges = sorted(set(compress(zip(edge_children, parent_ids), map(ne, parent_ids, repeat(NO_PERSON)))))
+    edge_children = array('i', map(itemgetter(0), edges))
+    edge_parents = array('i', map(itemgetter(1), edges))
+
+    bad = map(lt, map(birth.__getitem__, edge_children), map(birth.__getitem__, edge_parents))
+    results[CHILD_BEFORE_PARENT] = list(compress(edges, bad))
+
+    married = map(and_, map(bool, wedding), map(ne, spouse, repeat(NO_PERSON)))
+    spouse_death = array('i', map(death.__getitem__, spouse))
+    bad = map(and_, map(and_, married, map(bool, spouse_death)), map(gt, wedding, spouse_death))
+    results[WEDDING_AFTER_DEATH] = list(compress(zip(ids, spouse), bad))
+
+    # Un seul parent connu : l'enfant diffère de ceux de l'arête précédente et de la suivante
+    previous_differs = map(ne, edge_children, chain((NO_PERSON,), edge_children))
+    next_differs = map(ne, edge_children, chain(edge_children[1:], (NO_PERSON,)))
+    results[UNKNOWN_PARENT] = list(compress(edges, map(and_, previous_differs, next_differs)))
+    return results
+
+
+def validate_columns(columns, diagnostics=None, use_numpy=None):
+    """
+    Valide un arbre stocké en colonnes et ajoute une ValidationDiagnostic par incohérence
+    à diagnostics (par défaut, un collecteur sans limite), qui est retourné
+    :param columns:
+    :param diagnostics:
+    :param use_numpy:
+    :return:
+    """
+    if diagnostics is None:
+        diagnostics = Diagnostics(max_errors=None)
+    names = columns.names
+
+    def describe(person, ordinals):
+        return f"{names[person]} ({format_str_date(ordinal_to_date(ordinals[person]))})"
+
+    results = find_inconsistencies(columns, use_numpy)
+    # Les messages ne sont construits que pour les personnes en défaut
+    for check in CHECKS:
+        for person, other in results[check]:
+            if check == DEATH_BEFORE_BIRTH:
+                message = (f"{names[person]} est décédé le {format_str_date(ordinal_to_date(columns.death[person]))} "
+                           f"avant sa naissance le {format_str_date(ordinal_to_date(columns.birth[person]))}")
+            elif check == CHILD_BEFORE_PARENT:
+                message = f"{describe(person, columns.birth)} est né avant son parent {describe(other, columns.birth)}"
+            elif check == WEDDING_AFTER_DEATH:
+                message = (f"{names[person]} s'est marié le {format_str_date(ordinal_to_date(columns.wedding[person]))} "
+                           f"après le décès de son conjoint {names[other]} le "
+                           f"{format_str_date(ordinal_to_date(columns.death[other]))}")
+            else:
+                message = f"{describe(person, columns.birth)} n'a qu'un parent connu, {names[other]}"
+            diagnostics.add(ValidationDiagnostic(check, message, person, other, names))
+    return diagnostics
+
+
+def validate_tree(tree, diagnostics=None, use_numpy=None):
+    """
+    Valide un FamilyTree (converti en colonnes, voir validate_columns). La conversion parcourt
+    toutes les personnes : après un parsing, valider plutôt Parser.columns (keep_columns=True)
+    :param tree:
+    :param diagnostics:
+    :param use_numpy:
+    :return:
+    """
+    return validate_columns(TreeColumns.from_tree(tree), diagnostics, use_numpy)
@@ -0,0 +1,146 @@
+# -*- encoding: utf-8 -*-
+
+import FamilyTree as FT
+from Person import Person
+from lexer import Lexer
+from p4rser import Parser
+
+
+class Workspace:
+    """
+    Espace de travail regroupant plusieurs arbres généalogiques (plusieurs blocs
+    family_tree, dans un ou plusieurs fichiers) pour les fusionner en un seul arbre.
+    Chaque chargement utilise son propre Lexer et son propre Parser : des espaces de
+    travail différents peuvent être chargés en parallèle dans des threads
+    """
+    def __init__(self):
+        # Arbres chargés, avec leur origine : [(source, FamilyTree)]
+        self.trees = []
+        # Incohérences relevées par la dernière fusion : (nom, date de naissance, attribut, valeur retenue, valeur écartée)
+        self.conflicts = []
+
+    def add_tree(self, tree, source=None):
+        """
+        Ajoute un arbre déjà construit
+        :param tree:
+        :param source:
+        :return:
+        """
+        self.trees.append((source, tree))
+
+    def load(self, lexems, source=None, diagnostics=None):
+        """
+        Parse tous les blocs family_tree d'un flux de lexèmes et ajoute les arbres obtenus
+        :param lexems:
+        :param source:
+        :param diagnostics:
+        :return: les arbres ajoutés
+        """
+        trees = [tree for tree, _ in Parser(lexems, build_ast=False, diagnostics=diagnostics).parse_all()]
+        for tree in trees:
+            self.add_tree(tree, source)
+        return trees
+
+    def load_file(self, path, engine="master", diagnostics=None):
+        """
+        Charge tous les arbres d'un fichier
+        :param path:
+        :param engine:
+        :param diagnostics:
+        :return: les arbres ajoutés
+        """
+        lexer = Lexer(engine=engine, diagnostics=diagnostics)
+        return self.load(lexer.iter_lex_file(path), path, diagnostics)
+
+    def load_text(self, text, source="<texte>", diagnostics=None):
+        """
+        Charge tous les arbres d'un texte source
+        :param text:
+        :param source:
+        :param diagnostics:
+        :return: les arbres ajoutés
+        """
+        return self.load(Lexer(diagnostics=diagnostics).iter_lex(text), source, diagnostics)
+
+    def merge(self):
+        """
+        Fusionne les arbres chargés en un nouvel arbre, sans modifier ces derniers.
+        Les personnes de même nom et de même date de naissance sont confondues : la fusion
+        est une jointure par hachage sur l'index persons_by_key de l'arbre fusionné, en un
+        seul parcours des personnes puis des liens de chaque arbre.
+        La racine est celle du premier arbre. Les incohérences entre arbres (dates de décès,
+        conjoints ou dates de mariage différents pour une même personne) sont relevées dans
+        self.conflicts, la première valeur étant conservée
+        :return:
+        """
+        merged = FT.FamilyTree()
+        self.conflicts = []
+        for _, tree in self.trees:
+            # Personne de l'arbre -> personne de l'arbre fusionné
+            mapping = {None: None}
+            for person in tree.persons:
+                key = (person.name, person.birthdate)
+                target = merged.persons_by_key.get(key)
+                if target is None:
+                    target = Person(merged, person.name, person.birthdate, person.deathdate)
+                elif person.deathdate is not None and target.deathdate != person.deathdate:
+                    if target.deathdate is None:
+                        target.deathdate = person.deathdate
+                    else:
+                        self.conflicts.append((*key, "deathdate", target.deathdate, person.deathdate))
+                mapping[person] = target
+            if merged.racine is None and tree.racine is not None:
+                merged.racine = mapping[tree.racine]
+
+            self.merge_spouses(tree, mapping)
+            for person in tree.persons:
+                target = mapping[person]
+                target.parents = merge_links(target.parents, (mapping[parent] for parent in person.parents))
+                target.children = merge_links(target.children, (mapping[child] for child in person.children))
+        return merged
+
+    def merge_spouses(self, tree, mapping):
+        """
+        Reporte sur l'arbre fusionné le conjoint et la date de mariage de chaque personne d'un arbre,
+        tels qu'ils sont dans cet arbre : le lien n'a pas à être réciproque (après un remariage,
+        l'ancien conjoint désigne toujours la personne remariée).
+        Si un arbre précédent donne un autre conjoint à la personne, le conflit est relevé et
+        ce mariage n'est reporté ni sur elle, ni sur le conjoint qui la désigne dans cet arbre
+        :param tree:
+        :param mapping: personne de l'arbre -> personne de l'arbre fusionné
+        :return:
+        """
+        # Les conflits sont relevés avant toute écriture : l'ordre des personnes est indifférent
+        rejected = set()
+        for person in tree.persons:
+            target, spouse = mapping[person], mapping[person.spouse]
+            if spouse is not None and target.spouse is not None and target.spouse is not spouse:
+                rejected.add(person)
+                self.conflicts.append((target.name, target.birthdate, "spouse", target.spouse.name, spouse.name))
+        for person in tree.persons:
+            if person.spouse is None or person in rejected:
+                continue
+            if person.spouse in rejected and person.spouse.spouse is person:
+                continue
+            target = mapping[person]
+            target.spouse = mapping[person.spouse]
+            if person.wedding_date is None:
+                continue
+            if target.wedding_date is None:
+                target.wedding_date = person.wedding_date
+            elif target.wedding_date != person.wedding_date:
+                self.conflicts.append((target.name, target.birthdate, "wedding_date",
+                                       target.wedding_date, person.wedding_date))
+
+
+def merge_links(current, added):
+    """
+    Retourne la liste des personnes liées (parents ou enfants) complétée sans doublon,
+    dans l'ordre d'apparition. Les places vides (None) sont retirées
+    :param current:
+    :param added:
+    :return:
+    """
+    links = dict.fromkeys(person for person in current if person is not None)
+    links.update(dict.fromkeys(person for person in added if person is not None))
+    return list(links)
@@ -0,0 +1,7 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+
+# Les modules du compilateur s'importent depuis leur dossier (comme avec python compiler)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "compiler"))
@@ -0,0 +1,14 @@
+# -*- encoding: utf-8 -*-
+
+import os
+
+from batch import output_paths, output_stems
+
+
+def test_inputs_with_the_same_name_get_distinct_outputs():
+    paths = [os.path.join("a", "tree.txt"), os.path.join("b", "tree.txt"), os.path.join("a", "other.txt")]
+    stems = output_stems(paths)
+    assert stems[2] == "other"
+    assert stems[0] != stems[1] and all(stem.startswith("tree-") for stem in stems[:2])
+    outputs = [output_paths(path, "out", stem) for path, stem in zip(paths, stems)]
+    assert len({paths["frise"] for paths in outputs}) == len(paths)
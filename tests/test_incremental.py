@@ -0,0 +1,137 @@
+# -*- encoding: utf-8 -*-
+
+import contextlib
+import io
+import logging
+import os
+import random
+
+import pytest
+
+from FamilyTree import FamilyTreeException
+from incremental import IncrementalCompilation
+from lexer import Lexer
+from p4rser import Parser, ParsingException
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+
+
+class RecordingGraph:
+    """
+    Graphique minimal qui garde ses noeuds et ses arêtes dans body, comme graphviz.Digraph
+    """
+    def __init__(self):
+        self.body = []
+
+    def node(self, name, label=None, **attrs):
+        self.body.append(("node", name, label, sorted(attrs.items())))
+
+    def edge(self, tail_name, head_name, label=None, **attrs):
+        self.body.append(("edge", tail_name, head_name, label, sorted(attrs.items())))
+
+
+def describe(tree):
+    return [(person.name, person.birthdate, person.deathdate, person.spouse and person.spouse.name,
+             person.wedding_date, [parent and parent.name for parent in person.parents],
+             [child.name for child in person.children]) for person in tree.persons], tree.racine and tree.racine.name
+
+
+def full_compile(text):
+    graph = RecordingGraph()
+    with contextlib.redirect_stdout(io.StringIO()):
+        ftree, _ = Parser(Lexer().iter_lex(text), ast_graph=graph).parse()
+        program = Parser(Lexer().iter_lex(text), build_ast=False).parse_program()
+    positions = [[(name.value, name.line, name.column) for name in statement.names]
+                 for statement in program.statements]
+    return describe(ftree), graph.body, positions
+
+
+def assert_same_as_full(compilation):
+    tree, body, positions = full_compile(compilation.text)
+    assert describe(compilation.ftree) == tree
+    assert compilation.ast.graph.body == body
+    assert [[(name.value, name.line, name.column) for name in statement.names]
+            for statement in compilation.statements] == positions
+
+
+@pytest.fixture(autouse=True)
+def quiet_logs():
+    logging.disable(logging.CRITICAL)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+@pytest.fixture
+def source():
+    with open(os.path.join(EXAMPLES, "test2.txt"), encoding="utf-8") as file:
+        return file.read().rstrip("\n")
+
+
+def test_initial_compilation(source):
+    compilation = IncrementalCompilation(source, ast_graph_factory=RecordingGraph)
+    assert_same_as_full(compilation)
+
+
+@pytest.mark.parametrize("edit", [
+    # Lignes vides, commentaire et espaces : positions décalées
+    (2, 1, ""),
+    (3, 2, "// commentaire\n"),
+    (2, 2, "   AntoineBREESE (29/05/2001 - ) ;"),
+    # Nouvelle racine, homonyme, mariage et filiation ajoutés
+    (2, 1, "ZoeMARTIN(01/01/1990-);"),
+    (3, 2, "AntoineBREESE(01/01/1800-);"),
+    (39, 38, "AntoineBREESE <=> MarineBREESE (01/02/2020);"),
+    (39, 38, "MarineBREESE -> AntoineBREESE;"),
+    # Deux instructions sur une ligne, instruction sur deux lignes
+    (3, 4, "MarineBREESE(10/08/1998-); GenevieveBREESE(26/05/1959-);"),
+    (2, 2, "AntoineBREESE\n(29/05/2001-);"),
+])
+def test_edit_matches_full_compilation(source, edit):
+    compilation = IncrementalCompilation(source, ast_graph_factory=RecordingGraph)
+    compilation.edit(*edit)
+    assert_same_as_full(compilation)
+
+
+def test_removed_link_is_undone(source):
+    compilation = IncrementalCompilation(source, ast_graph_factory=RecordingGraph)
+    line = next(index for index, line in enumerate(compilation.lines, 1) if "<=>" in line)
+    compilation.edit(line, line, "")
+    assert_same_as_full(compilation)
+
+
+def test_error_is_the_full_compilation_error(source):
+    compilation = IncrementalCompilation(source, ast_graph_factory=RecordingGraph)
+    with pytest.raises(ParsingException) as incremental_error:
+        compilation.edit(3, 2, "InconnuX -> AntoineBREESE;")
+    with pytest.raises(ParsingException) as full_error:
+        full_compile(compilation.text)
+    assert str(incremental_error.value) == str(full_error.value)
+    # La modification suivante recompile le source corrigé
+    compilation.edit(3, 3, "")
+    assert_same_as_full(compilation)
+
+
+def test_random_edits(source):
+    rng = random.Random(0)
+    compilation = IncrementalCompilation(source, ast_graph_factory=RecordingGraph)
+    for step in range(150):
+        lines = list(compilation.lines)
+        index = rng.randint(2, len(lines) - 1)
+        names = sorted({line.split("(")[0].strip() for line in lines if "(" in line})
+        edit = rng.choice([
+            (index, index - 1, ""),
+            (index, index, ""),
+            (index, index - 1, lines[index - 1]),
+            (index, index, "  " + lines[index - 1]),
+            (index, index - 1, "Nouveau" + "ABCDEFGHIJ"[step % 10] * (1 + step // 10) + "(02/03/1950-);"),
+            (len(lines), len(lines) - 1, " <=> ".join(rng.sample(names, 2)) + ";"),
+            (len(lines), len(lines) - 1, " -> ".join(rng.sample(names, 2)) + ";"),
+        ])
+        try:
+            compilation.edit(*edit)
+        except (ParsingException, FamilyTreeException) as err:
+            with pytest.raises((ParsingException, FamilyTreeException)) as full_error:
+                full_compile(compilation.text)
+            assert str(full_error.value) == str(err)
+            compilation.edit(1, len(compilation.lines), "\n".join(lines))
+        assert_same_as_full(compilation)
@@ -0,0 +1,64 @@
+# -*- encoding: utf-8 -*-
+
+import pytest
+
+from FamilyTree import FamilyTree, FamilyTreeException
+from kinship import KinshipIndex
+from Person import Person
+
+
+@pytest.fixture
+def family():
+    """
+    Deux grands-parents, leurs deux enfants (Marc marié à Julie) et leurs petits-enfants :
+    Lea et Tom (enfants de Marc et Julie) et Noe (enfant de Claire)
+    """
+    tree = FamilyTree()
+    persons = {name: Person(tree, name, f"01/01/{year}", None) for name, year in
+               [("Jean", 1900), ("Anne", 1902), ("Marc", 1930), ("Claire", 1932), ("Julie", 1931),
+                ("Lea", 1960), ("Tom", 1962), ("Noe", 1965)]}
+    tree.racine = persons["Jean"]
+    persons["Jean"].define_mariage_link(persons["Anne"], None)
+    persons["Jean"].define_familial_link(persons["Marc"])
+    persons["Jean"].define_familial_link(persons["Claire"])
+    persons["Marc"].define_mariage_link(persons["Julie"], None)
+    persons["Marc"].define_familial_link(persons["Lea"])
+    persons["Marc"].define_familial_link(persons["Tom"])
+    persons["Claire"].define_familial_link(persons["Noe"])
+    return tree, persons
+
+
+def test_queries(family):
+    tree, persons = family
+    index = KinshipIndex(tree).build()
+    assert index.is_ancestor(persons["Jean"], persons["Lea"])
+    assert not index.is_ancestor(persons["Julie"], persons["Noe"])
+    assert index.ancestor_depths(persons["Lea"]) == {persons["Marc"]: 1, persons["Julie"]: 1,
+                                                      persons["Jean"]: 2, persons["Anne"]: 2}
+    nearest = index.nearest_common_ancestors(persons["Lea"], persons["Noe"])
+    assert {(ancestor.name, depths) for ancestor, depths in nearest} == {("Jean", (2, 2)), ("Anne", (2, 2))}
+    assert index.cousinship(persons["Lea"], persons["Noe"]) == (1, 0)
+    assert index.cousinship(persons["Lea"], persons["Tom"]) == (0, 0)
+    assert index.cousinship(persons["Marc"], persons["Noe"]) == (0, 1)
+    assert index.cousinship(persons["Julie"], persons["Noe"]) is None
+    assert index.descendants(persons["Claire"]) == {persons["Noe"]}
+
+
+def test_siblings_share_their_closure(family):
+    tree, persons = family
+    index = KinshipIndex(tree).build()
+    assert index.closure(persons["Lea"]) is index.closure(persons["Tom"])
+    assert index.closure(persons["Lea"]) is not index.closure(persons["Noe"])
+
+
+def test_added_link_updates_the_index(family):
+    tree, persons = family
+    index = KinshipIndex(tree).build()
+    assert index.nearest_common_ancestors(persons["Julie"], persons["Noe"]) == []
+    index.add_familial_link(persons["Julie"], persons["Claire"])
+    assert index.is_ancestor(persons["Julie"], persons["Noe"])
+    assert index.ancestor_depths(persons["Noe"])[persons["Julie"]] == 2
+    # Lea et Tom ne sont pas concernés : leur fermeture partagée reste valide
+    assert index.closure(persons["Lea"]) is index.closure(persons["Tom"])
+    with pytest.raises(FamilyTreeException):
+        index.add_familial_link(persons["Noe"], persons["Julie"])
@@ -0,0 +1,56 @@
+# -*- encoding: utf-8 -*-
+
+import os
+
+import pytest
+
+from diagnostics import Diagnostics
+from lexer import Lexer, LexerException
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+
+
+def lexems_of(iterable):
+    return [(lexem.tag, lexem.value, lexem.line, lexem.column) for lexem in iterable]
+
+
+@pytest.fixture
+def large_source(tmp_path):
+    with open(os.path.join(EXAMPLES, "test2.txt"), encoding="utf-8") as file:
+        text = file.read()
+    path = tmp_path / "large.txt"
+    # Assez de lignes pour une vingtaine de morceaux de 4 Ko
+    path.write_text(text * 60, encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("engine", ["master", "legacy"])
+def test_parallel_lexing_matches_sequential(large_source, engine):
+    sequential = lexems_of(Lexer(engine).iter_lex_file(large_source))
+    parallel = lexems_of(Lexer(engine).iter_lex_file_parallel(large_source, workers=2, chunk_size=4096))
+    assert parallel == sequential
+
+
+def test_parallel_lexing_reports_errors_in_order(large_source, tmp_path):
+    with open(large_source, encoding="utf-8") as file:
+        lines = file.read().split("\n")
+    lines[10] = "Pierre# (01/01/1900-);"
+    lines[-100] = "§ Marie (01/01/1900-);"
+    path = tmp_path / "errors.txt"
+    path.write_text("\n".join(lines), encoding="utf-8")
+
+    sequential_diagnostics, parallel_diagnostics = Diagnostics(None), Diagnostics(None)
+    sequential = lexems_of(Lexer(diagnostics=sequential_diagnostics).iter_lex_file(str(path)))
+    parallel = lexems_of(Lexer(diagnostics=parallel_diagnostics)
+                         .iter_lex_file_parallel(str(path), workers=2, chunk_size=4096))
+    assert parallel == sequential
+    assert [diagnostic.to_dict() for diagnostic in parallel_diagnostics] == \
+           [diagnostic.to_dict() for diagnostic in sequential_diagnostics]
+    assert len(parallel_diagnostics) == 2
+
+    # Sans collecteur, l'erreur est levée après les lexèmes qui la précèdent
+    lexems = []
+    with pytest.raises(LexerException):
+        for lexem in Lexer().iter_lex_file_parallel(str(path), workers=2, chunk_size=4096):
+            lexems.append(lexem)
+    assert lexems_of(lexems) == [lexem for lexem in sequential if lexem[2] < 11]
@@ -0,0 +1,34 @@
+# -*- encoding: utf-8 -*-
+
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from server import CompileServer, TreeStore
+
+# Implexe : G est à la fois parent et grand-parent de X
+COLLAPSE = """family_tree {
+G(01/01/1900-);
+P(01/01/1930-);
+X(01/01/1960-);
+G -> P;
+P -> X;
+G -> X;
+}"""
+
+
+def run_requests(*requests):
+    async def run():
+        with ThreadPoolExecutor(1) as executor:
+            server = CompileServer(TreeStore(executor))
+            return [await server.dispatch(dict(request)) for request in requests]
+    return asyncio.run(run())
+
+
+def test_generation_conflicts_survive_the_columnar_transfer():
+    compiled, generations = run_requests({"op": "compile", "source": COLLAPSE},
+                                         {"op": "generations", "source": COLLAPSE})
+    assert compiled["generation_conflicts"] == 1
+    assert generations["cached"]
+    conflicts = json.loads(generations["conflicts"].data)
+    assert conflicts == [["X", -1, -2]]
@@ -0,0 +1,123 @@
+# -*- encoding: utf-8 -*-
+
+import pytest
+
+from columns import TreeColumns
+from FamilyTree import FamilyTree
+from lexer import Lexer
+from p4rser import Parser
+from Person import Person
+from validation import (CHILD_BEFORE_PARENT, DEATH_BEFORE_BIRTH, UNKNOWN_PARENT, WEDDING_AFTER_DEATH,
+                        find_inconsistencies, validate_tree)
+
+
+@pytest.fixture(params=[False, True], ids=["python", "numpy"])
+def use_numpy(request):
+    if request.param:
+        pytest.importorskip("numpy")
+    return request.param
+
+
+def build_tree():
+    """
+    Arbre construit à la main : une personne morte avant sa naissance (Paul), un enfant né
+    avant son parent (Louis), un mariage après le décès du conjoint (Anne et Jean) et
+    un enfant dont un seul parent est connu (Louis)
+    """
+    tree = FamilyTree()
+    jean = Person(tree, "Jean", "01/01/1900", "01/01/1950")
+    anne = Person(tree, "Anne", "01/01/1905", None)
+    paul = Person(tree, "Paul", "01/01/1930", "01/01/1920")
+    louis = Person(tree, "Louis", "01/01/1890", None)
+    tree.racine = jean
+    anne.define_mariage_link(jean, "01/01/1960")
+    jean.spouse = None
+    paul.define_familial_link(louis)
+    return tree
+
+
+def test_inconsistencies_of_hand_built_tree(use_numpy):
+    results = find_inconsistencies(TreeColumns.from_tree(build_tree()), use_numpy)
+    # Identifiants : Jean 0, Anne 1, Paul 2, Louis 3
+    assert results[DEATH_BEFORE_BIRTH] == [(2, None)]
+    assert results[CHILD_BEFORE_PARENT] == [(3, 2)]
+    assert results[WEDDING_AFTER_DEATH] == [(1, 0)]
+    assert results[UNKNOWN_PARENT] == [(3, 2)]
+
+
+def test_links_declared_by_both_spouses_are_counted_once(use_numpy):
+    tree = FamilyTree()
+    father = Person(tree, "Pierre", "20/12/1958", None)
+    mother = Person(tree, "Genevieve", "26/05/1959", None)
+    child = Person(tree, "Antoine", "29/05/1950", None)
+    tree.racine = father
+    father.define_mariage_link(mother, "08/08/1981")
+    father.define_familial_link(child)
+    mother.define_familial_link(child)
+    results = find_inconsistencies(TreeColumns.from_tree(tree), use_numpy)
+    assert results[CHILD_BEFORE_PARENT] == [(2, 0), (2, 1)]
+    assert results[UNKNOWN_PARENT] == []
+
+
+def test_two_unmarried_parents_are_both_known(use_numpy):
+    tree = FamilyTree()
+    father = Person(tree, "Pierre", "20/12/1958", None)
+    mother = Person(tree, "Genevieve", "26/05/1959", None)
+    child = Person(tree, "Antoine", "29/05/2001", None)
+    tree.racine = father
+    father.define_familial_link(child)
+    mother.define_familial_link(child)
+    assert child.parents == [father, mother]
+    assert not validate_tree(tree, use_numpy=use_numpy)
+
+
+def test_consistent_tree_has_no_diagnostic(use_numpy):
+    tree = FamilyTree()
+    father = Person(tree, "Pierre", "20/12/1958", None)
+    mother = Person(tree, "Genevieve", "26/05/1959", None)
+    tree.racine = father
+    father.define_mariage_link(mother, "08/08/1981")
+    father.define_familial_link(Person(tree, "Antoine", "29/05/2001", None))
+    assert not validate_tree(tree, use_numpy=use_numpy)
+
+
+def test_diagnostics_name_the_persons(use_numpy):
+    diagnostics = validate_tree(build_tree(), use_numpy=use_numpy)
+    found = {(diagnostic.check, diagnostic.to_dict()["person_name"]) for diagnostic in diagnostics}
+    assert found == {(DEATH_BEFORE_BIRTH, "Paul"), (CHILD_BEFORE_PARENT, "Louis"),
+                     (WEDDING_AFTER_DEATH, "Anne"), (UNKNOWN_PARENT, "Louis")}
+    severities = {diagnostic.check: diagnostic.severity for diagnostic in diagnostics}
+    assert severities[UNKNOWN_PARENT] == "warning"
+    assert severities[CHILD_BEFORE_PARENT] == "error"
+    unknown = [diagnostic for diagnostic in diagnostics if diagnostic.check == UNKNOWN_PARENT]
+    assert unknown[0].to_dict()["other_name"] == "Paul"
+
+
+SOURCE = """family_tree{
+Pierre(20/12/1958-);
+Genevieve(26/05/1959-);
+Antoine(29/05/2001-);
+Marine(10/08/1998-);
+Claire(05/02/1990-);
+Lucie(12/01/1996-);
+Pierre -> Claire;
+Genevieve <=> Pierre(20/12/1974);
+Pierre -> Antoine;
+Genevieve -> Antoine;
+Marine <=> Pierre;
+Pierre -> Lucie;
+}"""
+
+
+def test_columns_kept_by_the_parser(use_numpy):
+    parser = Parser(Lexer().lex(SOURCE.splitlines()), build_ast=False, keep_columns=True)
+    ftree, _ = parser.parse()
+    columns, from_tree = parser.columns(), TreeColumns.from_tree(ftree)
+    for name in ("names", "birth", "death", "wedding", "spouse", "parent_offsets", "parent_ids",
+                 "child_offsets", "child_ids", "racine"):
+        assert getattr(columns, name) == getattr(from_tree, name), name
+    results = find_inconsistencies(columns, use_numpy)
+    assert results == find_inconsistencies(from_tree, use_numpy)
+    # Claire est née avant le mariage de Pierre ; Lucie, après son remariage avec Marine
+    assert results[UNKNOWN_PARENT] == [(4, 0)]
+    assert ftree.persons[5].parents == [ftree.persons[0], ftree.persons[3]]
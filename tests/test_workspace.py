@@ -0,0 +1,66 @@
+# -*- encoding: utf-8 -*-
+
+import logging
+
+import pytest
+
+from workspace import Workspace
+
+
+@pytest.fixture(autouse=True)
+def quiet_logs():
+    logging.disable(logging.CRITICAL)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+def merge(*sources):
+    workspace = Workspace()
+    for source in sources:
+        workspace.load_text(source)
+    return workspace, workspace.merge()
+
+
+def test_merged_marriage_is_set_on_both_spouses():
+    workspace, tree = merge("family_tree { A(01/01/1950-); B(01/01/1952-); }",
+                            "family_tree { A(01/01/1950-); B(01/01/1952-); A <=> B (01/06/1975); }")
+    a, b = tree.get_person("A"), tree.get_person("B")
+    assert a.spouse is b and b.spouse is a
+    assert a.wedding_date == b.wedding_date is not None
+    assert workspace.conflicts == []
+
+
+def test_conflicting_spouse_is_recorded_for_both_persons():
+    workspace, tree = merge("family_tree { A(01/01/1950-); B(01/01/1952-); A <=> B; }",
+                            "family_tree { A(01/01/1950-); C(01/01/1953-); A <=> C (01/06/1975); }")
+    a, b, c = tree.get_person("A"), tree.get_person("B"), tree.get_person("C")
+    # Le premier mariage est conservé des deux côtés, le second n'est reporté sur personne ;
+    # seul A a deux conjoints différents selon les arbres
+    assert a.spouse is b and b.spouse is a
+    assert c.spouse is None and c.wedding_date is None
+    assert [(name, attribute, kept, rejected) for name, _, attribute, kept, rejected in workspace.conflicts] == \
+        [("A", "spouse", "B", "C")]
+
+
+def test_merging_a_single_tree_keeps_it_unchanged():
+    source = """family_tree {
+    A(01/01/1950-); B(01/01/1952-); C(01/01/1953-); D(01/01/1980-); E(01/01/1985-);
+    A <=> B (01/06/1975);
+    A -> D;
+    B <=> C (01/06/1982);
+    C -> E;
+    }"""
+    workspace = Workspace()
+    original, = workspace.load_text(source)
+    tree = workspace.merge()
+    assert workspace.conflicts == []
+
+    def describe(ftree):
+        def name(person):
+            return None if person is None else person.name
+        return [(person.name, person.birthdate, person.deathdate, name(person.spouse), person.wedding_date,
+                 [name(parent) for parent in person.parents], [name(child) for child in person.children])
+                for person in ftree.persons]
+    assert describe(tree) == describe(original)
+    # Après le remariage de B, A désigne toujours B
+    assert tree.get_person("A").spouse.name == "B" and tree.get_person("B").spouse.name == "C"